@@ -0,0 +1,338 @@
+# Local stand-in for a 3x-ui panel (legacy xui/* API) for benchmarks and load tests.
+#
+#   python bench/fake_panel.py --panels 3 --inbounds 4 --clients 500 --latency-ms 40 --error-rate 0.01 --dead 1
+#
+# Prints an ALL_PANELS_CONFIG-style JSON block for the started panels and serves until Ctrl+C.
+# Implemented endpoints: /login, xui/inbound/list, addClient, update/{id}, updateClient/{clientId},
+# {id}/delClient/{clientId}, {id}/resetClientTraffic/{email} and onlines.
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import secrets
+import argparse
+import threading
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Union
+
+GB = 1073741824
+SESSION_COOKIE = '3x-ui'
+
+# (protocol, port, remark) for every inbound INBOUND_MAPPING knows, trial inbound first
+def default_inbound_specs() -> List[tuple]:
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import main
+    specs = [('vless', main.REQUIRED_PORT, main.REQUIRED_REMARK)]
+    for protocol, tiers in main.INBOUND_MAPPING.items():
+        for tier, mapping in tiers.items():
+            specs.append((protocol, mapping['port'], mapping['remark']))
+    return specs
+
+def make_client(protocol: str, email: str, expiry_ms: int, total_gb: int, rng: random.Random) -> Dict[str, Any]:
+    client = {
+        'email': email, 'enable': True, 'expiryTime': expiry_ms, 'totalGB': total_gb * GB,
+        'limitIp': 0, 'tgId': '', 'subId': secrets.token_hex(8), 'reset': 0,
+    }
+    if protocol in ('vless', 'vmess'):
+        client['id'] = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        client['flow'] = ''
+    else:
+        client['password'] = secrets.token_urlsafe(12)
+        if protocol == 'shadowsocks':
+            client['method'] = 'chacha20-ietf-poly1305'
+    return client
+
+def client_key(protocol: str, client: Dict[str, Any]) -> str:
+    if protocol in ('vless', 'vmess'):
+        return client.get('id', '')
+    if protocol == 'trojan':
+        return client.get('password', '')
+    return client.get('email', '')
+
+# Inbounds as xui/inbound/list returns them. expired_ratio of the clients have an expiry in the past.
+def make_inbounds(panel_no: int, inbound_specs: List[tuple], inbounds: int, clients: int,
+                  expired_ratio: float = 0.1, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = random.Random(seed * 1000 + panel_no)
+    now_ms = int(time.time() * 1000)
+    result = []
+    for position in range(inbounds):
+        protocol, port, remark = inbound_specs[position % len(inbound_specs)]
+        inbound_id = position + 1
+        client_list = []
+        for k in range(clients):
+            expired = rng.random() < expired_ratio
+            expiry_ms = now_ms - rng.randint(1, 30) * 86400000 if expired else now_ms + rng.randint(1, 60) * 86400000
+            client_list.append(make_client(protocol, f'p{panel_no}i{inbound_id}c{k}', expiry_ms, rng.choice((50, 150, 250)), rng))
+        result.append({
+            'id': inbound_id, 'up': 0, 'down': 0, 'total': 0, 'remark': remark, 'enable': True,
+            'expiryTime': 0, 'listen': '', 'port': port, 'protocol': protocol, 'tag': f'inbound-{port}',
+            'settings': json.dumps({'clients': client_list, 'decryption': 'none', 'fallbacks': []}),
+            'streamSettings': json.dumps({'network': 'tcp', 'security': 'none'}),
+            'sniffing': json.dumps({'enabled': True, 'destOverride': ['http', 'tls']}),
+            'clientStats': [
+                {'id': k + 1, 'inboundId': inbound_id, 'enable': True, 'email': c['email'],
+                 'up': rng.randint(0, 20) * GB, 'down': rng.randint(0, 80) * GB,
+                 'expiryTime': c['expiryTime'], 'total': c['totalGB'], 'reset': 0}
+                for k, c in enumerate(client_list)
+            ],
+        })
+    return result
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+# One fake 3x-ui panel on 127.0.0.1. latency_ms (+ up to jitter_ms) is added to every request,
+# error_rate is the fraction of requests answered with HTTP 500 and a dead panel never listens
+# (connections are refused). Request counts per endpoint are kept in `counters`.
+class FakePanel:
+    def __init__(self, inbounds: List[Dict[str, Any]], username: str = 'admin', password: str = 'admin',
+                 latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 online_ratio: float = 0.05, dead: bool = False, port: int = 0, seed: int = 0):
+        self.inbounds = inbounds
+        self.username = username
+        self.password = password
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.online_ratio = online_ratio
+        self.dead = dead
+        self.port = port or _free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.sessions: set = set()
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self.server: Union[ThreadingHTTPServer, None] = None
+
+    def start(self) -> 'FakePanel':
+        if self.dead:
+            return self
+        panel = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.reply(404, None)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload, headers = panel.handle(self.path, self.headers, body)
+                self.reply(status, payload, headers)
+
+            def reply(self, status: int, payload: Any, headers: Dict[str, str] = None):
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if data:
+                    self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def config(self, panel_type: str = 'Premium') -> Dict[str, Any]:
+        return {'url': self.url, 'username': self.username, 'password': self.password, 'type': panel_type}
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def _find_inbound(self, inbound_id: int) -> Union[Dict[str, Any], None]:
+        return next((inbound for inbound in self.inbounds if inbound['id'] == inbound_id), None)
+
+    def handle(self, path: str, headers: Any, body: bytes) -> tuple:
+        delay = self.latency_ms + (self.rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            time.sleep(delay / 1000)
+        path = urllib.parse.urlsplit(path).path.strip('/')
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self._count('error')
+            return 500, {'success': False, 'msg': 'injected error'}, None
+
+        if path == 'login':
+            self._count('login')
+            form = urllib.parse.parse_qs(body.decode())
+            if form.get('username', [''])[0] != self.username or form.get('password', [''])[0] != self.password:
+                return 200, {'success': False, 'msg': 'Invalid username or password', 'obj': None}, None
+            token = secrets.token_hex(16)
+            with self.lock:
+                self.sessions.add(token)
+            return 200, {'success': True, 'msg': 'Login Successfully', 'obj': None}, {'Set-Cookie': f'{SESSION_COOKIE}={token}; Path=/; HttpOnly'}
+
+        cookie = dict(part.strip().split('=', 1) for part in (headers.get('Cookie') or '').split(';') if '=' in part)
+        if cookie.get(SESSION_COOKIE) not in self.sessions:
+            # Newer 3x-ui answers expired sessions on API paths with 404
+            self._count('unauthorized')
+            return 404, None, None
+
+        parts = path.split('/')
+        if parts[:2] != ['xui', 'inbound'] or len(parts) < 3:
+            return 404, None, None
+        self._count(parts[3] if parts[2].isdigit() and len(parts) > 3 else parts[2])
+        request = json.loads(body) if body else {}
+
+        with self.lock:
+            if parts[2] == 'list':
+                return 200, {'success': True, 'msg': '', 'obj': json.loads(json.dumps(self.inbounds))}, None
+            if parts[2] == 'onlines':
+                emails = [stat['email'] for inbound in self.inbounds for stat in inbound['clientStats']]
+                online = [email for email in emails if self.rng.random() < self.online_ratio]
+                return 200, {'success': True, 'msg': '', 'obj': online}, None
+            if parts[2] == 'addClient':
+                return self._add_clients(request)
+            if parts[2] == 'update' and len(parts) == 4:
+                return self._update_inbound(int(parts[3]), request)
+            if parts[2] == 'updateClient' and len(parts) == 4:
+                return self._update_client(urllib.parse.unquote(parts[3]), request)
+            if parts[2].isdigit() and len(parts) == 5 and parts[3] == 'delClient':
+                return self._del_client(int(parts[2]), urllib.parse.unquote(parts[4]))
+            if parts[2].isdigit() and len(parts) == 5 and parts[3] == 'resetClientTraffic':
+                return self._reset_traffic(int(parts[2]), urllib.parse.unquote(parts[4]))
+        return 404, None, None
+
+    def _sync_stats(self, inbound: Dict[str, Any], clients: List[Dict[str, Any]]) -> None:
+        stats = {stat['email']: stat for stat in inbound['clientStats']}
+        inbound['clientStats'] = [
+            stats.get(client['email']) or {
+                'id': 0, 'inboundId': inbound['id'], 'enable': client.get('enable', True), 'email': client['email'],
+                'up': 0, 'down': 0, 'expiryTime': client.get('expiryTime', 0), 'total': client.get('totalGB', 0), 'reset': 0,
+            }
+            for client in clients
+        ]
+
+    def _add_clients(self, request: Dict[str, Any]) -> tuple:
+        inbound = self._find_inbound(int(request.get('id', 0)))
+        if inbound is None:
+            return 200, {'success': False, 'msg': 'Inbound not found'}, None
+        settings = json.loads(inbound['settings'])
+        new_clients = json.loads(request.get('settings') or '{}').get('clients', [])
+        existing = {stat['email'] for other in self.inbounds for stat in other['clientStats']}
+        for client in new_clients:
+            if client.get('email') in existing:
+                return 200, {'success': False, 'msg': f"Duplicate email: {client.get('email')}"}, None
+            existing.add(client.get('email'))
+        settings['clients'].extend(new_clients)
+        inbound['settings'] = json.dumps(settings)
+        self._sync_stats(inbound, settings['clients'])
+        return 200, {'success': True, 'msg': 'Inbound client(s) have been added.'}, None
+
+    def _update_inbound(self, inbound_id: int, request: Dict[str, Any]) -> tuple:
+        inbound = self._find_inbound(inbound_id)
+        if inbound is None:
+            return 200, {'success': False, 'msg': 'Inbound not found'}, None
+        for key, value in request.items():
+            if key not in ('id', 'clientStats'):
+                inbound[key] = value
+        self._sync_stats(inbound, json.loads(inbound['settings']).get('clients', []))
+        return 200, {'success': True, 'msg': 'Inbound has been updated.'}, None
+
+    def _update_client(self, client_id: str, request: Dict[str, Any]) -> tuple:
+        inbound = self._find_inbound(int(request.get('id', 0)))
+        replacement = (json.loads(request.get('settings') or '{}').get('clients') or [None])[0]
+        if inbound is None or replacement is None:
+            return 200, {'success': False, 'msg': 'Inbound not found'}, None
+        settings = json.loads(inbound['settings'])
+        for position, client in enumerate(settings['clients']):
+            if client_key(inbound['protocol'], client) == client_id:
+                old_email = client['email']
+                settings['clients'][position] = replacement
+                inbound['settings'] = json.dumps(settings)
+                for stat in inbound['clientStats']:
+                    if stat['email'] == old_email:
+                        stat.update(email=replacement['email'], enable=replacement.get('enable', True),
+                                    expiryTime=replacement.get('expiryTime', 0), total=replacement.get('totalGB', 0))
+                return 200, {'success': True, 'msg': 'Inbound client has been updated.'}, None
+        return 200, {'success': False, 'msg': 'Client not found'}, None
+
+    def _del_client(self, inbound_id: int, client_id: str) -> tuple:
+        inbound = self._find_inbound(inbound_id)
+        if inbound is None:
+            return 200, {'success': False, 'msg': 'Inbound not found'}, None
+        settings = json.loads(inbound['settings'])
+        remaining = [client for client in settings['clients'] if client_key(inbound['protocol'], client) != client_id]
+        if len(remaining) == len(settings['clients']):
+            return 200, {'success': False, 'msg': 'Client not found'}, None
+        settings['clients'] = remaining
+        inbound['settings'] = json.dumps(settings)
+        self._sync_stats(inbound, remaining)
+        return 200, {'success': True, 'msg': 'Inbound client has been deleted.'}, None
+
+    def _reset_traffic(self, inbound_id: int, email: str) -> tuple:
+        inbound = self._find_inbound(inbound_id)
+        for stat in (inbound or {}).get('clientStats', []):
+            if stat['email'] == email:
+                stat['up'] = stat['down'] = 0
+                return 200, {'success': True, 'msg': 'Traffic has been reset.'}, None
+        return 200, {'success': False, 'msg': 'Client not found'}, None
+
+# Start panels Premium_1..N (the last `trial` of them typed Trial, the last `dead` never listening)
+def start_fake_panels(panels: int = 3, inbounds: int = 4, clients: int = 200, latency_ms: float = 0.0,
+                      jitter_ms: float = 0.0, error_rate: float = 0.0, dead: int = 0, trial: int = 1,
+                      expired_ratio: float = 0.1, base_port: int = 0, seed: int = 0,
+                      inbound_specs: List[tuple] = None) -> Dict[str, tuple]:
+    specs = inbound_specs or default_inbound_specs()
+    started: Dict[str, tuple] = {}
+    for panel_no in range(1, panels + 1):
+        is_trial = panel_no > panels - trial
+        is_dead = panel_no <= dead
+        name = f'Trial_{panel_no}' if is_trial else f'Premium_{panel_no}'
+        panel = FakePanel(
+            make_inbounds(panel_no, specs, inbounds, clients, expired_ratio, seed),
+            latency_ms=latency_ms, jitter_ms=jitter_ms, error_rate=error_rate, dead=is_dead,
+            port=base_port + panel_no - 1 if base_port else 0, seed=seed + panel_no,
+        ).start()
+        started[name] = (panel, 'Trial' if is_trial else 'Premium')
+    return started
+
+def add_fake_panel_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--panels', type=int, default=3, help='number of fake panels')
+    parser.add_argument('--inbounds', type=int, default=4, help='inbounds per panel')
+    parser.add_argument('--clients', type=int, default=200, help='clients per inbound')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='latency added to every panel request')
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help='extra random latency, 0..jitter')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 500')
+    parser.add_argument('--dead', type=int, default=0, help='panels that refuse connections')
+    parser.add_argument('--trial', type=int, default=1, help='panels typed Trial (taken from the end)')
+    parser.add_argument('--expired-ratio', type=float, default=0.1, help='fraction of clients already expired')
+    parser.add_argument('--seed', type=int, default=0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve fake 3x-ui panels on 127.0.0.1')
+    add_fake_panel_arguments(parser)
+    parser.add_argument('--port', type=int, default=0, help='first port (consecutive ports are used)')
+    args = parser.parse_args()
+
+    fake_panels = start_fake_panels(
+        args.panels, args.inbounds, args.clients, args.latency_ms, args.jitter_ms, args.error_rate,
+        args.dead, args.trial, args.expired_ratio, args.port, args.seed,
+    )
+    print(json.dumps({name: panel.config(panel_type) for name, (panel, panel_type) in fake_panels.items()}, indent=4))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        for panel, _ in fake_panels.values():
+            panel.stop()
@@ -0,0 +1,134 @@
+# Local stand-in for the Telegram Bot API, for testing the expiry notifier without a real bot.
+#
+#   python bench/fake_telegram.py --max-per-second 30 --retry-after 2 --blocked 100005,100007
+#
+# Prints the TELEGRAM_API_BASE to use and serves until Ctrl+C. Every /bot<token>/<method> POST is
+# accepted (sendMessage, sendPhoto, ...) and recorded in `messages`. Flood control answers 429 with
+# parameters.retry_after once more than max_per_second requests arrive within one second; blocked
+# chats get 403 and error_rate of the requests get 500, like the real API.
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, List, Union
+
+from fake_panel import _free_port
+
+class FakeTelegram:
+    def __init__(self, max_per_second: float = 30.0, retry_after: int = 1, blocked_chats: set = None,
+                 error_rate: float = 0.0, latency_ms: float = 0.0, port: int = 0, seed: int = 0):
+        self.max_per_second = max_per_second
+        self.retry_after = retry_after
+        self.blocked_chats = {str(chat) for chat in (blocked_chats or ())}
+        self.error_rate = error_rate
+        self.latency_ms = latency_ms
+        self.port = port or _free_port()
+        self.url = f'http://127.0.0.1:{self.port}'
+        self.messages: List[Dict[str, Any]] = []
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        self.rng = random.Random(seed)
+        self._recent: List[float] = []
+        self.server: Union[ThreadingHTTPServer, None] = None
+
+    def start(self) -> 'FakeTelegram':
+        bot = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                status, payload = bot.handle(self.path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def handle(self, path: str, body: bytes) -> tuple:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        parts = path.strip('/').split('/')
+        if len(parts) != 2 or not parts[0].startswith('bot'):
+            self._count('not_found')
+            return 404, {'ok': False, 'error_code': 404, 'description': 'Not Found'}
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            payload = {}
+
+        now = time.monotonic()
+        with self.lock:
+            self._recent = [sent for sent in self._recent if now - sent < 1.0]
+            flooded = self.max_per_second > 0 and len(self._recent) >= self.max_per_second
+            if not flooded:
+                self._recent.append(now)
+        if flooded:
+            self._count('429')
+            return 429, {'ok': False, 'error_code': 429, 'description': f'Too Many Requests: retry after {self.retry_after}',
+                         'parameters': {'retry_after': self.retry_after}}
+        if self.error_rate and self.rng.random() < self.error_rate:
+            self._count('500')
+            return 500, {'ok': False, 'error_code': 500, 'description': 'Internal Server Error'}
+        chat_id = str(payload.get('chat_id', ''))
+        if chat_id in self.blocked_chats:
+            self._count('403')
+            return 403, {'ok': False, 'error_code': 403, 'description': 'Forbidden: bot was blocked by the user'}
+
+        with self.lock:
+            self.messages.append({'method': parts[1], 'chat_id': chat_id, 'payload': payload, 'at': time.time()})
+            message_id = len(self.messages)
+        self._count('ok')
+        return 200, {'ok': True, 'result': {'message_id': message_id, 'chat': {'id': chat_id}, 'date': int(time.time())}}
+
+def add_fake_telegram_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--max-per-second', type=float, default=30.0, help='requests per second before 429 (0 = no limit)')
+    parser.add_argument('--retry-after', type=int, default=1, help='retry_after seconds sent with 429')
+    parser.add_argument('--blocked', default='', help='comma separated chat IDs answered with 403')
+    parser.add_argument('--tg-error-rate', type=float, default=0.0, help='fraction of requests answered with HTTP 500')
+
+def fake_telegram_from_args(args: argparse.Namespace, port: int = 0) -> FakeTelegram:
+    blocked = {chat.strip() for chat in args.blocked.split(',') if chat.strip()}
+    return FakeTelegram(args.max_per_second, args.retry_after, blocked, args.tg_error_rate, port=port).start()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve a fake Telegram Bot API on 127.0.0.1')
+    add_fake_telegram_arguments(parser)
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    bot = fake_telegram_from_args(args, args.port)
+    print(f'TELEGRAM_API_BASE={bot.url}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        bot.stop()
+        print(json.dumps(bot.counters), file=sys.stderr)
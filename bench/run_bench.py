@@ -0,0 +1,217 @@
+# End-to-end benchmark: drives handle_request_route (Flask test client, no network hop on
+# the API side) against fake 3x-ui panels and reports p50/p95/p99 latency and throughput.
+#
+#   python bench/run_bench.py --panels 4 --inbounds 6 --clients 500 --latency-ms 30 --requests 300 --concurrency 16
+#   python bench/run_bench.py --save bench/baseline.json
+#   python bench/run_bench.py --compare bench/baseline.json --tolerance 0.25   # exit 1 on a regression
+#
+# Scenarios: config (account check), delexp (expired trial purge, dry run unless --delexp-live) and
+# online. --cold turns the inbound-list / online caches off so every request goes to the panels.
+# Trial creation is still a placeholder in main.py, so it has no scenario yet. A scenario with no
+# successful request only measured the error path: it is reported but left out of --save / --compare.
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Callable
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+# Keep the traffic history database of the checkout untouched
+_WORK_DIR = tempfile.mkdtemp(prefix='v2ray-api-bench-')
+os.environ['TRAFFIC_DB_FILE'] = os.path.join(_WORK_DIR, 'traffic_history.db')
+
+import main
+from fake_panel import start_fake_panels, add_fake_panel_arguments, client_key
+
+SCENARIOS = ('config', 'delexp', 'online')
+
+# Point main.py at the fake panels (same split into PREMIUM_PANELS / TRIAL_PANELS as at import)
+def configure_panels(fake_panels: Dict[str, tuple]) -> None:
+    main.ALL_PANELS_CONFIG.clear()
+    main.PREMIUM_PANELS.clear()
+    del main.TRIAL_PANELS[:]
+    for name, (panel, panel_type) in fake_panels.items():
+        config = panel.config(panel_type)
+        main.ALL_PANELS_CONFIG[name] = config
+        panel_data = {'name': name, 'config': {key: config[key] for key in ('url', 'username', 'password')}}
+        if panel_type == 'Premium':
+            main.PREMIUM_PANELS[len(main.PREMIUM_PANELS) + 1] = panel_data
+        else:
+            main.TRIAL_PANELS.append(panel_data)
+
+    main.DYNAMIC_PANELS_FILE = os.path.join(_WORK_DIR, 'dynamic_panels.json')
+    main.RATE_LIMIT_DB_FILE = ''
+    main.RATE_LIMIT_REQUESTS_PER_MINUTE = 10 ** 9
+
+def disable_caches() -> None:
+    main.INBOUND_LIST_FRESH_SECONDS = 0
+    main.INBOUND_LIST_MAX_STALE_SECONDS = 0
+    main.ONLINE_USERS_CACHE_TTL = 0
+    main.CLIENT_INDEX_TTL = 0
+
+# Config strings to check: client emails, vless:// links, and unknown names for misses
+def config_queries(fake_panels: Dict[str, tuple], miss_ratio: float, rng: random.Random) -> Callable[[int], str]:
+    known = []
+    for panel, _ in fake_panels.values():
+        for inbound in panel.inbounds:
+            for client in json.loads(inbound['settings'])['clients']:
+                if inbound['protocol'] == 'vless':
+                    known.append(f"vless://{client_key('vless', client)}@bench.example.com:{inbound['port']}?type=tcp#{client['email']}")
+                known.append(client['email'])
+
+    def make_path(i: int) -> str:
+        config = f'missing_{i}' if rng.random() < miss_ratio else rng.choice(known)
+        return '/?config=' + urllib.parse.quote(config)
+    return make_path
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest-rank percentile
+    rank = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[rank]
+
+def panel_counters(fake_panels: Dict[str, tuple]) -> Dict[str, int]:
+    totals: Dict[str, int] = {}
+    for panel, _ in fake_panels.values():
+        with panel.lock:
+            for name, count in panel.counters.items():
+                totals[name] = totals.get(name, 0) + count
+    return totals
+
+def run_scenario(make_path: Callable[[int], str], requests: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    local = threading.local()
+
+    def one(i: int) -> tuple:
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = main.app.test_client()
+        started = time.perf_counter()
+        response = client.get(make_path(i))
+        elapsed = time.perf_counter() - started
+        try:
+            ok = response.status_code == 200 and bool(json.loads(response.data).get('success'))
+        except ValueError:
+            ok = False
+        return elapsed, ok
+
+    for i in range(warmup):
+        one(-1 - i)
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        samples = list(executor.map(one, range(requests)))
+    wall = time.perf_counter() - wall_started
+
+    latencies = sorted(elapsed for elapsed, _ in samples)
+    return {
+        'requests': requests,
+        'ok': sum(1 for _, ok in samples if ok),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'max_ms': round((latencies[-1] if latencies else 0) * 1000, 2),
+        'throughput_rps': round(requests / wall, 1) if wall else 0.0,
+    }
+
+def print_report(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'scenario':<10}{'requests':>9}{'ok':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'req/s':>10}   panel requests")
+    for name, result in results.items():
+        calls = ' '.join(f'{endpoint}={count}' for endpoint, count in sorted(result['panel_requests'].items()))
+        print(f"{name:<10}{result['requests']:>9}{result['ok']:>7}{result['p50_ms']:>10}{result['p95_ms']:>10}"
+              f"{result['p99_ms']:>10}{result['max_ms']:>10}{result['throughput_rps']:>10}   {calls}")
+
+# Scenarios whose p95 grew, or throughput dropped, by more than `tolerance` against a saved run
+def find_regressions(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if before['p95_ms'] and result['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95_ms']} ms -> {result['p95_ms']} ms")
+        if before['throughput_rps'] and result['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {before['throughput_rps']} -> {result['throughput_rps']} req/s")
+    return regressions
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description='Benchmark the API against fake 3x-ui panels')
+    add_fake_panel_arguments(parser)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated: ' + ', '.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent API requests')
+    parser.add_argument('--warmup', type=int, default=3, help='unmeasured requests per scenario (logins, first downloads)')
+    parser.add_argument('--miss-ratio', type=float, default=0.1, help='fraction of config checks for unknown accounts')
+    parser.add_argument('--cold', action='store_true', help='disable the inbound-list and online caches')
+    parser.add_argument('--delexp-live', action='store_true', help='really delete expired trial clients')
+    parser.add_argument('--save', help='write results as JSON to this file')
+    parser.add_argument('--compare', help='baseline JSON from --save; exit 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression for --compare')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+
+    fake_panels = start_fake_panels(
+        args.panels, args.inbounds, args.clients, args.latency_ms, args.jitter_ms, args.error_rate,
+        args.dead, args.trial, args.expired_ratio, seed=args.seed,
+    )
+    configure_panels(fake_panels)
+    if args.cold:
+        disable_caches()
+
+    rng = random.Random(args.seed)
+    paths = {
+        'config': config_queries(fake_panels, args.miss_ratio, rng),
+        'delexp': lambda i: '/?delexp' if args.delexp_live else '/?delexp&dry_run=1',
+        'online': lambda i: '/?online',
+    }
+
+    print(f'{args.panels} panels ({args.dead} dead, {args.trial} trial) x {args.inbounds} inbounds x {args.clients} clients, '
+          f'latency {args.latency_ms}+{args.jitter_ms} ms, error rate {args.error_rate}, '
+          f'concurrency {args.concurrency}, caches {"off" if args.cold else "on"}')
+
+    results: Dict[str, Dict[str, Any]] = {}
+    for name in scenarios:
+        before = panel_counters(fake_panels)
+        results[name] = run_scenario(paths[name], args.requests, args.concurrency, args.warmup)
+        after = panel_counters(fake_panels)
+        results[name]['panel_requests'] = {key: after[key] - before.get(key, 0) for key in after if after[key] != before.get(key, 0)}
+
+    print_report(results)
+
+    for panel, _ in fake_panels.values():
+        panel.stop()
+
+    failed = [name for name, result in results.items() if result['requests'] and not result['ok']]
+    for name in failed:
+        print(f'WARNING {name}: no request succeeded, left out of --save / --compare')
+    results = {name: result for name, result in results.items() if name not in failed}
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print('REGRESSION ' + line)
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
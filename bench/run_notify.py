@@ -0,0 +1,96 @@
+# Expiry notifier run against fake trial panels and the fake Bot API: queues notifications with
+# ?notify_expiry, keeps calling ?notify_send until the queue is empty and checks that every chat got
+# exactly one message, that the send rate stayed under the configured limit and that a second scan
+# queues nothing.
+#
+#   python bench/run_notify.py --panels 2 --trial 2 --inbounds 1 --clients 2000 --expiring-ratio 0.3 --rate 25 --max-per-second 20
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+_WORK_DIR = tempfile.mkdtemp(prefix='v2ray-api-notify-')
+os.environ['TRAFFIC_DB_FILE'] = os.path.join(_WORK_DIR, 'traffic_history.db')
+os.environ['NOTIFY_DB_FILE'] = os.path.join(_WORK_DIR, 'notifications.db')
+
+import main
+from fake_panel import start_fake_panels, add_fake_panel_arguments
+from fake_telegram import add_fake_telegram_arguments, fake_telegram_from_args
+from run_bench import configure_panels
+
+# Trial inbound clients get Telegram chat IDs (tgId); expiring_ratio of them expire inside the window
+def prepare_trial_clients(fake_panels: dict, expiring_ratio: float, seed: int) -> int:
+    rng = random.Random(seed)
+    now_ms = int(time.time() * 1000)
+    chat_id = 100000
+    for panel, panel_type in fake_panels.values():
+        if panel_type != 'Trial':
+            continue
+        for inbound in panel.inbounds:
+            if int(inbound['port']) != main.REQUIRED_PORT:
+                continue
+            settings = json.loads(inbound['settings'])
+            for client in settings['clients']:
+                client['tgId'] = chat_id
+                chat_id += 1
+                if rng.random() < expiring_ratio:
+                    client['expiryTime'] = now_ms + rng.randint(1, main.NOTIFY_EXPIRY_DAYS * 24) * 3600000
+            inbound['settings'] = json.dumps(settings)
+    return chat_id - 100000
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description='Run the expiry notifier against fake panels and a fake Bot API')
+    add_fake_panel_arguments(parser)
+    add_fake_telegram_arguments(parser)
+    parser.add_argument('--expiring-ratio', type=float, default=0.1, help='fraction of trial clients expiring inside NOTIFY_EXPIRY_DAYS')
+    parser.add_argument('--rate', type=float, default=main.NOTIFY_MESSAGES_PER_SECOND, help='NOTIFY_MESSAGES_PER_SECOND')
+    parser.add_argument('--budget', type=float, default=5.0, help='NOTIFY_SEND_BUDGET_SECONDS per call')
+    args = parser.parse_args()
+
+    fake_panels = start_fake_panels(args.panels, args.inbounds, args.clients, args.latency_ms, args.jitter_ms,
+                                    args.error_rate, args.dead, args.trial, args.expired_ratio, seed=args.seed)
+    chats = prepare_trial_clients(fake_panels, args.expiring_ratio, args.seed)
+    bot = fake_telegram_from_args(args)
+    configure_panels(fake_panels)
+    main.TELEGRAM_API_BASE = bot.url
+    main.NOTIFY_MESSAGES_PER_SECOND = args.rate
+    main.NOTIFY_SEND_BUDGET_SECONDS = args.budget
+    client = main.app.test_client()
+
+    started = time.monotonic()
+    scan = json.loads(client.get('/?notify_expiry').data)['data']
+    print(f"{chats} trial chats: found {scan.get('found')} ({scan.get('expiring')} expiring, {scan.get('expired')} expired), queued {scan.get('queued')}")
+    calls = [scan.get('delivery', {})]
+    while calls[-1].get('pending'):
+        calls.append(json.loads(client.get('/?notify_send').data)['data'])
+        if not any(calls[-1].get(key) for key in ('sent', 'rejected', 'failed', 'retried', 'throttled')):
+            time.sleep(0.5)
+    elapsed = time.monotonic() - started
+
+    totals = {key: sum(call.get(key, 0) for call in calls) for key in ('sent', 'rejected', 'failed', 'retried', 'throttled')}
+    delivered = [message['chat_id'] for message in bot.messages]
+    print(f"{len(calls)} send calls in {elapsed:.1f} s: " + ' '.join(f'{key}={value}' for key, value in totals.items()))
+    print(f"fake Bot API: {json.dumps(bot.counters, sort_keys=True)}")
+
+    # Peak messages in any one-second window, as seen by the Bot API
+    times = sorted(message['at'] for message in bot.messages)
+    peak = max((sum(1 for other in times[i:] if other - at < 1.0) for i, at in enumerate(times)), default=0)
+    duplicates = len(delivered) - len(set(delivered))
+    rescan = json.loads(client.get('/?notify_expiry').data)['data']
+    print(f"peak {peak} msg/s (limit {args.rate}), duplicate deliveries {duplicates}, queued by a second scan {rescan.get('queued')}")
+
+    for panel, _ in fake_panels.values():
+        panel.stop()
+    bot.stop()
+    return 1 if duplicates or rescan.get('queued') else 0
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
@@ -0,0 +1,107 @@
+# Cold-start benchmark: fresh interpreter per run, measuring `import main`, the first request
+# (no panel traffic) and the first account check against a fake panel, plus which heavy modules
+# the import pulled in.
+#
+#   python bench/startup.py --runs 15
+#   python bench/startup.py --runs 15 --importtime      # also list the slowest imports of one run
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_panel import start_fake_panels
+
+# Modules that only some actions need; any of them loaded by `import main` costs every cold start
+HEAVY_MODULES = ('requests', 'urllib3', 'httpx', 'asyncio', 'orjson', 'cProfile', 'pstats')
+
+CHILD = r'''
+import os, sys, json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+loaded = [name for name in json.loads(os.environ['BENCH_HEAVY_MODULES']) if name in sys.modules]
+
+main.ALL_PANELS_CONFIG.clear()
+main.ALL_PANELS_CONFIG.update(json.loads(os.environ['BENCH_PANELS']))
+main.DYNAMIC_PANELS_FILE = os.path.join(os.environ['BENCH_WORK_DIR'], 'dynamic_panels.json')
+client = main.app.test_client()
+
+request_started = time.perf_counter()
+client.get('/')
+first_request = time.perf_counter() - request_started
+
+check_started = time.perf_counter()
+response = client.get('/?config=' + os.environ['BENCH_CONFIG'])
+first_check = time.perf_counter() - check_started
+print(json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'first_request_ms': first_request * 1000,
+    'first_check_ms': first_check * 1000,
+    'check_ok': bool(json.loads(response.data).get('success')),
+    'heavy_modules': loaded,
+}))
+'''
+
+def run_child(env: dict) -> dict:
+    output = subprocess.run([sys.executable, '-c', CHILD], cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def slowest_imports(env: dict, top: int) -> list:
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import main'], cwd=REPO_DIR, env=env, capture_output=True, text=True, check=True)
+    rows = []
+    for line in output.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            rows.append((int(parts[1]), parts[2].rstrip()))
+    return sorted(rows, reverse=True)[:top]
+
+def summarize(values: list) -> str:
+    ordered = sorted(values)
+    return f'median {statistics.median(ordered):7.1f} ms   min {ordered[0]:7.1f} ms   max {ordered[-1]:7.1f} ms'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure cold-start cost of main.py')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--importtime', action='store_true', help='show the slowest imports (cumulative)')
+    parser.add_argument('--save', help='write the medians as JSON to this file')
+    args = parser.parse_args()
+
+    import tempfile
+    work_dir = tempfile.mkdtemp(prefix='v2ray-api-startup-')
+    panels = start_fake_panels(panels=1, inbounds=2, clients=50, trial=0)
+    panel, panel_type = next(iter(panels.values()))
+    env = dict(
+        os.environ,
+        BENCH_PANELS=json.dumps({'Bench_1': panel.config(panel_type)}),
+        BENCH_CONFIG='p1i1c1',
+        BENCH_WORK_DIR=work_dir,
+        BENCH_HEAVY_MODULES=json.dumps(HEAVY_MODULES),
+        TRAFFIC_DB_FILE=os.path.join(work_dir, 'traffic_history.db'),
+        PYTHONDONTWRITEBYTECODE='',
+    )
+
+    results = [run_child(env) for _ in range(args.runs)]
+    print(f'{args.runs} cold starts')
+    for key, label in (('import_ms', 'import main'), ('first_request_ms', 'first request'), ('first_check_ms', 'first check')):
+        print(f'{label:<15}{summarize([result[key] for result in results])}')
+    print(f"heavy modules loaded by import: {', '.join(results[-1]['heavy_modules']) or 'none'}")
+    if not all(result['check_ok'] for result in results):
+        print('WARNING: first account check failed in some runs')
+
+    if args.importtime:
+        print('slowest imports (cumulative us):')
+        for micros, module in slowest_imports(env, 15):
+            print(f'{micros:>10}  {module}')
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({key: statistics.median(result[key] for result in results)
+                       for key in ('import_ms', 'first_request_ms', 'first_check_ms')}, f, indent=2)
+    panel.stop()
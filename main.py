@@ -1,16 +1,54 @@
 import os
+import io
+import sys
 import json
 import time
 import re
 import math
+import random
 import uuid
 import base64
+import hashlib
+import tempfile
 import urllib.parse
+import threading
+import bisect
+import hmac
+import importlib
+import contextvars
+import http.cookiejar
+from contextlib import contextmanager
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context
 from functools import wraps
 from typing import Dict, Any, List, Union, Callable
 
+try:
+    import fcntl  # POSIX advisory locking for the dynamic panels file
+except ImportError:
+    fcntl = None
+
+# Modules that only some actions need are imported on first use, so a serverless cold start
+# only pays for Flask: requests (panel calls), asyncio + httpx (ASGI entry point), orjson
+# (compact responses) and cProfile/pstats (debug profiles).
+requests = None
+HTTPAdapter = None
+asyncio = None
+httpx = None
+_OPTIONAL_MODULES: Dict[str, Any] = {}
+
+# Imported module, or None when the optional dependency is not installed (checked once)
+def optional_import(name: str) -> Any:
+    if name not in _OPTIONAL_MODULES:
+        try:
+            _OPTIONAL_MODULES[name] = importlib.import_module(name)
+        except ImportError:
+            _OPTIONAL_MODULES[name] = None
+    return _OPTIONAL_MODULES[name]
+
 # =========================================================================
 # CONFIGURATION & CONSTANTS
 # =========================================================================
@@ -44,23 +82,38 @@ ALL_PANELS_CONFIG: Dict[str, Any] = {
 }
 
 # PHP script ၏ filtering logic အတိုင်း ပြန်လည်ခွဲထုတ်ခြင်း
-PREMIUM_PANELS: Dict[int, Any] = {}
-TRIAL_PANELS: List[Any] = []
-premium_index = 1
-for name, config in ALL_PANELS_CONFIG.items():
-    panel_data = {
-        'name': name,
-        'config': {
-            'url': config['url'],
-            'username': config['username'],
-            'password': config['password'],
-        }
-    }
-    if config['type'] == 'Premium':
-        PREMIUM_PANELS[premium_index] = panel_data
-        premium_index += 1
-    elif config['type'] == 'Trial':
-        TRIAL_PANELS.append(panel_data)
+# PREMIUM_PANELS / TRIAL_PANELS are built on first use (get_panel_tables) rather than at import
+_PANEL_TABLES: Dict[str, Any] = {}
+
+def get_panel_tables() -> tuple:
+    if not _PANEL_TABLES:
+        premium_panels: Dict[int, Any] = {}
+        trial_panels: List[Any] = []
+        premium_index = 1
+        for name, config in ALL_PANELS_CONFIG.items():
+            panel_data = {
+                'name': name,
+                'config': {
+                    'url': config['url'],
+                    'username': config['username'],
+                    'password': config['password'],
+                }
+            }
+            if config['type'] == 'Premium':
+                premium_panels[premium_index] = panel_data
+                premium_index += 1
+            elif config['type'] == 'Trial':
+                trial_panels.append(panel_data)
+        _PANEL_TABLES.update(premium=premium_panels, trial=trial_panels)
+    return _PANEL_TABLES['premium'], _PANEL_TABLES['trial']
+
+# main.PREMIUM_PANELS / main.TRIAL_PANELS for code that imports this module
+def __getattr__(name: str) -> Any:
+    if name == 'PREMIUM_PANELS':
+        return get_panel_tables()[0]
+    if name == 'TRIAL_PANELS':
+        return get_panel_tables()[1]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 API_INFO = {
@@ -79,6 +132,12 @@ API_INFO = {
     ]
 }
 
+# Query parameters of read-only requests; GET requests using only these get an ETag and may get 304
+READ_ONLY_PARAMS = {
+    'config', 'online', 'stats', 'analytics', 'period', 'list_panels', 'optimal', 'type',
+    'protocol', 'tier', 'pool_stats', 'panel_health', 'compact', 'api_info',
+}
+
 # JSON File Configuration (NEW)
 DYNAMIC_PANELS_FILE = os.path.join(os.path.dirname(__file__), 'dynamic_panels.json')
 
@@ -116,25 +175,133 @@ PREMIUM_EXPIRY_TIME_MS_UNLIMITED = 0
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
 SHADOWSOCKS_METHOD = 'chacha20-ietf-poly1305'
 
-# Rate limiting configuration (In-memory cache)
+# Rate limiting configuration (sliding window counters, in-memory or shared SQLite file)
 RATE_LIMIT_REQUESTS_PER_MINUTE = 30
 RATE_LIMIT_WINDOW = 60
-RATE_LIMIT_CACHE: Dict[str, Dict[int, int]] = {}
+RATE_LIMIT_CACHE: "OrderedDict[str, list]" = OrderedDict()  # identifier -> [window_key, current_count, previous_count]
+# Set to a local file path to share counters between gunicorn workers (empty = per-process memory)
+RATE_LIMIT_DB_FILE = os.environ.get('RATE_LIMIT_DB_FILE', '')
+# How much of the per-minute budget each action uses (default 1). Override with a JSON object of
+# action -> cost in RATE_LIMIT_ACTION_COSTS; malformed values are logged and ignored.
+RATE_LIMIT_ACTION_COSTS: Dict[str, int] = {
+    'delexp': 10, 'configs': 10, 'drain': 10, 'transfer': 10, 'names': 10, 'notify_expiry': 10,
+    'collect_traffic': 5, 'notify_send': 5,
+    'stats': 2, 'analytics': 2, 'online': 2, 'sub': 2,
+}
+
+# Panel fan-out configuration (panels are queried in parallel, bounded by this setting)
+PANEL_MAX_CONCURRENCY = int(os.environ.get('PANEL_MAX_CONCURRENCY', '8'))
+
+# Panel session cache (login cookie reused per panel URL + username until TTL or auth failure)
+PANEL_SESSION_TTL = int(os.environ.get('PANEL_SESSION_TTL', '1800'))
+# A failed login is cached this long, so requests queued behind it fail fast instead of logging in again
+PANEL_LOGIN_FAILURE_TTL = float(os.environ.get('PANEL_LOGIN_FAILURE_TTL', '5'))
+PANEL_SESSION_CACHE: Dict[tuple, Dict[str, Any]] = {}
+
+# HTTP connection pooling (one keep-alive pool per panel host)
+PANEL_POOL_SIZE = int(os.environ.get('PANEL_POOL_SIZE', '10'))
+PANEL_CONNECT_TIMEOUT = float(os.environ.get('PANEL_CONNECT_TIMEOUT', '5'))
+PANEL_READ_TIMEOUT = float(os.environ.get('PANEL_READ_TIMEOUT', '15'))
+
+# Retry backoff (exponential with full jitter) and per-panel circuit breaker
+RETRY_BACKOFF_BASE_SECONDS = float(os.environ.get('RETRY_BACKOFF_BASE_SECONDS', '0.25'))
+RETRY_BACKOFF_MAX_SECONDS = float(os.environ.get('RETRY_BACKOFF_MAX_SECONDS', '4'))
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_BREAKER_FAILURE_THRESHOLD', '3'))
+CIRCUIT_BREAKER_RESET_SECONDS = float(os.environ.get('CIRCUIT_BREAKER_RESET_SECONDS', '30'))
+
+# Load-aware panel placement (scores cached briefly; lower score wins)
+PLACEMENT_SCORE_TTL = float(os.environ.get('PLACEMENT_SCORE_TTL', '10'))
+PLACEMENT_EWMA_ALPHA = 0.3
+PANEL_MAX_CLIENTS_PER_INBOUND = int(os.environ.get('PANEL_MAX_CLIENTS_PER_INBOUND', '1000'))
+PLACEMENT_WEIGHTS = {'load': 0.5, 'latency': 0.25, 'errors': 0.25}
+
+# Client location index (email/UUID/password -> panel + inbound), entries older than the TTL are stale
+CLIENT_INDEX_TTL = int(os.environ.get('CLIENT_INDEX_TTL', '600'))
+
+# Inbound list cache (stale-while-revalidate): fresh copies are served from memory, stale copies
+# are served while one background refresh runs, copies older than the max stale age are re-downloaded
+INBOUND_LIST_FRESH_SECONDS = float(os.environ.get('INBOUND_LIST_FRESH_SECONDS', '20'))
+INBOUND_LIST_MAX_STALE_SECONDS = float(os.environ.get('INBOUND_LIST_MAX_STALE_SECONDS', '300'))
+
+# Parsed inbound settings cache (LRU keyed by inbound ID + settings hash, capped by raw settings size)
+INBOUND_SETTINGS_CACHE_MAX_BYTES = int(os.environ.get('INBOUND_SETTINGS_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Online users aggregate (?online) is reused for this many seconds: one upstream sweep per window
+ONLINE_USERS_CACHE_TTL = float(os.environ.get('ONLINE_USERS_CACHE_TTL', '5'))
+
+# Expired trial purge (?delexp): maximum clients removed per run (a smaller ?limit= can be passed)
+DELEXP_MAX_PER_RUN = int(os.environ.get('DELEXP_MAX_PER_RUN', '5000'))
+
+# Traffic history store for ?analytics (SQLite, hourly + daily rollups of clientStats deltas)
+TRAFFIC_DB_FILE = os.environ.get('TRAFFIC_DB_FILE', os.path.join(os.path.dirname(__file__), 'traffic_history.db'))
+TRAFFIC_SNAPSHOT_INTERVAL = int(os.environ.get('TRAFFIC_SNAPSHOT_INTERVAL', '300'))
+TRAFFIC_HOURLY_RETENTION_DAYS = 35
+TRAFFIC_DAILY_RETENTION_DAYS = 400
+
+# Batch account check (POST {"configs": [...]}) limit per request
+BATCH_CHECK_MAX_CONFIGS = int(os.environ.get('BATCH_CHECK_MAX_CONFIGS', '500'))
+
+# Bulk premium creation (POST {"names": [...]}) limit per request, all added with one addClient
+BULK_CREATE_MAX_NAMES = int(os.environ.get('BULK_CREATE_MAX_NAMES', '500'))
+
+# Subscriptions (?sub=<user>): built links are cached per user until this API modifies the user's
+# client or the TTL runs out (changes made directly on a panel). Misses are cached for a shorter time.
+SUBSCRIPTION_CACHE_TTL = float(os.environ.get('SUBSCRIPTION_CACHE_TTL', '3600'))
+SUBSCRIPTION_MISS_TTL = float(os.environ.get('SUBSCRIPTION_MISS_TTL', '60'))
+SUBSCRIPTION_CACHE_MAX_USERS = int(os.environ.get('SUBSCRIPTION_CACHE_MAX_USERS', '50000'))
+SUBSCRIPTION_UPDATE_INTERVAL_HOURS = int(os.environ.get('SUBSCRIPTION_UPDATE_INTERVAL_HOURS', '12'))
+
+# Panel drain (POST ?drain=<from>&to_panel=<to>): clients per addClient / source inbound update, a cap on
+# clients moved per second (0 = no cap) and where resume checkpoints are kept. The checkpoint only
+# speeds up resuming: a destination client with the same email and the same id/password is always
+# recognised as an earlier copy, so a lost checkpoint (per-instance /tmp on Vercel) is harmless.
+DRAIN_BATCH_SIZE = int(os.environ.get('DRAIN_BATCH_SIZE', '100'))
+DRAIN_MAX_CLIENTS_PER_SECOND = float(os.environ.get('DRAIN_MAX_CLIENTS_PER_SECOND', '50'))
+DRAIN_CHECKPOINT_DIR = os.environ.get('DRAIN_CHECKPOINT_DIR', tempfile.gettempdir())
+
+# Prometheus metrics at /metrics (per process). METRICS_TOKEN, when set, is required as a Bearer token.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Debug requests: a matching X-Debug-Token header adds a Server-Timing header; X-Debug-Profile
+# (cprofile / sample) also profiles the request. Empty DEBUG_TOKEN disables debug mode.
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN', '')
+DEBUG_PROFILE_DIR = os.environ.get('DEBUG_PROFILE_DIR', tempfile.gettempdir())
+DEBUG_SAMPLE_INTERVAL = float(os.environ.get('DEBUG_SAMPLE_INTERVAL', '0.005'))
+DEBUG_PROFILE_TOP = 40
 
 # Notification Configuration
 # Bot token သည် sensitive ဖြစ်သဖြင့် Environment Variable တွင်ထားရန် အကြံပြုပါသည်။
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', '8007668447:AAE9RK3SCTvYVAXB8ZTQFUClCoqCAbvF9jQ')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', '-1002833902644')
+# Bot API base URL (point it at a local stand-in such as bench/fake_telegram.py for tests)
+TELEGRAM_API_BASE = os.environ.get('TELEGRAM_API_BASE', 'https://api.telegram.org')
+
+# Expiry notifications (?notify_expiry queues + sends, ?notify_send only sends): trial users expiring
+# within the next NOTIFY_EXPIRY_DAYS, or expired within the last NOTIFY_EXPIRY_DAYS, get one message
+# per expiry date. The queue and the sent-log live in SQLite; sending is paced at
+# NOTIFY_MESSAGES_PER_SECOND and one request sends for at most NOTIFY_SEND_BUDGET_SECONDS (the rest
+# stays queued for the next call). NOTIFY_DB_FILE must be writable; on Vercel the app directory is
+# read-only, so point it at persistent writable storage.
+NOTIFY_DB_FILE = os.environ.get('NOTIFY_DB_FILE', os.path.join(os.path.dirname(__file__), 'notifications.db'))
+NOTIFY_EXPIRY_DAYS = int(os.environ.get('NOTIFY_EXPIRY_DAYS', '3'))
+NOTIFY_MESSAGES_PER_SECOND = float(os.environ.get('NOTIFY_MESSAGES_PER_SECOND', '20'))
+NOTIFY_SEND_BUDGET_SECONDS = float(os.environ.get('NOTIFY_SEND_BUDGET_SECONDS', '20'))
+NOTIFY_MAX_ATTEMPTS = 5
+NOTIFY_RETRY_BASE_SECONDS = 30
+NOTIFY_CLAIM_SECONDS = 60
+NOTIFY_SENT_RETENTION_DAYS = 90
 
 # Custom Notification Constants (HTML formatting is compatible with Telegram)
 EXPIRY_NOTIFICATION_IMAGE_URL = 'https://raw.githubusercontent.com/nyeinkokoaung404/v2ray-tel-bot/main/images/404-VPN.jpg'
 MY_EXPIRY_NOTIFICATION_TEXT = "<b>VPN သက်တမ်းကုန်သွားပြီလား? 🙄</b>\n\nစိတ်မပူပါနဲ့ <b>404 VPN</b> နဲ့ဆိုရင် KBZ Pay, Wave Pay, AYA Pay တို့နဲ့ အချိန်မရွေး ပိတ်ချိန်မရှိ ၊ စောင့်ဆိုင်းစရာ ၊ စကားပြောစရာမလိုပဲ 24/7 @nkka404 မှာ သက်တမ်းတိုးလို့ရနေပြီနော်!"
 RENEWAL_INLINE_KEYBOARD = [
     [
-        [
+        {
             'text': 'ဝယ်ယူ/သက်တမ်းတိုးရန်',
             'url': 'https://t.me/nkka404?text=' + urllib.parse.quote('သက်တမ်းတိုးချင်ပါတယ်။')
-        ]
+        }
     ]
 ]
 
@@ -174,6 +341,8 @@ TRANSLATIONS = {
         'file_access_failed': 'File read/write failed',
         'expiry_soon_user': 'Your Trial account will expire in %d days. Please renew if needed.',
         'expired_user': 'Your Trial account has expired and will be deleted soon.',
+        'account_transferred': 'Account transferred successfully',
+        'panel_drained': 'Panel drain finished',
     },
     'my': {
         'account_created': 'အကောင့်အောင်မြင်စွာဖန်တီးပြီးပါပြီ',
@@ -209,6 +378,8 @@ TRANSLATIONS = {
         'file_access_failed': 'ဖိုင်ဖတ်/ရေး လုပ်ဆောင်မှု မအောင်မြင်ပါ',
         'expiry_soon_user': 'သင်၏ Trial အကောင့်သည် နောက် %d ရက်တွင် သက်တမ်းကုန်ဆုံးပါမည်။ လိုအပ်ပါက သက်တမ်းတိုးပါ။',
         'expired_user': 'သင်၏ Trial အကောင့်သည် သက်တမ်းကုန်ဆုံးသွားပြီး မကြာမီ ဖျက်လိုက်ပါမည်။',
+        'account_transferred': 'အကောင့်ကို panel အသစ်သို့ အောင်မြင်စွာပြောင်းရွှေ့ပြီးပါပြီ',
+        'panel_drained': 'Panel မှ အကောင့်များကို ပြောင်းရွှေ့ပြီးပါပြီ',
     }
 }
 
@@ -218,6 +389,28 @@ TRANSLATIONS = {
 
 app = Flask(__name__)
 
+# RATE_LIMIT_ACTION_COSTS overrides from the environment -> {action: cost}; bad input never stops startup
+def load_rate_limit_cost_overrides(raw: str) -> Dict[str, int]:
+    if not raw.strip():
+        return {}
+    try:
+        overrides = json.loads(raw)
+    except json.JSONDecodeError as e:
+        app.logger.warning(f'Ignoring RATE_LIMIT_ACTION_COSTS, not valid JSON: {e}')
+        return {}
+    if not isinstance(overrides, dict):
+        app.logger.warning('Ignoring RATE_LIMIT_ACTION_COSTS, expected a JSON object of action -> cost')
+        return {}
+    costs = {}
+    for action, cost in overrides.items():
+        if isinstance(cost, int) and not isinstance(cost, bool) and cost >= 0:
+            costs[action] = cost
+        else:
+            app.logger.warning(f'Ignoring RATE_LIMIT_ACTION_COSTS entry {action!r}: cost must be a non-negative integer')
+    return costs
+
+RATE_LIMIT_ACTION_COSTS.update(load_rate_limit_cost_overrides(os.environ.get('RATE_LIMIT_ACTION_COSTS', '')))
+
 # Helper to get client language
 def get_client_language() -> str:
     accept_lang = request.headers.get('Accept-Language', 'en')
@@ -229,6 +422,244 @@ def get_client_language() -> str:
 def t(key: str, lang: str) -> str:
     return TRANSLATIONS.get(lang, TRANSLATIONS['en']).get(key, TRANSLATIONS['en'].get(key, key))
 
+# =========================================================================
+# METRICS (Prometheus text format, served at /metrics)
+# =========================================================================
+
+METRIC_DESCRIPTIONS: Dict[str, tuple] = {
+    'v2ray_api_panel_request_seconds': ('histogram', 'One HTTP request to a panel (login or API endpoint).'),
+    'v2ray_api_panel_call_seconds': ('histogram', 'Whole api_call including retries and re-login.'),
+    'v2ray_api_settings_parse_seconds': ('histogram', 'Parsing an inbound settings blob into lookup tables (cache misses).'),
+    'v2ray_api_client_match_seconds': ('histogram', "Matching configs against one panel's inbounds."),
+    'v2ray_api_panel_retries_total': ('counter', 'Panel API attempts repeated after a failure.'),
+    'v2ray_api_panel_failures_total': ('counter', 'Panel logins and API calls that gave up.'),
+    'v2ray_api_circuit_rejections_total': ('counter', 'Panel calls skipped because the circuit breaker is open.'),
+    'v2ray_api_settings_cache_total': ('counter', 'Parsed settings cache lookups by result.'),
+    'v2ray_api_rate_limit_rejections_total': ('counter', 'Requests rejected by the rate limiter.'),
+    'v2ray_api_subscription_cache_total': ('counter', 'Subscription cache lookups by result.'),
+    'v2ray_api_notifications_total': ('counter', 'Telegram expiry notification attempts by result.'),
+}
+_METRICS_LOCK = threading.Lock()
+# (name, labels) -> [per-bucket counts..., +Inf count, sum, count]
+_METRIC_HISTOGRAMS: Dict[tuple, list] = {}
+_METRIC_COUNTERS: Dict[tuple, float] = {}
+_METRIC_PANEL_LABELS: Dict[str, str] = {}
+# Endpoint segments followed by a client ID, dropped from the endpoint label to bound cardinality
+_METRIC_ID_SEGMENTS = ('updateClient', 'delClient', 'resetClientTraffic')
+
+def observe_metric(name: str, value: float, **labels) -> None:
+    if name in TIMING_PHASES and _REQUEST_TIMINGS.get() is not None:
+        record_timing(TIMING_PHASES[name] or 'panel-' + labels['endpoint'].rsplit('/', 1)[-1], value, labels.get('panel', ''))
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(labels.items()))
+    bucket = bisect.bisect_left(METRICS_LATENCY_BUCKETS, value)
+    with _METRICS_LOCK:
+        series = _METRIC_HISTOGRAMS.get(key)
+        if series is None:
+            series = _METRIC_HISTOGRAMS[key] = [0] * (len(METRICS_LATENCY_BUCKETS) + 3)
+        series[bucket] += 1
+        series[-2] += value
+        series[-1] += 1
+
+def increment_metric(name: str, amount: float = 1, **labels) -> None:
+    if not METRICS_ENABLED:
+        return
+    key = (name, tuple(labels.items()))
+    with _METRICS_LOCK:
+        _METRIC_COUNTERS[key] = _METRIC_COUNTERS.get(key, 0) + amount
+
+def metric_panel_label(panel_url: str) -> str:
+    label = _METRIC_PANEL_LABELS.get(panel_url)
+    if label is None:
+        label = _METRIC_PANEL_LABELS[panel_url] = urllib.parse.urlsplit(panel_url).netloc or panel_url
+    return label
+
+# 'xui/inbound/3/delClient/<uuid>' -> 'xui/inbound/delClient'
+def metric_endpoint_label(endpoint: str) -> str:
+    parts = []
+    skip_next = False
+    for part in endpoint.split('/'):
+        if skip_next or part.isdigit():
+            skip_next = False
+            continue
+        parts.append(part)
+        skip_next = part in _METRIC_ID_SEGMENTS
+    return '/'.join(parts)
+
+def _metric_labels(labels: tuple, extra: str = '') -> str:
+    pairs = []
+    for name, value in labels:
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def render_metrics() -> str:
+    with _METRICS_LOCK:
+        histograms = {key: list(series) for key, series in _METRIC_HISTOGRAMS.items()}
+        counters = dict(_METRIC_COUNTERS)
+
+    lines = []
+    for name, (metric_type, description) in METRIC_DESCRIPTIONS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if metric_type == 'histogram':
+            for (series_name, labels), series in sorted(histograms.items()):
+                if series_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(METRICS_LATENCY_BUCKETS, series):
+                    cumulative += count
+                    bucket_labels = _metric_labels(labels, f'le="{bound}"')
+                    lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                bucket_labels = _metric_labels(labels, 'le="+Inf"')
+                lines.append(f'{name}_bucket{bucket_labels} {series[-1]}')
+                lines.append(f'{name}_sum{_metric_labels(labels)} {series[-2]}')
+                lines.append(f'{name}_count{_metric_labels(labels)} {series[-1]}')
+        else:
+            for (series_name, labels), value in sorted(counters.items()):
+                if series_name == name:
+                    lines.append(f'{name}{_metric_labels(labels)} {value}')
+    return '\n'.join(lines) + '\n'
+
+# =========================================================================
+# DEBUG TIMING & PROFILING (X-Debug-Token requests only)
+# =========================================================================
+
+# Phase timings of the current debug request: {'lock', 'phases': {(phase, panel): [seconds, count]},
+# 'threads'}. None outside debug requests, so recording is a single ContextVar lookup.
+_REQUEST_TIMINGS: contextvars.ContextVar = contextvars.ContextVar('request_timings', default=None)
+
+# Metrics that double as Server-Timing phases ('' = panel-<endpoint>)
+TIMING_PHASES = {
+    'v2ray_api_panel_request_seconds': '',
+    'v2ray_api_settings_parse_seconds': 'parse',
+    'v2ray_api_client_match_seconds': 'match',
+}
+
+def is_debug_request() -> bool:
+    token = request.headers.get('X-Debug-Token', '')
+    return bool(DEBUG_TOKEN) and bool(token) and hmac.compare_digest(token.encode(), DEBUG_TOKEN.encode())
+
+def start_request_timings() -> Dict[str, Any]:
+    timings = {'lock': threading.Lock(), 'phases': {}, 'threads': {threading.get_ident()}, 'started': time.monotonic()}
+    timings['token'] = _REQUEST_TIMINGS.set(timings)
+    return timings
+
+def finish_request_timings(timings: Dict[str, Any]) -> None:
+    try:
+        _REQUEST_TIMINGS.reset(timings['token'])
+    except ValueError:
+        _REQUEST_TIMINGS.set(None)
+
+def record_timing(phase: str, seconds: float, panel: str = '') -> None:
+    timings = _REQUEST_TIMINGS.get()
+    if timings is None:
+        return
+    with timings['lock']:
+        entry = timings['phases'].setdefault((phase, panel), [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+# Pool threads run workers through this (inside a copy of the request's context), so their
+# timings land on the request and the sampling profiler follows them
+def run_with_request_context(fn: Callable, *args) -> Any:
+    timings = _REQUEST_TIMINGS.get()
+    if timings is None:
+        return fn(*args)
+    thread_id = threading.get_ident()
+    with timings['lock']:
+        timings['threads'].add(thread_id)
+    try:
+        return fn(*args)
+    finally:
+        with timings['lock']:
+            timings['threads'].discard(thread_id)
+
+# Server-Timing value: total first, then phases by time spent (panel and call count in desc)
+def format_server_timing(timings: Dict[str, Any]) -> str:
+    entries = [f"total;dur={(time.monotonic() - timings['started']) * 1000:.1f}"]
+    with timings['lock']:
+        phases = sorted(timings['phases'].items(), key=lambda item: -item[1][0])
+    for (phase, panel), (seconds, count) in phases:
+        desc = f'{panel} x{count}' if panel else f'x{count}'
+        entries.append(f'{phase};desc="{desc}";dur={seconds * 1000:.1f}')
+    return ', '.join(entries)
+
+# Sampling profiler: every DEBUG_SAMPLE_INTERVAL, the stacks of the request's threads are
+# counted in folded form ("outer;inner;leaf"), which flamegraph.pl and speedscope read directly
+def start_stack_sampler(timings: Dict[str, Any]) -> Dict[str, Any]:
+    sampler = {'stacks': {}, 'samples': 0, 'stop': threading.Event()}
+
+    def sample() -> None:
+        own_id = threading.get_ident()
+        while not sampler['stop'].wait(DEBUG_SAMPLE_INTERVAL):
+            frames = sys._current_frames()
+            with timings['lock']:
+                thread_ids = list(timings['threads'])
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                folded = ';'.join(reversed(stack))
+                sampler['stacks'][folded] = sampler['stacks'].get(folded, 0) + 1
+                sampler['samples'] += 1
+
+    sampler['thread'] = threading.Thread(target=sample, name='debug-sampler', daemon=True)
+    sampler['thread'].start()
+    return sampler
+
+def stop_stack_sampler(sampler: Dict[str, Any]) -> str:
+    sampler['stop'].set()
+    sampler['thread'].join()
+    lines = [f'{stack} {count}' for stack, count in sorted(sampler['stacks'].items(), key=lambda item: -item[1])]
+    return '\n'.join(lines) + '\n'
+
+def start_profile(mode: str, timings: Dict[str, Any]) -> Union[Dict[str, Any], None]:
+    if mode == 'sample':
+        return {'mode': mode, 'sampler': start_stack_sampler(timings)}
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this process
+            return None
+        return {'mode': mode, 'profiler': profiler}
+    return None
+
+# Stop profiling -> (inline text, or None when written to a file, file path or None)
+def finish_profile(profile: Dict[str, Any], to_file: bool) -> tuple:
+    path = None
+    if to_file:
+        suffix = 'folded' if profile['mode'] == 'sample' else 'prof'
+        path = os.path.join(DEBUG_PROFILE_DIR, f"profile-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.{suffix}")
+
+    if profile['mode'] == 'sample':
+        folded = stop_stack_sampler(profile['sampler'])
+        if path is None:
+            return ''.join(folded.splitlines(keepends=True)[:DEBUG_PROFILE_TOP]), None
+        with open(path, 'w') as f:
+            f.write(folded)
+        return None, path
+
+    profiler = profile['profiler']
+    profiler.disable()
+    if path is not None:
+        profiler.dump_stats(path)
+        return None, path
+    import pstats
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(DEBUG_PROFILE_TOP)
+    return output.getvalue(), None
+
 # =========================================================================
 # SECURITY & VALIDATION FUNCTIONS
 # =========================================================================
@@ -244,55 +675,144 @@ def get_client_identifier() -> str:
     # Note: In Vercel, request.remote_addr might be the load balancer IP
     return request.remote_addr if request.remote_addr else 'unknown'
 
-# Rate Limiting
-def check_rate_limit(identifier: str) -> bool:
-    global RATE_LIMIT_CACHE
-    now = int(time.time())
-    window_key = now // RATE_LIMIT_WINDOW
-    
-    # Clean up old window
-    old_window = window_key - 2
-    keys_to_delete = [k for k in RATE_LIMIT_CACHE if int(k.split('_')[-1]) <= old_window]
-    for key in keys_to_delete:
-        del RATE_LIMIT_CACHE[key]
-        
-    cache_key = f"{identifier}_{window_key}"
-    
-    RATE_LIMIT_CACHE[cache_key] = RATE_LIMIT_CACHE.get(cache_key, 0) + 1
-    
-    return RATE_LIMIT_CACHE[cache_key] <= RATE_LIMIT_REQUESTS_PER_MINUTE
+# Rate Limiting (sliding window: the previous window's count is weighted by how much of it
+# still overlaps the last RATE_LIMIT_WINDOW seconds). O(1) work per request.
+_RATE_LIMIT_LOCK = threading.Lock()
+_RATE_LIMIT_DB_PURGED_WINDOW = [0]
+_RATE_LIMIT_SCHEMA = 'CREATE TABLE IF NOT EXISTS rate_limits (identifier TEXT PRIMARY KEY, window INTEGER, current INTEGER, previous INTEGER);'
+
+def _sliding_window_allows(entry: list, window_key: int, elapsed_fraction: float, cost: int) -> bool:
+    if entry[0] != window_key:
+        # Roll the windows forward; anything older than the previous window no longer counts
+        entry[2] = entry[1] if entry[0] == window_key - 1 else 0
+        entry[1] = 0
+        entry[0] = window_key
+    estimated = entry[2] * (1 - elapsed_fraction) + entry[1]
+    if estimated + cost > RATE_LIMIT_REQUESTS_PER_MINUTE:
+        return False
+    entry[1] += cost
+    return True
+
+def _check_rate_limit_memory(identifier: str, window_key: int, elapsed_fraction: float, cost: int) -> bool:
+    with _RATE_LIMIT_LOCK:
+        entry = RATE_LIMIT_CACHE.get(identifier)
+        if entry is None:
+            entry = RATE_LIMIT_CACHE[identifier] = [window_key, 0, 0]
+        else:
+            RATE_LIMIT_CACHE.move_to_end(identifier)
+        allowed = _sliding_window_allows(entry, window_key, elapsed_fraction, cost)
+
+        # Least recently seen identifiers sit at the front; drop the ones that can no longer count
+        while RATE_LIMIT_CACHE:
+            oldest_key, oldest = next(iter(RATE_LIMIT_CACHE.items()))
+            if oldest[0] >= window_key - 1:
+                break
+            del RATE_LIMIT_CACHE[oldest_key]
+        return allowed
+
+def _check_rate_limit_shared(identifier: str, window_key: int, elapsed_fraction: float, cost: int) -> bool:
+    conn = get_sqlite_connection(RATE_LIMIT_DB_FILE, _RATE_LIMIT_SCHEMA)
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        row = conn.execute('SELECT window, current, previous FROM rate_limits WHERE identifier = ?', (identifier,)).fetchone()
+        entry = list(row) if row else [window_key, 0, 0]
+        allowed = _sliding_window_allows(entry, window_key, elapsed_fraction, cost)
+        conn.execute('INSERT OR REPLACE INTO rate_limits (identifier, window, current, previous) VALUES (?, ?, ?, ?)', (identifier, *entry))
+        # Once per window (per process) clear rows that can no longer count
+        if _RATE_LIMIT_DB_PURGED_WINDOW[0] != window_key:
+            _RATE_LIMIT_DB_PURGED_WINDOW[0] = window_key
+            conn.execute('DELETE FROM rate_limits WHERE window < ?', (window_key - 1,))
+        conn.execute('COMMIT')
+        return allowed
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+def check_rate_limit(identifier: str, cost: int = 1) -> bool:
+    now = time.time()
+    window_key = int(now // RATE_LIMIT_WINDOW)
+    elapsed_fraction = (now % RATE_LIMIT_WINDOW) / RATE_LIMIT_WINDOW
+
+    if RATE_LIMIT_DB_FILE:
+        try:
+            return _check_rate_limit_shared(identifier, window_key, elapsed_fraction, cost)
+        except sqlite3.Error as e:
+            # Shared store unavailable: keep limiting per process rather than failing requests
+            app.logger.warning(f'Shared rate limit store failed, using in-memory counters: {e}')
+    return _check_rate_limit_memory(identifier, window_key, elapsed_fraction, cost)
+
+# Cost of the current request: the most expensive action named in the query string or JSON body
+def get_request_cost() -> int:
+    actions = set(request.args.keys())
+    if request.method == 'POST':
+        body = request.get_json(silent=True)
+        if isinstance(body, dict):
+            actions.update(body.keys())
+    return max([RATE_LIMIT_ACTION_COSTS.get(action, 1) for action in actions] or [1])
+
+# 429 response when the current request is over its rate limit, None when it may proceed
+def rate_limit_rejection() -> Union[tuple, None]:
+    started = time.monotonic()
+    client_id = get_client_identifier()
+    allowed = check_rate_limit(client_id, get_request_cost())
+    record_timing('rate_limit', time.monotonic() - started)
+    if allowed:
+        return None
+    increment_metric('v2ray_api_rate_limit_rejections_total')
+    lang = get_client_language()
+    return format_api_response({
+        'error': t('rate_limit_exceeded', lang),
+        'message': 'Too many requests. Please try again later.'
+    }, success=False, lang=lang), 429
 
 def rate_limit_required(f: Callable) -> Callable:
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        client_id = get_client_identifier()
-        if not check_rate_limit(client_id):
-            lang = get_client_language()
-            return format_api_response({
-                'error': t('rate_limit_exceeded', lang),
-                'message': 'Too many requests. Please try again later.'
-            }, success=False, lang=lang), 429
+        rejection = rate_limit_rejection()
+        if rejection:
+            return rejection
         return f(*args, **kwargs)
     return decorated_function
 
+# Validation / parsing patterns, compiled once at import
+USER_NAME_PATTERN = re.compile(r'^[a-zA-Z0-9_\-@.]+$')
+TELEGRAM_ID_PATTERN = re.compile(r'^\d+$')
+UUID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+PANEL_URL_PATTERN = re.compile(r'https?:\/\/[^\s]+')
+PANEL_HOST_PATTERN = re.compile(r'https?:\/\/([^\/:]+)')
+
 # Validation functions (Direct translation of PHP regex)
 def validate_user_name(name: str) -> bool:
-    return bool(re.match(r'^[a-zA-Z0-9_\-@.]+$', name)) and len(name) <= 50
+    return bool(USER_NAME_PATTERN.match(name)) and len(name) <= 50
 
 def validate_panel_index(index: int, panels: Dict) -> bool:
     return index > 0 and index <= len(panels)
 
 def validate_telegram_id(id_str: str) -> bool:
-    return bool(re.match(r'^\d+$', id_str)) and len(id_str) <= 32
+    return bool(TELEGRAM_ID_PATTERN.match(id_str)) and len(id_str) <= 32
 
 
 # =========================================================================
-# JSON FLAT FILE FUNCTIONS (File Locking is simulated with OS/Atomicity)
+# JSON FLAT FILE FUNCTIONS (Advisory file locking + atomic replace)
 # =========================================================================
 
-def get_dynamic_panels_from_json() -> Dict[str, Any]:
-    if not os.path.exists(DYNAMIC_PANELS_FILE):
-        return {}
+# Parsed dynamic_panels.json, reused until the file's inode, mtime or size changes
+_DYNAMIC_PANELS_CACHE: Dict[str, Any] = {'signature': None, 'panels': {}}
+_DYNAMIC_PANELS_LOCK = threading.Lock()
+
+def _dynamic_panels_signature() -> Union[tuple, None]:
+    try:
+        st = os.stat(DYNAMIC_PANELS_FILE)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+# Entries without an 'id' get one derived from their URL + username, so the ID is the same
+# on every read and in every worker until it is written back to the file
+def _stable_panel_id(panel: Dict[str, Any]) -> str:
+    return uuid.uuid5(uuid.NAMESPACE_URL, f"{panel.get('url', '')}|{panel.get('username', '')}").hex
+
+def _load_dynamic_panels() -> Dict[str, Any]:
     try:
         with open(DYNAMIC_PANELS_FILE, 'r') as f:
             data = json.load(f)
@@ -300,36 +820,94 @@ def get_dynamic_panels_from_json() -> Dict[str, Any]:
         return {}
     
     dynamic_panels = {}
-    for panel in data:
-        name = panel.get('name', f"DB_Panel_{panel.get('id', uuid.uuid4().hex)}")
+    for panel in data if isinstance(data, list) else []:
+        panel_id = panel.get('id') or _stable_panel_id(panel)
+        name = panel.get('name') or f"DB_Panel_{panel_id}"
         dynamic_panels[name] = {
             'url': panel.get('url', ''),
             'username': panel.get('username', ''),
             'password': panel.get('password', ''),
             'type': panel.get('type', 'Premium'),
-            'id': panel.get('id', uuid.uuid4().hex),
+            'id': panel_id,
         }
     return dynamic_panels
 
+def get_dynamic_panels_from_json() -> Dict[str, Any]:
+    signature = _dynamic_panels_signature()
+    if signature is None:
+        return {}
+    if _DYNAMIC_PANELS_CACHE['signature'] != signature:
+        with _DYNAMIC_PANELS_LOCK:
+            if _DYNAMIC_PANELS_CACHE['signature'] != signature:
+                panels = _load_dynamic_panels()
+                _DYNAMIC_PANELS_CACHE.update(signature=signature, panels=panels)
+    return dict(_DYNAMIC_PANELS_CACHE['panels'])
+
+# Exclusive advisory lock shared by every worker process (sidecar .lock file)
+@contextmanager
+def dynamic_panels_file_lock():
+    with open(DYNAMIC_PANELS_FILE + '.lock', 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+# Callers that read, modify and write should hold dynamic_panels_file_lock (see update_dynamic_panels)
 def save_panels_to_json(panels: Dict[str, Any]) -> bool:
     # Convert associative dict back to simple list format for JSON storage
-    panel_list = list(panels.values())
+    panel_list = [{'name': name, **config} for name, config in panels.items()]
     content = json.dumps(panel_list, indent=4, ensure_ascii=False)
     
+    temp_file = None
     try:
-        # Using atomic write operation (write to temp, rename) for basic safety
-        temp_file = DYNAMIC_PANELS_FILE + '.tmp'
-        with open(temp_file, 'w') as f:
+        # Unique temp file in the same directory, then atomic rename over the original
+        fd, temp_file = tempfile.mkstemp(prefix='.dynamic_panels.', suffix='.tmp', dir=os.path.dirname(DYNAMIC_PANELS_FILE))
+        with os.fdopen(fd, 'w') as f:
             f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
         os.replace(temp_file, DYNAMIC_PANELS_FILE)
         return True
     except Exception:
+        if temp_file and os.path.exists(temp_file):
+            os.remove(temp_file)
         return False
 
+# Locked read-modify-write. mutator(panels) edits the dict in place and returns a result
+# dict; the file is only written when the result has no 'error'.
+def update_dynamic_panels(mutator: Callable) -> Dict[str, Any]:
+    try:
+        with dynamic_panels_file_lock():
+            panels = _load_dynamic_panels()
+            result = mutator(panels)
+            if 'error' not in result and not save_panels_to_json(panels):
+                return {'error': 'file_access_failed'}
+            return result
+    except OSError:
+        return {'error': 'file_access_failed'}
+
 # =========================================================================
 # UTILITY FUNCTIONS
 # =========================================================================
 
+# Per-thread SQLite connection for a local database file (autocommit; callers use explicit BEGIN)
+_SQLITE_CONNECTIONS = threading.local()
+
+def get_sqlite_connection(path: str, schema: str) -> sqlite3.Connection:
+    connections = getattr(_SQLITE_CONNECTIONS, 'connections', None)
+    if connections is None:
+        connections = _SQLITE_CONNECTIONS.connections = {}
+    conn = connections.get(path)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(schema)
+        connections[path] = conn
+    return conn
+
 # Generate Random Key
 def generate_random_key(length: int = 32) -> str:
     characters = '0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ!@#$%^&*()-_+=[]{}:;,.|'
@@ -416,7 +994,7 @@ def parse_v2ray_config(config: str) -> Dict[str, str]:
                 except Exception:
                     pass
     
-    if re.match(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', config, re.IGNORECASE):
+    if UUID_PATTERN.match(config):
         return {'type': 'uuid', 'value': config, 'email': config, 'method': 'auto'}
         
     if validate_user_name(config):
@@ -424,9 +1002,12 @@ def parse_v2ray_config(config: str) -> Dict[str, str]:
         
     return {'error': 'Configuration parsing failed: Invalid or unsupported format.'}
 
+# Protocols create_config_link can build a link for
+CONFIG_LINK_PROTOCOLS = ('shadowsocks', 'vless', 'vmess', 'trojan')
+
 # Create Config Link
 def create_config_link(panel_url: str, port: int, client: Dict[str, Any], protocol: str) -> str:
-    match = re.search(r'https?:\/\/([^\/:]+)', panel_url)
+    match = PANEL_HOST_PATTERN.search(panel_url)
     server_host = match.group(1) if match else 'unknown_host'
     email = client.get('email', 'Account')
     remark = urllib.parse.quote(email.replace(' ', '-'))
@@ -453,8 +1034,8 @@ def create_config_link(panel_url: str, port: int, client: Dict[str, Any], protoc
     else:
         return "N/A - Protocol Not Supported in Link Generation"
 
-# Format API Response
-def format_api_response(data: Dict[str, Any], success: bool = True, lang: str = 'en') -> str:
+# Add human readable traffic/expiry fields to account data (used per item by batch results too)
+def format_account_fields(data: Dict[str, Any], lang: str = 'en') -> Dict[str, Any]:
     if 'up' in data or 'down' in data or 'total' in data:
         total = int(data.get('total', 0))
         used = int(data.get('up', 0)) + int(data.get('down', 0))
@@ -473,54 +1054,306 @@ def format_api_response(data: Dict[str, Any], success: bool = True, lang: str =
     
     if 'status' in data and data['status'] in TRANSLATIONS[lang]:
         data['status'] = t(data['status'], lang)
-    
-    response = {
-        'api': API_INFO,
-        'data': data,
-        'timestamp': int(time.time()),
-        'success': success and 'error' not in data,
-        'language': lang
-    }
-    return json.dumps(response, indent=4, ensure_ascii=False)
+    return data
+
+# Compact output: ?compact=1 or "X-Response-Format: compact" (no indentation, API_INFO only with ?api_info=1)
+def wants_compact_response() -> bool:
+    if not has_request_context():
+        return False
+    return (request.args.get('compact', '').lower() in ('1', 'true')
+            or request.headers.get('X-Response-Format', '').lower() == 'compact')
 
+def _dumps(value: Any, compact: bool) -> str:
+    if compact:
+        orjson = optional_import('orjson')
+        if orjson is not None:
+            try:
+                return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode()
+            except TypeError:
+                pass
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+    return json.dumps(value, indent=4, ensure_ascii=False)
+
+# API_INFO never changes, so it is encoded once per output style and spliced into every response
+_API_INFO_ENCODED: Dict[bool, str] = {}
+
+def _encoded_api_info(compact: bool) -> str:
+    encoded = _API_INFO_ENCODED.get(compact)
+    if encoded is None:
+        encoded = _dumps(API_INFO, compact)
+        if not compact:
+            encoded = encoded.replace('\n', '\n    ')
+        _API_INFO_ENCODED[compact] = encoded
+    return encoded
+
+# Format API Response
+def format_api_response(data: Dict[str, Any], success: bool = True, lang: str = 'en') -> str:
+    started = time.monotonic()
+    format_account_fields(data, lang)
+    compact = wants_compact_response()
+    include_api_info = not compact or (has_request_context() and request.args.get('api_info', '').lower() in ('1', 'true'))
+
+    # Everything except the timestamp is encoded first; that part also identifies the content for ETags
+    payload = _dumps({'data': data, 'success': success and 'error' not in data, 'language': lang}, compact)
+    if has_request_context():
+        g.response_etag = hashlib.blake2b(f'{int(compact)}{int(include_api_info)}{payload}'.encode(), digest_size=16).hexdigest()
+
+    timestamp = int(time.time())
+    if compact:
+        api_part = f'"api":{_encoded_api_info(True)},' if include_api_info else ''
+        body = f'{{{api_part}{payload[1:-1]},"timestamp":{timestamp}}}'
+    else:
+        body = f'{{\n    "api": {_encoded_api_info(False)},\n{payload[2:-2]},\n    "timestamp": {timestamp}\n}}'
+    record_timing('encode', time.monotonic() - started)
+    return body
 
 # =========================================================================
 # API HELPER FUNCTIONS (Using Python Requests)
 # =========================================================================
 
-import requests
+_HTTP_SESSIONS: Dict[str, 'requests.Session'] = {}
+_HTTP_SESSIONS_LOCK = threading.Lock()
+
+# requests is imported with the first panel session instead of at cold start
+def load_requests() -> None:
+    global requests, HTTPAdapter
+    if requests is None:
+        import requests as requests_module
+        from requests.adapters import HTTPAdapter as adapter_class
+        HTTPAdapter = adapter_class
+        requests = requests_module
+
+# Keep-alive HTTP session for a panel host (scheme://host:port), created on first use
+def get_http_session(panel_url: str) -> 'requests.Session':
+    parsed = urllib.parse.urlsplit(panel_url)
+    host_key = f"{parsed.scheme}://{parsed.netloc}"
+    session = _HTTP_SESSIONS.get(host_key)
+    if session is not None:
+        return session
+
+    load_requests()
+    with _HTTP_SESSIONS_LOCK:
+        session = _HTTP_SESSIONS.get(host_key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=PANEL_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['User-Agent'] = USER_AGENT
+            # Panel cookies are managed explicitly by the session cache, never by the shared jar
+            session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+            _HTTP_SESSIONS[host_key] = session
+    return session
+
+# Connection reuse counters per panel host (urllib3 counts every request and every new connection)
+def get_http_pool_stats() -> Dict[str, Any]:
+    stats = {}
+    for host_key, session in list(_HTTP_SESSIONS.items()):
+        request_count = 0
+        new_connections = 0
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for pool_key in pools.keys():
+                pool = pools.get(pool_key)
+                if pool is not None:
+                    request_count += pool.num_requests
+                    new_connections += pool.num_connections
+        stats[host_key] = {
+            'requests': request_count,
+            'new_connections': new_connections,
+            'reused_connections': max(0, request_count - new_connections),
+        }
+    return stats
+
+# =========================================================================
+# CIRCUIT BREAKER (per panel: closed -> open after repeated failures -> half-open probe)
+# =========================================================================
+
+CIRCUIT_BREAKERS: Dict[str, Dict[str, Any]] = {}
+_CIRCUIT_BREAKER_LOCK = threading.Lock()
+
+def _circuit_breaker(panel_url: str) -> Dict[str, Any]:
+    key = panel_url.rstrip('/')
+    breaker = CIRCUIT_BREAKERS.get(key)
+    if breaker is None:
+        breaker = CIRCUIT_BREAKERS.setdefault(key, {
+            'state': 'closed', 'consecutive_failures': 0, 'opened_at': 0.0, 'trips': 0, 'probe_in_flight': False
+        })
+    return breaker
+
+# False while the panel's breaker is open; after the reset timeout a single half-open probe is let through
+def circuit_allows(panel_url: str) -> bool:
+    breaker = _circuit_breaker(panel_url)
+    if breaker['state'] == 'closed':
+        return True
+    with _CIRCUIT_BREAKER_LOCK:
+        if breaker['state'] == 'open' and time.time() - breaker['opened_at'] >= CIRCUIT_BREAKER_RESET_SECONDS:
+            breaker['state'] = 'half_open'
+            breaker['probe_in_flight'] = False
+        if breaker['state'] == 'half_open' and not breaker['probe_in_flight']:
+            breaker['probe_in_flight'] = True
+            return True
+        allowed = breaker['state'] == 'closed'
+    if not allowed:
+        increment_metric('v2ray_api_circuit_rejections_total', panel=metric_panel_label(panel_url))
+    return allowed
+
+# Live panel health used by placement: EWMA of request latency and of the failure rate
+PANEL_HEALTH: Dict[str, Dict[str, Any]] = {}
+
+def _panel_health(panel_url: str) -> Dict[str, Any]:
+    key = panel_url.rstrip('/')
+    health = PANEL_HEALTH.get(key)
+    if health is None:
+        health = PANEL_HEALTH.setdefault(key, {'latency_ewma': None, 'error_ewma': 0.0})
+    return health
+
+def record_panel_latency(panel_url: str, seconds: float, endpoint: str = 'login') -> None:
+    observe_metric('v2ray_api_panel_request_seconds', seconds, panel=metric_panel_label(panel_url), endpoint=metric_endpoint_label(endpoint))
+    health = _panel_health(panel_url)
+    previous = health['latency_ewma']
+    health['latency_ewma'] = seconds if previous is None else previous + PLACEMENT_EWMA_ALPHA * (seconds - previous)
+
+def record_panel_result(panel_url: str, success: bool) -> None:
+    health = _panel_health(panel_url)
+    health['error_ewma'] += PLACEMENT_EWMA_ALPHA * ((0.0 if success else 1.0) - health['error_ewma'])
+
+    breaker = _circuit_breaker(panel_url)
+    with _CIRCUIT_BREAKER_LOCK:
+        if success:
+            breaker.update(state='closed', consecutive_failures=0, probe_in_flight=False)
+            return
+        breaker['consecutive_failures'] += 1
+        if breaker['state'] == 'half_open' or breaker['consecutive_failures'] >= CIRCUIT_BREAKER_FAILURE_THRESHOLD:
+            if breaker['state'] != 'open':
+                breaker['trips'] += 1
+            breaker.update(state='open', opened_at=time.time(), probe_in_flight=False)
+
+def get_circuit_breaker_stats() -> Dict[str, Any]:
+    return {
+        panel_url: {
+            'state': breaker['state'],
+            'consecutive_failures': breaker['consecutive_failures'],
+            'trips': breaker['trips'],
+            'opened_at': int(breaker['opened_at']) if breaker['opened_at'] else None,
+        }
+        for panel_url, breaker in list(CIRCUIT_BREAKERS.items())
+    }
+
+# Connection errors, timeouts and 5xx mean the panel is unhealthy; other errors do not trip the breaker
+def is_panel_failure(error: Exception) -> bool:
+    if requests is not None and isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if httpx is not None and isinstance(error, httpx.TransportError):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code >= 500
 
 def api_login(panel_url: str, username: str, password: str) -> Union[str, bool]:
+    if not circuit_allows(panel_url):
+        return False
     url = f"{panel_url.rstrip('/')}/login"
     data = {'username': username, 'password': password}
+    started = time.monotonic()
+    response = None
     try:
-        response = requests.post(url, data=data, headers={'User-Agent': USER_AGENT}, timeout=15, verify=False, allow_redirects=True)
+        response = get_http_session(panel_url).post(url, data=data, timeout=(PANEL_CONNECT_TIMEOUT, PANEL_READ_TIMEOUT), verify=False, allow_redirects=True)
+        record_panel_latency(panel_url, time.monotonic() - started)
         response.raise_for_status() # Raises an exception for 4xx or 5xx status codes
+
+        # 3x-ui answers a wrong password with HTTP 200 and {"success": false}
+        try:
+            login_result = response.json()
+            if isinstance(login_result, dict) and login_result.get('success') is False:
+                record_panel_result(panel_url, True)
+                increment_metric('v2ray_api_panel_failures_total', panel=metric_panel_label(panel_url), endpoint='login')
+                return False
+        except ValueError:
+            pass
         
-        # Extract cookie from response headers
-        if 'set-cookie' in response.headers:
-            # Join multiple set-cookie headers into a single Cookie header string
-            cookie_header = "; ".join([cookie.split(';')[0] for cookie in response.headers.get_all('set-cookie')])
-            return cookie_header if cookie_header else False
-        return False
+        # Join the cookies set during login (including redirects) into a single Cookie header string
+        cookies = {}
+        for resp in [*response.history, response]:
+            for cookie in resp.cookies:
+                cookies[cookie.name] = cookie.value
+        cookie_header = "; ".join(f"{name}={value}" for name, value in cookies.items())
+        record_panel_result(panel_url, True)
+        return cookie_header if cookie_header else False
     except requests.RequestException as e:
         # print(f"Login failed for {panel_url}: {e}")
+        # Error statuses were already timed by record_panel_latency before raise_for_status
+        if response is None:
+            observe_metric('v2ray_api_panel_request_seconds', time.monotonic() - started, panel=metric_panel_label(panel_url), endpoint='login')
+        increment_metric('v2ray_api_panel_failures_total', panel=metric_panel_label(panel_url), endpoint='login')
+        record_panel_result(panel_url, not is_panel_failure(e))
+        return False
+
+_PANEL_SESSION_LOCK = threading.Lock()
+_PANEL_LOGIN_LOCKS: Dict[tuple, threading.Lock] = {}
+
+# Cached login: reuses the panel cookie until it expires. Concurrent callers for the
+# same panel share one in-flight login, and a failed login is reused for
+# PANEL_LOGIN_FAILURE_TTL seconds. Pass stale_cookie (the cookie the panel just
+# rejected) to force a new login unless another request has already replaced it.
+def get_panel_session(panel_url: str, username: str, password: str, stale_cookie: str = None) -> Union[str, bool]:
+    key = (panel_url.rstrip('/'), username)
+    entry = PANEL_SESSION_CACHE.get(key)
+    if entry and entry['expires_at'] > time.time() and entry['cookie'] != stale_cookie:
+        return entry['cookie']
+
+    with _PANEL_SESSION_LOCK:
+        login_lock = _PANEL_LOGIN_LOCKS.setdefault(key, threading.Lock())
+
+    with login_lock:
+        # Another request may have logged in while we were waiting for the lock
+        entry = PANEL_SESSION_CACHE.get(key)
+        if entry and entry['expires_at'] > time.time() and entry['cookie'] != stale_cookie:
+            return entry['cookie']
+
+        cookie_header = api_login(panel_url, username, password)
+        if cookie_header:
+            PANEL_SESSION_CACHE[key] = {'cookie': cookie_header, 'expires_at': time.time() + PANEL_SESSION_TTL}
+        elif PANEL_LOGIN_FAILURE_TTL > 0:
+            PANEL_SESSION_CACHE[key] = {'cookie': False, 'expires_at': time.time() + PANEL_LOGIN_FAILURE_TTL}
+        else:
+            PANEL_SESSION_CACHE.pop(key, None)
+        return cookie_header
+
+def invalidate_panel_session(panel_url: str, username: str) -> None:
+    PANEL_SESSION_CACHE.pop((panel_url.rstrip('/'), username), None)
+
+# Marker returned by a single API attempt when the panel rejected the session cookie
+PANEL_AUTH_FAILED = object()
+
+def api_call(panel_url: str, cookie_header: str, endpoint: str, data: Dict[str, Any] = None, credentials: tuple = None) -> Union[Dict[str, Any], bool]:
+    if not circuit_allows(panel_url):
         return False
+    call_started = time.monotonic()
+    # Whether the last attempt failed because the panel itself is unhealthy, and how many attempts were made
+    last_attempt = {'panel_failure': False, 'attempts': 0}
 
-def api_call(panel_url: str, cookie_header: str, endpoint: str, data: Dict[str, Any] = None) -> Union[Dict[str, Any], bool]:
-    def do_call():
+    def do_call(cookie: str):
+        last_attempt['panel_failure'] = False
+        last_attempt['attempts'] += 1
         url = f"{panel_url.rstrip('/')}/{endpoint}"
         headers = {
-            "Cookie": cookie_header,
-            "Content-Type": "application/json",
-            "User-Agent": USER_AGENT
+            "Cookie": cookie,
+            "Content-Type": "application/json"
         }
+        session = get_http_session(panel_url)
+        timeout = (PANEL_CONNECT_TIMEOUT, PANEL_READ_TIMEOUT)
         
         try:
+            started = time.monotonic()
             if data is not None:
-                response = requests.post(url, json=data, headers=headers, timeout=15, verify=False)
+                response = session.post(url, json=data, headers=headers, timeout=timeout, verify=False, allow_redirects=False)
             else:
-                response = requests.post(url, headers=headers, timeout=15, verify=False)
+                response = session.post(url, headers=headers, timeout=timeout, verify=False, allow_redirects=False)
+            record_panel_latency(panel_url, time.monotonic() - started, endpoint)
+
+            # Expired sessions are redirected to the login page (or get 401/404 on newer 3x-ui)
+            if response.is_redirect or response.status_code in (401, 403, 404):
+                return PANEL_AUTH_FAILED
                 
             response.raise_for_status()
             
@@ -530,30 +1363,327 @@ def api_call(panel_url: str, cookie_header: str, endpoint: str, data: Dict[str,
             return False
         except requests.RequestException as e:
             # print(f"API call failed on {url}: {e}")
+            last_attempt['panel_failure'] = is_panel_failure(e)
             return False
         except json.JSONDecodeError:
             # print(f"API call failed: Invalid JSON response from {url}")
             return False
 
-    return handle_api_call_with_retry(do_call)
-
+    result = handle_api_call_with_retry(lambda: do_call(cookie_header))
+    attempt_loops = 1
+    if result is PANEL_AUTH_FAILED and credentials:
+        # Log in once more (shared with concurrent callers) and retry with the new cookie
+        new_cookie = get_panel_session(panel_url, credentials[0], credentials[1], stale_cookie=cookie_header)
+        if new_cookie:
+            attempt_loops += 1
+            result = handle_api_call_with_retry(lambda: do_call(new_cookie))
+        if result is PANEL_AUTH_FAILED:
+            invalidate_panel_session(panel_url, credentials[0])
+    record_panel_result(panel_url, result is not False or not last_attempt['panel_failure'])
+    record_api_call_metrics(panel_url, endpoint, time.monotonic() - call_started, last_attempt['attempts'] - attempt_loops, result is False or result is PANEL_AUTH_FAILED)
+    return False if result is PANEL_AUTH_FAILED else result
+
+def record_api_call_metrics(panel_url: str, endpoint: str, seconds: float, retries: int, failed: bool) -> None:
+    panel, endpoint = metric_panel_label(panel_url), metric_endpoint_label(endpoint)
+    observe_metric('v2ray_api_panel_call_seconds', seconds, panel=panel, endpoint=endpoint)
+    if retries > 0:
+        increment_metric('v2ray_api_panel_retries_total', retries, panel=panel, endpoint=endpoint)
+    if failed:
+        increment_metric('v2ray_api_panel_failures_total', panel=panel, endpoint=endpoint)
+
+# Retries with exponential backoff and full jitter (random sleep up to base * 2^attempt, capped)
 def handle_api_call_with_retry(api_call_func: Callable, max_retries: int = 2) -> Union[Dict[str, Any], bool]:
     for attempt in range(max_retries + 1):
         result = api_call_func()
         if result is not False:
             return result
         if attempt < max_retries:
-            time.sleep(1)
+            time.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_BASE_SECONDS * (2 ** attempt))))
     return False
 
+# Extract (url, username, password) from either panel structure:
+# panels.php (nested 'config') or JSON file (flat)
+def get_panel_credentials(panel_config: Dict[str, Any]) -> tuple:
+    nested = panel_config.get('config', {})
+    panel_url = panel_config.get('url') or nested.get('url')
+    username = panel_config.get('username') or nested.get('username')
+    password = panel_config.get('password') or nested.get('password')
+    return panel_url, username, password
+
+# Run worker(panel_key, panel, stop_event) for every panel on a bounded thread pool.
+# first_match=True: the first truthy result is returned, queued panels are cancelled and
+# still-running workers are told to stop through stop_event (their results are ignored).
+# first_match=False: waits for every panel and returns {panel_key: result}.
+def fan_out_panels(panels: Dict[Any, Any], worker: Callable, first_match: bool = True) -> Any:
+    items = list(panels.items())
+    if not items:
+        return False if first_match else {}
+
+    stop_event = threading.Event()
+    max_workers = max(1, min(PANEL_MAX_CONCURRENCY, len(items)))
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='panel')
+    futures = {
+        executor.submit(contextvars.copy_context().run, run_with_request_context, worker, key, panel, stop_event): key
+        for key, panel in items
+    }
+    results: Dict[Any, Any] = {}
+    try:
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                app.logger.warning(f'Panel worker failed for {futures[future]}: {e}')
+                result = False
+            if not first_match:
+                results[futures[future]] = result
+            elif result:
+                stop_event.set()
+                return result
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return results if not first_match else False
+
+INBOUND_LIST_CACHE: Dict[str, Dict[str, Any]] = {}
+_INBOUND_LIST_LOCK = threading.Lock()
+_INBOUND_FETCH_LOCKS: Dict[str, threading.Lock] = {}
+
+# Login (cached) and download a panel's inbound list; every download refreshes the cache and re-indexes the panel
+def download_panel_inbounds(panel_name: str, panel_url: str, username: str, password: str) -> Union[tuple, bool]:
+    cookie_header = get_panel_session(panel_url, username, password)
+    if not cookie_header:
+        return False
+
+    inbound_list = api_call(panel_url, cookie_header, 'xui/inbound/list', credentials=(username, password))
+    if not inbound_list or 'obj' not in inbound_list:
+        return False
+
+    return store_panel_inbounds(panel_name, panel_url, cookie_header, inbound_list['obj'] or [])
+
+# Cache a freshly downloaded inbound list and feed it to the index, stats and traffic history
+def store_panel_inbounds(panel_name: str, panel_url: str, cookie_header: str, inbounds: List[Dict[str, Any]]) -> tuple:
+    INBOUND_LIST_CACHE[panel_url.rstrip('/')] = {
+        'cookie': cookie_header, 'inbounds': inbounds, 'fetched_at': time.time(), 'refreshing': False
+    }
+    index_panel_inbounds(panel_name, inbounds)
+    update_system_stats(panel_name, inbounds)
+    maybe_record_traffic_snapshot(panel_name, inbounds)
+    return cookie_header, inbounds
+
+def _refresh_panel_inbounds(panel_name: str, panel_url: str, username: str, password: str) -> None:
+    try:
+        download_panel_inbounds(panel_name, panel_url, username, password)
+    except Exception as e:
+        app.logger.warning(f'Background inbound refresh failed for {panel_name}: {e}')
+    finally:
+        entry = INBOUND_LIST_CACHE.get(panel_url.rstrip('/'))
+        if entry:
+            entry['refreshing'] = False
+
+# Inbound list through the stale-while-revalidate cache. fresh=True bypasses the cache
+# (write paths that need exact client positions). Returns (cookie_header, inbounds) or False.
+def fetch_panel_inbounds(panel_name: str, panel_url: str, username: str, password: str, stop_event: threading.Event = None, fresh: bool = False) -> Union[tuple, bool]:
+    cache_key = panel_url.rstrip('/')
+    entry = INBOUND_LIST_CACHE.get(cache_key)
+    if entry and not fresh:
+        age = time.time() - entry['fetched_at']
+        if age <= INBOUND_LIST_FRESH_SECONDS:
+            return entry['cookie'], entry['inbounds']
+        if age <= INBOUND_LIST_MAX_STALE_SECONDS:
+            with _INBOUND_LIST_LOCK:
+                start_refresh = not entry['refreshing']
+                entry['refreshing'] = True
+            if start_refresh:
+                threading.Thread(target=_refresh_panel_inbounds, args=(panel_name, panel_url, username, password), daemon=True).start()
+            return entry['cookie'], entry['inbounds']
+
+    # Synchronous download, shared by concurrent callers for the same panel
+    requested_at = time.time()
+    with _INBOUND_LIST_LOCK:
+        fetch_lock = _INBOUND_FETCH_LOCKS.setdefault(cache_key, threading.Lock())
+    with fetch_lock:
+        entry = INBOUND_LIST_CACHE.get(cache_key)
+        if entry and entry['fetched_at'] >= requested_at:
+            fetched = (entry['cookie'], entry['inbounds'])
+        else:
+            fetched = download_panel_inbounds(panel_name, panel_url, username, password)
+
+    if not fetched or (stop_event and stop_event.is_set()):
+        return False
+    return fetched
+
+_INBOUND_WARMING: set = set()
+
+# Background download for a panel with no cached inbound list yet (started once until it lands)
+def warm_panel_inbounds(panel_name: str, panel_url: str, username: str, password: str) -> None:
+    cache_key = panel_url.rstrip('/')
+    with _INBOUND_LIST_LOCK:
+        if cache_key in _INBOUND_WARMING or cache_key in INBOUND_LIST_CACHE:
+            return
+        _INBOUND_WARMING.add(cache_key)
+
+    def warm() -> None:
+        try:
+            _refresh_panel_inbounds(panel_name, panel_url, username, password)
+        finally:
+            _INBOUND_WARMING.discard(cache_key)
+
+    threading.Thread(target=warm, daemon=True).start()
+
+# Write paths call this after changing clients on a panel
+def invalidate_inbound_list(panel_url: str) -> None:
+    INBOUND_LIST_CACHE.pop(panel_url.rstrip('/'), None)
+
+# =========================================================================
+# PARSED INBOUND SETTINGS CACHE (LRU, keyed by inbound ID + settings hash)
+# =========================================================================
+
+INBOUND_SETTINGS_CACHE: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+_INBOUND_SETTINGS_CACHE_BYTES = 0
+_INBOUND_SETTINGS_LOCK = threading.Lock()
+
+# Parsed settings plus client lookup tables (lowercased email/id/password -> client positions; values
+# that differ only in case share a key). An unchanged inbound is never parsed twice; only its
+# settings string is hashed.
+def get_inbound_tables(inbound: Dict[str, Any]) -> Dict[str, Any]:
+    global _INBOUND_SETTINGS_CACHE_BYTES
+    raw_settings = inbound.get('settings') or '{}'
+    digest = hashlib.blake2b(raw_settings.encode(), digest_size=16).digest()
+    cache_key = (inbound.get('id'), digest)
+
+    with _INBOUND_SETTINGS_LOCK:
+        tables = INBOUND_SETTINGS_CACHE.get(cache_key)
+        if tables is not None:
+            INBOUND_SETTINGS_CACHE.move_to_end(cache_key)
+    if tables is not None:
+        increment_metric('v2ray_api_settings_cache_total', result='hit')
+        return tables
+
+    parse_started = time.monotonic()
+    try:
+        settings = json.loads(raw_settings)
+    except json.JSONDecodeError:
+        settings = {}
+    clients = settings.get('clients', []) if isinstance(settings, dict) else []
+
+    tables = {'settings': settings, 'clients': clients, 'by_email': {}, 'by_id': {}, 'by_password': {}, 'stats': (None, {})}
+    for client_index, client in enumerate(clients):
+        for field in ('email', 'id', 'password'):
+            value = client.get(field)
+            if value:
+                tables['by_' + field].setdefault(str(value).lower(), []).append(client_index)
+
+    cost = len(raw_settings)
+    observe_metric('v2ray_api_settings_parse_seconds', time.monotonic() - parse_started)
+    increment_metric('v2ray_api_settings_cache_total', result='miss')
+    with _INBOUND_SETTINGS_LOCK:
+        if cache_key not in INBOUND_SETTINGS_CACHE:
+            INBOUND_SETTINGS_CACHE[cache_key] = tables
+            _INBOUND_SETTINGS_CACHE_BYTES += cost
+            tables['cost'] = cost
+        while _INBOUND_SETTINGS_CACHE_BYTES > INBOUND_SETTINGS_CACHE_MAX_BYTES and len(INBOUND_SETTINGS_CACHE) > 1:
+            _, evicted = INBOUND_SETTINGS_CACHE.popitem(last=False)
+            _INBOUND_SETTINGS_CACHE_BYTES -= evicted.get('cost', 0)
+    return tables
+
+# clientStats by email. Traffic counters change between downloads while settings do not, so the
+# table is rebuilt whenever the inbound carries a different clientStats list than last time.
+def get_client_stats_table(inbound: Dict[str, Any], tables: Dict[str, Any]) -> Dict[str, Any]:
+    client_stats = inbound.get('clientStats') or inbound.get('clientInfo') or []
+    stats_source, stats_by_email = tables['stats']
+    if stats_source is not client_stats:
+        stats_by_email = {}
+        for stat in client_stats:
+            stats_by_email.setdefault(stat.get('email'), stat)
+        tables['stats'] = (client_stats, stats_by_email)
+    return stats_by_email
+
+# Position of the client whose email matches exactly (case included) -> index or None
+def find_email_in_tables(tables: Dict[str, Any], email: str) -> Union[int, None]:
+    for client_index in tables['by_email'].get(email.lower(), ()):
+        if tables['clients'][client_index].get('email', '') == email:
+            return client_index
+    return None
+
+# =========================================================================
+# CLIENT LOCATION INDEX (email / UUID / password -> panel, inbound, client email)
+# =========================================================================
+
+CLIENT_INDEX: Dict[tuple, Dict[str, Any]] = {}
+_CLIENT_INDEX_PANEL_KEYS: Dict[str, set] = {}
+_CLIENT_INDEX_LOCK = threading.Lock()
+
+# Index lookup field for each parse_v2ray_config type
+CLIENT_INDEX_FIELDS = {
+    'email': 'email',
+    'vmess': 'id', 'vless': 'id', 'uuid': 'id',
+    'shadowsocks': 'password', 'trojan': 'password',
+}
+
+def client_index_keys(client: Dict[str, Any]) -> List[tuple]:
+    keys = []
+    for field in ('email', 'id', 'password'):
+        value = client.get(field)
+        if value:
+            keys.append((field, str(value).lower()))
+    return keys
+
+# Replace every index entry of a panel with the clients of a freshly downloaded inbound list.
+# The first client in panel order keeps a key, as a linear scan would find it first.
+def index_panel_inbounds(panel_name: str, inbounds: List[Dict[str, Any]]) -> None:
+    now = time.time()
+    entries = {}
+    for inbound in inbounds:
+        for client in get_inbound_tables(inbound)['clients']:
+            location = {'panel': panel_name, 'inbound_id': inbound.get('id'), 'email': client.get('email', ''), 'indexed_at': now}
+            for key in client_index_keys(client):
+                entries.setdefault(key, location)
+
+    with _CLIENT_INDEX_LOCK:
+        for key in _CLIENT_INDEX_PANEL_KEYS.pop(panel_name, set()):
+            if CLIENT_INDEX.get(key, {}).get('panel') == panel_name:
+                del CLIENT_INDEX[key]
+        CLIENT_INDEX.update(entries)
+        _CLIENT_INDEX_PANEL_KEYS[panel_name] = set(entries)
+
+# Write-path hooks: call after this API adds or removes a client on a panel
+def index_client(panel_name: str, inbound_id: int, client: Dict[str, Any]) -> None:
+    location = {'panel': panel_name, 'inbound_id': inbound_id, 'email': client.get('email', ''), 'indexed_at': time.time()}
+    with _CLIENT_INDEX_LOCK:
+        for key in client_index_keys(client):
+            CLIENT_INDEX[key] = location
+            _CLIENT_INDEX_PANEL_KEYS.setdefault(panel_name, set()).add(key)
+    invalidate_subscription(client.get('email', ''))
+
+def unindex_client(client: Dict[str, Any]) -> None:
+    with _CLIENT_INDEX_LOCK:
+        for key in client_index_keys(client):
+            location = CLIENT_INDEX.pop(key, None)
+            if location:
+                _CLIENT_INDEX_PANEL_KEYS.get(location['panel'], set()).discard(key)
+    invalidate_subscription(client.get('email', ''))
+
+# Returns the indexed location, or None when the client is not indexed or the entry is stale
+def lookup_client_location(field: str, value: str) -> Union[Dict[str, Any], None]:
+    location = CLIENT_INDEX.get((field, str(value).lower()))
+    if not location or time.time() - location['indexed_at'] > CLIENT_INDEX_TTL:
+        return None
+    return location
+
+# The panel's inbounds with the indexed inbound first, so a scan for an indexed client stops there
+def indexed_inbound_first(inbounds: List[Dict[str, Any]], location: Union[Dict[str, Any], None]) -> List[Dict[str, Any]]:
+    if not location:
+        return inbounds
+    return sorted(inbounds, key=lambda inbound: inbound.get('id') != location['inbound_id'])
+
 # Find Client in All Panels
-def find_client_in_all_panels(user_name: str, panels: Dict[int, Any]) -> Union[Dict[str, Any], bool]:
+# fresh=True skips the inbound-list cache (use before writing with the returned client_index)
+def find_client_in_all_panels(user_name: str, panels: Dict[int, Any], fresh: bool = False) -> Union[Dict[str, Any], bool]:
     # Merge Premium panels with dynamic JSON panels for comprehensive search
     all_panels_to_check = panels.copy()
     dynamic_panels = get_dynamic_panels_from_json()
     
     # Add dynamic panels as new numbered indices if they are 'Premium' type
-    dynamic_premium_index = len(PREMIUM_PANELS) + 1
+    dynamic_premium_index = len(get_panel_tables()[0]) + 1
     for name, config in dynamic_panels.items():
         if config.get('type') == 'Premium':
             all_panels_to_check[dynamic_premium_index] = {
@@ -562,49 +1692,371 @@ def find_client_in_all_panels(user_name: str, panels: Dict[int, Any]) -> Union[D
             }
             dynamic_premium_index += 1
 
-    for panel_index, panel in all_panels_to_check.items():
+    def search_panel(panel_index: int, panel: Dict[str, Any], stop_event: threading.Event) -> Union[Dict[str, Any], bool]:
         panel_url = panel['config']['url']
         panel_name = panel['name']
-        cookie_header = api_login(panel_url, panel['config']['username'], panel['config']['password'])
+        fetched = fetch_panel_inbounds(panel_name, panel_url, panel['config']['username'], panel['config']['password'], stop_event, fresh)
+        if not fetched:
+            return False
+        cookie_header, inbounds = fetched
 
-        if not cookie_header:
-            continue
+        for inbound in indexed_inbound_first(inbounds, location if location and location['panel'] == panel_name else None):
+            tables = get_inbound_tables(inbound)
+            client_index = find_email_in_tables(tables, user_name)
+            
+            # Check if the email matches the username
+            if client_index is not None:
+                # Callers modify and send back the returned settings, so hand out a private copy
+                try:
+                    settings = json.loads(inbound.get('settings', '[]'))
+                except json.JSONDecodeError:
+                    settings = {}
+                clients = settings.get('clients', [])
+                client = clients[client_index]
+
+                protocol = inbound.get('protocol', 'unknown').lower()
+                client_uid = client.get('id') or client.get('password') or client.get('email')
+
+                return {
+                    'panel_index': panel_index,
+                    'panel_name': panel_name,
+                    'panel_url': panel_url,
+                    'cookie_header': cookie_header,
+                    'inbound_id': inbound['id'],
+                    'inbound_port': inbound['port'],
+                    'client_index': client_index,
+                    'client_email': user_name,
+                    'protocol': protocol,
+                    'client_data': client,
+                    'client_uid': client_uid,
+                    'inbound_protocol_settings': settings,
+                    'all_clients': clients
+                }
+        return False
+
+    # Indexed clients are looked up on their own panel only; fall back to a full scan on a miss
+    location = lookup_client_location('email', user_name)
+    if location:
+        for panel_index, panel in list(all_panels_to_check.items()):
+            if panel['name'] == location['panel']:
+                result = search_panel(panel_index, panel, threading.Event())
+                if result:
+                    return result
+                del all_panels_to_check[panel_index]
+                break
+
+    return fan_out_panels(all_panels_to_check, search_panel)
+
+# =========================================================================
+# SUBSCRIPTIONS (?sub=<user>: base64 list of the user's links on every panel)
+# =========================================================================
 
-        inbound_list = api_call(panel_url, cookie_header, 'xui/inbound/list')
-        if not inbound_list or 'obj' not in inbound_list:
+# user name -> {'body', 'userinfo', 'etag', 'links', 'built_at'}; oldest entries are dropped first
+SUBSCRIPTION_CACHE: Dict[str, Dict[str, Any]] = {}
+_SUBSCRIPTION_LOCK = threading.Lock()
+# Invalidations are stamped from one counter and remembered per user (oldest dropped first, past
+# SUBSCRIPTION_CACHE_MAX_USERS). A build is cached only if its user was not invalidated after it
+# started; for users whose stamp was dropped, the newest dropped stamp stands in for it.
+_SUBSCRIPTION_STAMP = [0]
+_SUBSCRIPTION_INVALIDATED: Dict[str, int] = {}
+_SUBSCRIPTION_DROPPED_STAMP = [0]
+
+# Write-path hook (index_client / unindex_client / updateClient): drop the user's cached links
+def invalidate_subscription(user_name: str) -> None:
+    if not user_name:
+        return
+    with _SUBSCRIPTION_LOCK:
+        SUBSCRIPTION_CACHE.pop(user_name, None)
+        _SUBSCRIPTION_STAMP[0] += 1
+        _SUBSCRIPTION_INVALIDATED.pop(user_name, None)
+        _SUBSCRIPTION_INVALIDATED[user_name] = _SUBSCRIPTION_STAMP[0]
+        while len(_SUBSCRIPTION_INVALIDATED) > SUBSCRIPTION_CACHE_MAX_USERS:
+            oldest = next(iter(_SUBSCRIPTION_INVALIDATED))
+            _SUBSCRIPTION_DROPPED_STAMP[0] = _SUBSCRIPTION_INVALIDATED.pop(oldest)
+
+# Enabled, unexpired clients with this exact email in one panel's inbounds -> [{'link', 'up', 'down', 'total', 'expiryTime'}]
+def collect_subscription_entries(panel_url: str, inbounds: List[Dict[str, Any]], user_name: str) -> List[Dict[str, Any]]:
+    now_ms = int(time.time() * 1000)
+    entries = []
+    for inbound in inbounds:
+        protocol = inbound.get('protocol', 'unknown').lower()
+        if protocol not in CONFIG_LINK_PROTOCOLS:
             continue
+        tables = get_inbound_tables(inbound)
+        client_index = find_email_in_tables(tables, user_name)
+        if client_index is None:
+            continue
+        client = tables['clients'][client_index]
+        if not client.get('enable', True):
+            continue
+        if 0 < int(client.get('expiryTime', 0)) <= now_ms:
+            continue
+        stat = get_client_stats_table(inbound, tables).get(user_name) or {}
+        entries.append({
+            'link': create_config_link(panel_url, int(inbound['port']), client, protocol),
+            'up': int(stat.get('up', 0)),
+            'down': int(stat.get('down', 0)),
+            'total': client_total_bytes(client),
+            'expiryTime': int(client.get('expiryTime', 0)),
+        })
+    return entries
+
+# Subscription-Userinfo header: summed traffic, total 0 if any link is unlimited, earliest expiry (seconds)
+def format_subscription_userinfo(entries: List[Dict[str, Any]]) -> str:
+    upload = sum(entry['up'] for entry in entries)
+    download = sum(entry['down'] for entry in entries)
+    total = 0 if any(entry['total'] <= 0 for entry in entries) else sum(entry['total'] for entry in entries)
+    expiries = [entry['expiryTime'] for entry in entries if entry['expiryTime'] > 0]
+    expire = min(expiries) // 1000 if expiries else 0
+    return f'upload={upload}; download={download}; total={total}; expire={expire}'
+
+def build_subscription(user_name: str, lang: str) -> Dict[str, Any]:
+    panels = get_all_panels_for_check()
+
+    def scan_panel(panel_name: str, panel_config: Dict[str, Any], stop_event: threading.Event) -> Union[List[Dict[str, Any]], None]:
+        panel_url, username, password = get_panel_credentials(panel_config)
+        if not panel_url or not username or not password:
+            return []
+        fetched = fetch_panel_inbounds(panel_name, panel_url, username, password, stop_event)
+        if not fetched:
+            return None
+        return collect_subscription_entries(panel_url, fetched[1], user_name)
+
+    scans = fan_out_panels(panels, scan_panel, first_match=False)
+    entries = []
+    unreachable = []
+    for panel_name in panels:
+        scan = scans.get(panel_name)
+        if isinstance(scan, list):
+            entries.extend(scan)
+        else:
+            unreachable.append(panel_name)
+
+    if not entries:
+        if unreachable:
+            return {'error': t('login_failed', lang), 'unreachable_panels': unreachable}
+        # Cached as a miss (links == 0)
+        return {'links': 0, 'complete': True}
+
+    body = base64.b64encode('\n'.join(entry['link'] for entry in entries).encode()).decode()
+    userinfo = format_subscription_userinfo(entries)
+    return {
+        'body': body,
+        'userinfo': userinfo,
+        'etag': hashlib.blake2b(f'{userinfo}{body}'.encode(), digest_size=16).hexdigest(),
+        'links': len(entries),
+        # Earliest link expiry (ms, 0 = none): the cached body is rebuilt once a link has expired
+        'expires_at': min((entry['expiryTime'] for entry in entries if entry['expiryTime'] > 0), default=0),
+        # Partial results (a panel was unreachable) are served but never cached
+        'complete': not unreachable,
+    }
 
-        for inbound in inbound_list['obj']:
-            try:
-                settings = json.loads(inbound.get('settings', '[]'))
-            except json.JSONDecodeError:
-                settings = {}
-
-            clients = settings.get('clients', [])
-
-            for client_index, client in enumerate(clients):
-                # Check if the email matches the username
-                if client.get('email', '') == user_name:
-                    
-                    protocol = inbound.get('protocol', 'unknown').lower()
-                    client_uid = client.get('id') or client.get('password') or client.get('email')
-
-                    return {
-                        'panel_index': panel_index,
-                        'panel_name': panel_name,
-                        'panel_url': panel_url,
-                        'cookie_header': cookie_header,
-                        'inbound_id': inbound['id'],
-                        'inbound_port': inbound['port'],
-                        'client_index': client_index,
-                        'client_email': user_name,
-                        'protocol': protocol,
-                        'client_data': client,
-                        'client_uid': client_uid,
-                        'inbound_protocol_settings': settings,
-                        'all_clients': clients
-                    }
-    return False
+# Cached subscription for a user. Hits never touch the panels; when the panels cannot be read,
+# an expired (but not invalidated) entry is served instead of an error.
+def get_subscription(user_name: str, lang: str) -> Dict[str, Any]:
+    now = time.time()
+    cached = SUBSCRIPTION_CACHE.get(user_name)
+    if cached is not None:
+        ttl = SUBSCRIPTION_CACHE_TTL if cached.get('links') else SUBSCRIPTION_MISS_TTL
+        if now - cached['built_at'] < ttl and not 0 < cached.get('expires_at', 0) <= now * 1000:
+            increment_metric('v2ray_api_subscription_cache_total', result='hit')
+            return cached
+    increment_metric('v2ray_api_subscription_cache_total', result='miss')
+
+    started = _SUBSCRIPTION_STAMP[0]
+    subscription = build_subscription(user_name, lang)
+    if 'error' in subscription:
+        return cached if cached is not None and cached.get('links') else subscription
+    if subscription['complete']:
+        subscription['built_at'] = now
+        with _SUBSCRIPTION_LOCK:
+            if _SUBSCRIPTION_INVALIDATED.get(user_name, _SUBSCRIPTION_DROPPED_STAMP[0]) <= started:
+                SUBSCRIPTION_CACHE.pop(user_name, None)
+                SUBSCRIPTION_CACHE[user_name] = subscription
+                while len(SUBSCRIPTION_CACHE) > SUBSCRIPTION_CACHE_MAX_USERS:
+                    del SUBSCRIPTION_CACHE[next(iter(SUBSCRIPTION_CACHE))]
+    return subscription
+
+# =========================================================================
+# SYSTEM STATS (aggregates maintained on every inbound-list refresh and API write)
+# =========================================================================
+
+# Counters are flat keys ('accounts.active', 'traffic.used', 'protocol.vless', 'tier.vless:Premium').
+# Each panel's latest aggregate is stored; a refresh or write applies only the difference to the
+# system-wide totals, so ?stats reads precomputed numbers and never walks clients.
+SYSTEM_STATS_TOTALS: Dict[str, int] = {}
+SYSTEM_STATS_PANELS: Dict[str, Dict[str, Any]] = {}
+_SYSTEM_STATS_LOCK = threading.Lock()
+_INBOUND_TIER_LABELS: Dict[int, str] = {}
+
+def inbound_tier_label(inbound: Dict[str, Any]) -> str:
+    if not _INBOUND_TIER_LABELS:
+        for protocol, tiers in INBOUND_MAPPING.items():
+            for tier, mapping in tiers.items():
+                _INBOUND_TIER_LABELS[mapping['port']] = f'{protocol}:{tier}'
+        _INBOUND_TIER_LABELS[REQUIRED_PORT] = REQUIRED_REMARK
+    return _INBOUND_TIER_LABELS.get(int(inbound.get('port', 0)), 'other')
+
+# totalGB holds bytes on current panels and plain GB on old ones
+def client_total_bytes(client: Dict[str, Any]) -> int:
+    total_gb = client.get('totalGB', 0)
+    return total_gb if total_gb > 1000000 else total_gb * 1073741824
+
+def client_status(client: Dict[str, Any], stat: Union[Dict[str, Any], None], now_ms: int) -> str:
+    if not client.get('enable', True):
+        return 'disabled'
+    expiry = int(client.get('expiryTime', 0))
+    total = client_total_bytes(client)
+    used = int(stat.get('up', 0)) + int(stat.get('down', 0)) if stat else 0
+    if 0 < expiry <= now_ms or (total > 0 and used >= total):
+        return 'expired'
+    return 'active'
+
+def _inbound_stats_counters(inbound: Dict[str, Any], now_ms: int) -> Dict[str, int]:
+    tables = get_inbound_tables(inbound)
+    stats_by_email = get_client_stats_table(inbound, tables)
+    protocol = inbound.get('protocol', 'unknown').lower()
+    client_count = len(tables['clients'])
+    counters = {
+        'accounts.total': client_count,
+        f'protocol.{protocol}': client_count,
+        f'tier.{inbound_tier_label(inbound)}': client_count,
+        'traffic.used': sum(int(stat.get('up', 0)) + int(stat.get('down', 0)) for stat in stats_by_email.values()),
+    }
+    for client in tables['clients']:
+        key = 'accounts.' + client_status(client, stats_by_email.get(client.get('email')), now_ms)
+        counters[key] = counters.get(key, 0) + 1
+    return counters
+
+def _apply_stats_delta(delta: Dict[str, int]) -> None:
+    for key, change in delta.items():
+        if change:
+            SYSTEM_STATS_TOTALS[key] = SYSTEM_STATS_TOTALS.get(key, 0) + change
+
+# Replace a panel's aggregate with one computed from a freshly downloaded inbound list
+def update_system_stats(panel_name: str, inbounds: List[Dict[str, Any]]) -> None:
+    now_ms = int(time.time() * 1000)
+    counters: Dict[str, int] = {}
+    for inbound in inbounds:
+        for key, value in _inbound_stats_counters(inbound, now_ms).items():
+            counters[key] = counters.get(key, 0) + value
+
+    with _SYSTEM_STATS_LOCK:
+        previous = SYSTEM_STATS_PANELS.get(panel_name, {}).get('counters', {})
+        _apply_stats_delta({key: counters.get(key, 0) - previous.get(key, 0) for key in set(counters) | set(previous)})
+        SYSTEM_STATS_PANELS[panel_name] = {'counters': counters, 'updated_at': time.time()}
+
+# Write-path hook: adjust a panel's counters right after this API adds or removes clients
+def adjust_system_stats(panel_name: str, delta: Dict[str, int]) -> None:
+    with _SYSTEM_STATS_LOCK:
+        panel_stats = SYSTEM_STATS_PANELS.setdefault(panel_name, {'counters': {}, 'updated_at': time.time()})
+        for key, change in delta.items():
+            panel_stats['counters'][key] = panel_stats['counters'].get(key, 0) + change
+        _apply_stats_delta(delta)
+
+# Counter changes for clients of one inbound being added (sign=1) or removed (sign=-1)
+def client_stats_delta(inbound: Dict[str, Any], count: int, status: str, sign: int = 1) -> Dict[str, int]:
+    protocol = inbound.get('protocol', 'unknown').lower()
+    return {
+        'accounts.total': sign * count,
+        f'accounts.{status}': sign * count,
+        f'protocol.{protocol}': sign * count,
+        f'tier.{inbound_tier_label(inbound)}': sign * count,
+    }
+
+def drop_panel_stats(panel_name: str) -> None:
+    with _SYSTEM_STATS_LOCK:
+        previous = SYSTEM_STATS_PANELS.pop(panel_name, {}).get('counters', {})
+        _apply_stats_delta({key: -value for key, value in previous.items()})
+
+# =========================================================================
+# TRAFFIC HISTORY STORE (SQLite rollups of clientStats for ?analytics)
+# =========================================================================
+
+# traffic_last keeps the last seen counters so each snapshot only adds the delta to its
+# hour and day buckets; queries never touch the panels.
+_TRAFFIC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS traffic_last (panel TEXT, email TEXT, up INTEGER, down INTEGER, PRIMARY KEY (panel, email));
+CREATE TABLE IF NOT EXISTS traffic_hourly (bucket INTEGER, panel TEXT, email TEXT, up INTEGER, down INTEGER, PRIMARY KEY (bucket, panel, email));
+CREATE TABLE IF NOT EXISTS traffic_daily (bucket INTEGER, panel TEXT, email TEXT, up INTEGER, down INTEGER, PRIMARY KEY (bucket, panel, email));
+"""
+_TRAFFIC_LAST_SNAPSHOT: Dict[str, float] = {}
+_TRAFFIC_WRITER: Dict[str, Any] = {'executor': None}
+_TRAFFIC_WRITER_LOCK = threading.Lock()
+
+def record_traffic_snapshot(panel_name: str, inbounds: List[Dict[str, Any]], taken_at: float = None) -> int:
+    taken_at = taken_at or time.time()
+    counters = {}
+    for inbound in inbounds:
+        for stat in inbound.get('clientStats') or inbound.get('clientInfo') or []:
+            if stat.get('email'):
+                counters[stat['email']] = (int(stat.get('up', 0)), int(stat.get('down', 0)))
+
+    conn = get_sqlite_connection(TRAFFIC_DB_FILE, _TRAFFIC_SCHEMA)
+    hour_bucket = int(taken_at // 3600) * 3600
+    day_bucket = int(taken_at // 86400) * 86400
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        last = {email: (up, down) for email, up, down in conn.execute('SELECT email, up, down FROM traffic_last WHERE panel = ?', (panel_name,))}
+        deltas = []
+        # The first snapshot of a panel is only a baseline: lifetime counters are not recent traffic
+        for email, (up, down) in (counters.items() if last else ()):
+            last_up, last_down = last.get(email, (0, 0))
+            # Counters that went backwards were reset on the panel: count from zero
+            delta_up = up - last_up if up >= last_up else up
+            delta_down = down - last_down if down >= last_down else down
+            if delta_up or delta_down:
+                deltas.append((email, delta_up, delta_down))
+
+        conn.executemany('INSERT OR REPLACE INTO traffic_last (panel, email, up, down) VALUES (?, ?, ?, ?)',
+                         [(panel_name, email, up, down) for email, (up, down) in counters.items()])
+        for table, bucket in (('traffic_hourly', hour_bucket), ('traffic_daily', day_bucket)):
+            conn.executemany(
+                f'INSERT INTO {table} (bucket, panel, email, up, down) VALUES (?, ?, ?, ?, ?) '
+                f'ON CONFLICT (bucket, panel, email) DO UPDATE SET up = up + excluded.up, down = down + excluded.down',
+                [(bucket, panel_name, email, delta_up, delta_down) for email, delta_up, delta_down in deltas])
+        conn.execute('DELETE FROM traffic_hourly WHERE bucket < ?', (hour_bucket - TRAFFIC_HOURLY_RETENTION_DAYS * 86400,))
+        conn.execute('DELETE FROM traffic_daily WHERE bucket < ?', (day_bucket - TRAFFIC_DAILY_RETENTION_DAYS * 86400,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return len(deltas)
+
+def _record_traffic_snapshot_safely(panel_name: str, inbounds: List[Dict[str, Any]], taken_at: float) -> None:
+    try:
+        record_traffic_snapshot(panel_name, inbounds, taken_at)
+    except (sqlite3.Error, OSError) as e:
+        app.logger.warning(f'Traffic snapshot failed for {panel_name}: {e}')
+
+# Called for every downloaded inbound list; at most one snapshot per panel per TRAFFIC_SNAPSHOT_INTERVAL,
+# written by a single background writer so request threads never wait on SQLite
+def maybe_record_traffic_snapshot(panel_name: str, inbounds: List[Dict[str, Any]]) -> None:
+    now = time.time()
+    with _TRAFFIC_WRITER_LOCK:
+        if now - _TRAFFIC_LAST_SNAPSHOT.get(panel_name, 0) < TRAFFIC_SNAPSHOT_INTERVAL:
+            return
+        _TRAFFIC_LAST_SNAPSHOT[panel_name] = now
+        if _TRAFFIC_WRITER['executor'] is None:
+            _TRAFFIC_WRITER['executor'] = ThreadPoolExecutor(max_workers=1, thread_name_prefix='traffic')
+    _TRAFFIC_WRITER['executor'].submit(_record_traffic_snapshot_safely, panel_name, inbounds, now)
+
+# Snapshot every panel now (for a cron hitting ?collect_traffic); uses the inbound-list cache
+def collect_traffic_snapshots(lang: str) -> Dict[str, Any]:
+    def snapshot_panel(panel_name: str, panel_config: Dict[str, Any], stop_event: threading.Event) -> Union[int, None]:
+        panel_url, username, password = get_panel_credentials(panel_config)
+        if not panel_url or not username or not password:
+            return None
+        fetched = fetch_panel_inbounds(panel_name, panel_url, username, password)
+        if not fetched:
+            return None
+        return record_traffic_snapshot(panel_name, fetched[1])
+
+    results = fan_out_panels(get_all_panels_for_check(), snapshot_panel, first_match=False)
+    return {
+        'panels': {panel_name: {'status': t('panel_status_online' if changed is not None else 'panel_status_offline', lang), 'clients_changed': changed or 0}
+                   for panel_name, changed in results.items()},
+    }
 
 # =========================================================================
 # ACCOUNT MANAGEMENT FUNCTIONS (Direct PHP Logic Translation)
@@ -629,70 +2081,167 @@ def get_all_panels_for_check() -> Dict[str, Any]:
     return {**static_panels, **dynamic_panels}
 
 
+# Account check result for a matched client (the shape returned by check_v2ray_account)
+def build_account_result(panel_name: str, inbound: Dict[str, Any], client: Dict[str, Any], stat: Dict[str, Any], matched_by: str) -> Dict[str, Any]:
+    total_bytes = client_total_bytes(client)
+    
+    return {
+        'panel_name': panel_name,
+        'protocol': inbound.get('protocol', 'unknown').lower(),
+        'email': client.get('email', ''),
+        'up': int(stat.get('up', 0)),
+        'down': int(stat.get('down', 0)),
+        'total': total_bytes,
+        'expiryTime': int(client.get('expiryTime', 0)),
+        'enable': bool(client.get('enable', True)),
+        'matched_by': matched_by
+    }
+
 # This function's logic is nearly identical to the PHP version, using the
 # Python helper functions and data structures.
 def check_v2ray_account(parsed_config: Dict[str, str], all_panels_config: Dict[str, Any]) -> Dict[str, Any]:
     all_panels_to_check = get_all_panels_for_check()
     lang = get_client_language()
 
-    for panel_name, panel_config in all_panels_to_check.items():
-        # Handle two possible structures: panels.php (nested 'config') vs JSON (flat)
-        panel_url = panel_config.get('url') or panel_config.get('config', {}).get('url')
-        username = panel_config.get('username') or panel_config.get('config', {}).get('username')
-        password = panel_config.get('password') or panel_config.get('config', {}).get('password')
+    def check_panel(panel_name: str, panel_config: Dict[str, Any], stop_event: threading.Event) -> Union[Dict[str, Any], bool]:
+        panel_url, username, password = get_panel_credentials(panel_config)
         
         if not panel_url or not username or not password:
-            continue
+            return False
             
-        cookie_header = api_login(panel_url, username, password)
+        fetched = fetch_panel_inbounds(panel_name, panel_url, username, password, stop_event)
+        if not fetched:
+            return False
+        return match_account_on_panel(panel_name, panel_url, fetched[1], parsed_config, location)
 
-        if not cookie_header:
-            continue
-            
-        inbound_list = api_call(panel_url, cookie_header, 'xui/inbound/list')
-        if not inbound_list or 'obj' not in inbound_list:
-            continue
+    # Indexed clients are looked up on their own panel only; fall back to a full scan on a miss
+    location = lookup_client_location(CLIENT_INDEX_FIELDS[parsed_config['type']], parsed_config['value'])
+    if location and location['panel'] in all_panels_to_check:
+        result = check_panel(location['panel'], all_panels_to_check[location['panel']], threading.Event())
+        if result:
+            return result
+        # The full scan would read that panel through the same cache or failed login, so skip it there
+        all_panels_to_check = {name: cfg for name, cfg in all_panels_to_check.items() if name != location['panel']}
 
-        for inbound in inbound_list['obj']:
-            try:
-                settings = json.loads(inbound.get('settings', '[]'))
-            except json.JSONDecodeError:
-                settings = {}
-            clients = settings.get('clients', [])
-            client_stats = inbound.get('clientStats') or inbound.get('clientInfo', [])
-            
-            for client in clients:
-                client_id = ''
-                match parsed_config['type']:
-                    case 'email':
-                        client_id = client.get('email', '')
-                    case 'vmess' | 'vless' | 'uuid':
-                        client_id = client.get('id', '')
-                    case 'shadowsocks' | 'trojan':
-                        client_id = client.get('password', '')
-                
-                if client_id.lower() == parsed_config['value'].lower():
-                    client_email = client.get('email', '')
-                    stat = next((s for s in client_stats if s.get('email') == client_email), None)
-                    
-                    if stat:
-                        total_gb = client.get('totalGB', 0)
-                        total_bytes = total_gb if total_gb > 1000000 else total_gb * 1073741824
-                        
-                        return {
-                            'panel_name': panel_name,
-                            'protocol': inbound.get('protocol', 'unknown').lower(),
-                            'email': client_email,
-                            'up': int(stat.get('up', 0)),
-                            'down': int(stat.get('down', 0)),
-                            'total': total_bytes,
-                            'expiryTime': int(client.get('expiryTime', 0)),
-                            'enable': bool(client.get('enable', True)),
-                            'matched_by': parsed_config['type']
-                        }
+    result = fan_out_panels(all_panels_to_check, check_panel)
+    if result:
+        return result
 
     return {'error': t('account_not_found', lang)}
 
+# Resolve many parsed configs with one inbound-list pass per panel. Returns one result per
+# input, in order, each shaped like check_v2ray_account's (parse errors are passed through).
+def check_v2ray_accounts_batch(parsed_configs: List[Dict[str, str]], all_panels_config: Dict[str, Any], lang: str) -> List[Dict[str, Any]]:
+    all_panels_to_check = get_all_panels_for_check()
+    pending = batch_lookup_keys(parsed_configs)
+
+    def scan_panel(panel_name: str, panel_config: Dict[str, Any], stop_event: threading.Event) -> Dict[int, Any]:
+        panel_url, username, password = get_panel_credentials(panel_config)
+        if not panel_url or not username or not password:
+            return {}
+        fetched = fetch_panel_inbounds(panel_name, panel_url, username, password, stop_event)
+        if not fetched:
+            return {}
+        return match_accounts_in_inbounds(panel_name, panel_url, fetched[1], pending)
+
+    panel_matches = fan_out_panels(all_panels_to_check, scan_panel, first_match=False) if pending else {}
+    return merge_batch_matches(parsed_configs, all_panels_to_check, panel_matches, lang)
+
+# The indexed client, checked against the inbound's current settings: it must still be in the
+# indexed inbound under the indexed email and carry the looked-up value -> account result or False
+def match_indexed_account(panel_name: str, inbounds: List[Dict[str, Any]], location: Dict[str, Any], parsed_config: Dict[str, str]) -> Union[Dict[str, Any], bool]:
+    inbound = next((item for item in inbounds if item.get('id') == location['inbound_id']), None)
+    if inbound is None:
+        return False
+    tables = get_inbound_tables(inbound)
+    client_index = find_email_in_tables(tables, location['email'])
+    if client_index is None:
+        return False
+    client = tables['clients'][client_index]
+    if str(client.get(CLIENT_INDEX_FIELDS[parsed_config['type']], '')).lower() != parsed_config['value'].lower():
+        return False
+    stat = get_client_stats_table(inbound, tables).get(client.get('email', ''))
+    return build_account_result(panel_name, inbound, client, stat, parsed_config['type']) if stat else False
+
+# Indexed lookup when the index points at this panel, else (or on a miss) a scan of all its inbounds
+def match_account_on_panel(panel_name: str, panel_url: str, inbounds: List[Dict[str, Any]], parsed_config: Dict[str, str], location: Union[Dict[str, Any], None]) -> Union[Dict[str, Any], bool]:
+    if location and location['panel'] == panel_name:
+        result = match_indexed_account(panel_name, inbounds, location, parsed_config)
+        if result:
+            return result
+    return match_account_in_inbounds(panel_name, panel_url, inbounds, parsed_config)
+
+# Look up one parsed config in a panel's inbounds -> account result or False
+def match_account_in_inbounds(panel_name: str, panel_url: str, inbounds: List[Dict[str, Any]], parsed_config: Dict[str, str]) -> Union[Dict[str, Any], bool]:
+    started = time.monotonic()
+    lookup_field = 'by_' + CLIENT_INDEX_FIELDS[parsed_config['type']]
+    lookup_value = parsed_config['value'].lower()
+
+    result = False
+    for inbound in inbounds:
+        tables = get_inbound_tables(inbound)
+        # Values are compared case-insensitively; the first client with traffic stats wins
+        for client_index in tables[lookup_field].get(lookup_value, ()):
+            client = tables['clients'][client_index]
+            stat = get_client_stats_table(inbound, tables).get(client.get('email', ''))
+            if stat:
+                result = build_account_result(panel_name, inbound, client, stat, parsed_config['type'])
+                break
+        if result:
+            break
+    observe_metric('v2ray_api_client_match_seconds', time.monotonic() - started, panel=metric_panel_label(panel_url), mode='single')
+    return result
+
+# (position, lookup_field, lookup_value, matched_by) for every config that parsed
+def batch_lookup_keys(parsed_configs: List[Dict[str, str]]) -> List[tuple]:
+    return [
+        (position, 'by_' + CLIENT_INDEX_FIELDS[parsed['type']], parsed['value'].lower(), parsed['type'])
+        for position, parsed in enumerate(parsed_configs) if 'error' not in parsed
+    ]
+
+# One pass over a panel's inbounds for every pending lookup -> {position: account result}
+def match_accounts_in_inbounds(panel_name: str, panel_url: str, inbounds: List[Dict[str, Any]], pending: List[tuple]) -> Dict[int, Any]:
+    started = time.monotonic()
+    matches: Dict[int, Any] = {}
+    for inbound in inbounds:
+        tables = get_inbound_tables(inbound)
+        stats_by_email = None
+        for position, lookup_field, lookup_value, matched_by in pending:
+            if position in matches:
+                continue
+            for client_index in tables[lookup_field].get(lookup_value, ()):
+                client = tables['clients'][client_index]
+                if stats_by_email is None:
+                    stats_by_email = get_client_stats_table(inbound, tables)
+                stat = stats_by_email.get(client.get('email', ''))
+                if stat:
+                    matches[position] = build_account_result(panel_name, inbound, client, stat, matched_by)
+                    break
+    observe_metric('v2ray_api_client_match_seconds', time.monotonic() - started, panel=metric_panel_label(panel_url), mode='batch')
+    return matches
+
+def merge_batch_matches(parsed_configs: List[Dict[str, str]], panels: Dict[str, Any], panel_matches: Dict[str, Any], lang: str) -> List[Dict[str, Any]]:
+    # Panel order decides which match wins, same as a sequential sweep would
+    results: Dict[int, Any] = {}
+    for panel_name in panels:
+        for position, account in (panel_matches.get(panel_name) or {}).items():
+            results.setdefault(position, account)
+
+    return [
+        parsed if 'error' in parsed else results.get(position, {'error': t('account_not_found', lang)})
+        for position, parsed in enumerate(parsed_configs)
+    ]
+
+def format_batch_results(batch_configs: List[Any], batch_results: List[Dict[str, Any]], lang: str) -> Dict[str, Any]:
+    return {
+        'results': [
+            {'config': item, 'found': 'error' not in result, 'account': format_account_fields(result, lang)}
+            for item, result in zip(batch_configs, batch_results)
+        ],
+        'count': len(batch_results),
+        'found': sum(1 for result in batch_results if 'error' not in result),
+    }
+
 # ... (Other main functions like create_trial_account, create_premium_account,
 # delete_premium_account, modify_account_details, toggle_account_status,
 # reset_account_traffic, transfer_account, get_online_users, and
@@ -711,9 +2260,23 @@ def reset_account_traffic(user_name: str, panel_index: int, lang: str) -> Dict[s
     # Placeholder for the actual logic
     return {'error': t('system_error', lang), 'details': 'Traffic reset function not fully implemented in Python placeholder.'}
 
+# One-client drain_panel run
 def transfer_account(user_name: str, from_panel_index: int, to_panel_index: int, panels: Dict[int, Any], lang: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'Transfer function not fully implemented in Python placeholder.'}
+    drained = drain_panel(from_panel_index, to_panel_index, panels, lang, users={user_name})
+    if 'error' in drained:
+        return drained
+    entry = drained['clients'].get(user_name)
+    if entry is None:
+        return {'error': t('account_not_found', lang)}
+    if entry['status'] != 'moved':
+        return {'error': entry.get('error') or t('system_error', lang), 'email': user_name, **entry}
+    return {
+        'message': t('account_transferred', lang),
+        'email': user_name,
+        'from_panel': drained['source_panel'],
+        'to_panel': drained['destination_panel'],
+        **entry,
+    }
 
 def delete_premium_account(user_name: str, panel_index: int, panels: Dict[int, Any], lang: str) -> Dict[str, Any]:
     # Placeholder for the actual logic
@@ -731,43 +2294,969 @@ def get_trial_account_key(telegram_user_id: str, trial_panels: List[Any], lang:
     # Placeholder for the actual logic
     return {'error': t('system_error', lang), 'details': 'Trial key retrieve function not fully implemented in Python placeholder.'}
 
-def delete_expired_trial_accounts(trial_panels: List[Any], lang: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'Expired trial delete function not fully implemented in Python placeholder.'}
+# Inbound update payload: the inbound as listed by the panel with a replaced client list
+def build_inbound_update(inbound: Dict[str, Any], settings: Dict[str, Any], clients: List[Dict[str, Any]]) -> Dict[str, Any]:
+    payload = {key: value for key, value in inbound.items() if key not in ('clientStats', 'clientInfo')}
+    payload['settings'] = json.dumps({**settings, 'clients': clients}, ensure_ascii=False)
+    return payload
+
+# Removes expired clients from each trial panel's trial inbound with ONE inbound update per panel,
+# computed from a single inbound-list fetch. dry_run only reports; limit caps deletions per run.
+def delete_expired_trial_accounts(trial_panels: List[Any], lang: str, dry_run: bool = False, limit: int = 0) -> Dict[str, Any]:
+    panels = {panel['name']: panel for panel in trial_panels}
+    if not panels:
+        return {'error': t('no_trial_panels', lang)}
+    max_deletions = min(limit, DELEXP_MAX_PER_RUN) if limit > 0 else DELEXP_MAX_PER_RUN
+    now_ms = int(time.time() * 1000)
+
+    # Phase 1: one fresh inbound list per panel -> expired clients of the trial inbound
+    def find_expired(panel_name: str, panel: Dict[str, Any], stop_event: threading.Event) -> Dict[str, Any]:
+        started = time.monotonic()
+        panel_url, username, password = get_panel_credentials(panel)
+        fetched = fetch_panel_inbounds(panel_name, panel_url, username, password, fresh=True)
+        if not fetched:
+            return {'error': t('login_failed', lang), 'elapsed': time.monotonic() - started}
+        cookie_header, inbounds = fetched
+        inbound = find_mapped_inbound(inbounds, 'trial', REQUIRED_REMARK)
+        if inbound is None:
+            return {'error': t('inbound_not_found', lang), 'elapsed': time.monotonic() - started}
+
+        tables = get_inbound_tables(inbound)
+        # expiryTime < 0 means "starts on first use" in 3x-ui, so only positive past timestamps are expired
+        expired = [client for client in tables['clients'] if 0 < int(client.get('expiryTime', 0)) <= now_ms]
+        return {
+            'panel_url': panel_url, 'credentials': (username, password), 'cookie': cookie_header,
+            'inbound': inbound, 'tables': tables, 'expired': expired, 'elapsed': time.monotonic() - started,
+        }
+
+    scans = fan_out_panels(panels, find_expired, first_match=False)
+
+    # Phase 2: apply the per-run cap in panel order
+    remaining_budget = max_deletions
+    for panel_name in panels:
+        scan = scans.get(panel_name) or {'error': t('system_error', lang), 'elapsed': 0.0}
+        scans[panel_name] = scan
+        if 'error' not in scan:
+            scan['to_delete'] = scan['expired'][:remaining_budget]
+            remaining_budget -= len(scan['to_delete'])
+
+    # Phase 3: one batched inbound update per panel. The inbound is re-read right before the update and
+    # only the selected emails that are still expired are dropped, so clients created or renewed since
+    # the scan are kept.
+    def purge_panel(panel_name: str, scan: Dict[str, Any], stop_event: threading.Event) -> Dict[str, Any]:
+        if 'error' in scan:
+            return {'error': scan['error'], 'elapsed_ms': int(scan['elapsed'] * 1000)}
+        started = time.monotonic()
+        report = {'inbound_id': scan['inbound']['id'], 'expired_found': len(scan['expired']), 'deleted': 0,
+                  'emails': [client.get('email', '') for client in scan['to_delete']]}
+        if scan['to_delete'] and not dry_run:
+            username, password = scan['credentials']
+            fetched = fetch_panel_inbounds(panel_name, scan['panel_url'], username, password, fresh=True)
+            inbound = next((item for item in fetched[1] if item.get('id') == scan['inbound']['id']), None) if fetched else None
+            if inbound is None:
+                report['error'] = t('login_failed', lang) if not fetched else t('inbound_not_found', lang)
+                report['elapsed_ms'] = int((scan['elapsed'] + time.monotonic() - started) * 1000)
+                return report
+            tables = get_inbound_tables(inbound)
+            delete_emails = set(report['emails'])
+            removed = [client for client in tables['clients']
+                       if client.get('email', '') in delete_emails and 0 < int(client.get('expiryTime', 0)) <= now_ms]
+            removed_ids = {id(client) for client in removed}
+            kept = [client for client in tables['clients'] if id(client) not in removed_ids]
+            payload = build_inbound_update(inbound, tables['settings'], kept)
+            result = api_call(scan['panel_url'], fetched[0], f"xui/inbound/update/{inbound['id']}", payload, credentials=scan['credentials'])
+            invalidate_inbound_list(scan['panel_url'])
+            if result and result.get('success'):
+                report['deleted'] = len(removed)
+                report['emails'] = [client.get('email', '') for client in removed]
+                for client in removed:
+                    unindex_client(client)
+                adjust_system_stats(panel_name, client_stats_delta(inbound, report['deleted'], 'expired', -1))
+            else:
+                report['error'] = (result or {}).get('msg') or t('system_error', lang)
+        report['elapsed_ms'] = int((scan['elapsed'] + time.monotonic() - started) * 1000)
+        return report
+
+    reports = fan_out_panels(scans, purge_panel, first_match=False)
+    panel_reports = {panel_name: reports.get(panel_name) for panel_name in panels}
+    total_expired = sum(report.get('expired_found', 0) for report in panel_reports.values() if report)
+    total_deleted = sum(report.get('deleted', 0) for report in panel_reports.values() if report)
+    if total_deleted and not dry_run:
+        invalidate_placement_scores()
+
+    return {
+        'message': t('expired_deleted' if total_expired else 'no_expired_accounts', lang),
+        'dry_run': dry_run,
+        'limit': max_deletions,
+        'total_expired': total_expired,
+        'total_deleted': total_deleted,
+        'panels': panel_reports,
+    }
+
+_ONLINE_USERS_CACHE: Dict[str, Any] = {'computed_at': 0.0, 'panels': {}}
+_ONLINE_USERS_LOCK = threading.Lock()
+
+# One parallel sweep of every panel's onlines endpoint -> {panel_name: [emails] or None if unreachable}
+def _sweep_online_users() -> Dict[str, Any]:
+    def fetch_online(panel_name: str, panel_config: Dict[str, Any], stop_event: threading.Event) -> Union[List[str], None]:
+        panel_url, username, password = get_panel_credentials(panel_config)
+        if not panel_url or not username or not password:
+            return None
+        cookie_header = get_panel_session(panel_url, username, password)
+        if not cookie_header:
+            return None
+        result = api_call(panel_url, cookie_header, 'xui/inbound/onlines', credentials=(username, password))
+        if not result or not result.get('success'):
+            return None
+        return [str(email) for email in (result.get('obj') or [])]
+
+    all_panels = get_all_panels_for_check()
+    results = fan_out_panels(all_panels, fetch_online, first_match=False)
+    return {panel_name: results.get(panel_name) for panel_name in all_panels}
 
 def get_online_users(all_panels_config: Dict[str, Any], lang: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'Online users function not fully implemented in Python placeholder.'}
+    cached = _ONLINE_USERS_CACHE
+    is_cached = time.time() - cached['computed_at'] < ONLINE_USERS_CACHE_TTL
+    if not is_cached:
+        # Concurrent pollers wait for the sweep already in progress instead of starting their own
+        with _ONLINE_USERS_LOCK:
+            cached = _ONLINE_USERS_CACHE
+            is_cached = time.time() - cached['computed_at'] < ONLINE_USERS_CACHE_TTL
+            if not is_cached:
+                cached = {'computed_at': time.time(), 'panels': _sweep_online_users()}
+                _ONLINE_USERS_CACHE.update(cached)
+    return format_online_users(cached, is_cached, lang)
+
+def format_online_users(cached: Dict[str, Any], is_cached: bool, lang: str) -> Dict[str, Any]:
+    online_users = sorted({email for emails in cached['panels'].values() if emails for email in emails})
+    panels = {
+        panel_name: {
+            'status': t('panel_status_online' if emails is not None else 'panel_status_offline', lang),
+            'online_count': len(emails) if emails is not None else 0,
+        }
+        for panel_name, emails in cached['panels'].items()
+    }
+    return {
+        'message': t('online_users_retrieved' if online_users else 'no_online_users', lang),
+        'total_online': len(online_users),
+        'online_users': online_users,
+        'panels': panels,
+        'cached': is_cached,
+        'generated_at': int(cached['computed_at']),
+    }
 
-def get_system_stats(premium_panels: Dict[int, Any], trial_panels: List[Any], all_panels_config: Dict[str, Any]) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'System stats function not fully implemented in Python placeholder.'}
+def _stats_section(counters: Dict[str, int], prefix: str) -> Dict[str, int]:
+    return {key[len(prefix):]: value for key, value in sorted(counters.items()) if key.startswith(prefix) and value}
 
-def get_traffic_analytics(all_panels_config: Dict[str, Any], period: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'Traffic analytics function not fully implemented in Python placeholder.'}
+def get_system_stats(premium_panels: Dict[int, Any], trial_panels: List[Any], all_panels_config: Dict[str, Any], lang: str = 'en') -> Dict[str, Any]:
+    all_panels = get_all_panels_for_check()
+    # Panels that have never been downloaded are fetched in the background for the next call
+    for panel_name, panel_config in all_panels.items():
+        if panel_name not in SYSTEM_STATS_PANELS:
+            panel_url, username, password = get_panel_credentials(panel_config)
+            if panel_url and username and password:
+                warm_panel_inbounds(panel_name, panel_url, username, password)
 
-def get_optimal_panel_for_creation(panels: Dict[int, Any], account_type: str) -> int:
-    # Placeholder for the actual logic
-    return next(iter(panels.keys()), 1)
+    with _SYSTEM_STATS_LOCK:
+        totals = dict(SYSTEM_STATS_TOTALS)
+        panel_stats = {name: {'counters': dict(entry['counters']), 'updated_at': entry['updated_at']}
+                       for name, entry in SYSTEM_STATS_PANELS.items() if name in all_panels}
+
+    return {
+        'accounts': {key: totals.get(f'accounts.{key}', 0) for key in ('total', 'active', 'expired', 'disabled')},
+        'traffic_used': format_bytes(totals.get('traffic.used', 0)),
+        'protocols': _stats_section(totals, 'protocol.'),
+        'tiers': _stats_section(totals, 'tier.'),
+        'panels': {
+            name: {
+                'accounts': {key: entry['counters'].get(f'accounts.{key}', 0) for key in ('total', 'active', 'expired', 'disabled')},
+                'traffic_used': format_bytes(entry['counters'].get('traffic.used', 0)),
+                'updated_at': int(entry['updated_at']),
+            }
+            for name, entry in panel_stats.items()
+        },
+        'panels_configured': len(all_panels),
+        'panels_reporting': len(panel_stats),
+        'premium_panels': len(premium_panels),
+        'trial_panels': len(trial_panels),
+    }
+
+ANALYTICS_PERIOD_PATTERN = re.compile(r'^(\d{1,3})([hd])$')
+
+# Traffic totals, per-panel totals, a time series and the top users for a period like 24h, 7d or 30d.
+# Up to 48h is answered from hourly buckets, longer periods from daily buckets; the aggregation is
+# done by SQLite (GROUP BY over the rollup tables), never by walking panels.
+def get_traffic_analytics(all_panels_config: Dict[str, Any], period: str, lang: str = 'en') -> Dict[str, Any]:
+    match = ANALYTICS_PERIOD_PATTERN.match(period or '')
+    if not match or int(match.group(1)) <= 0:
+        return {'error': 'Invalid period. Use e.g. 24h, 7d or 30d.'}
+    amount, unit = int(match.group(1)), match.group(2)
+    period_seconds = amount * (3600 if unit == 'h' else 86400)
+    if period_seconds > TRAFFIC_DAILY_RETENTION_DAYS * 86400:
+        return {'error': f'Period too long. History is kept for {TRAFFIC_DAILY_RETENTION_DAYS} days.'}
+
+    table, bucket_size = ('traffic_hourly', 3600) if period_seconds <= 48 * 3600 else ('traffic_daily', 86400)
+    since = int((time.time() - period_seconds) // bucket_size) * bucket_size
+
+    try:
+        conn = get_sqlite_connection(TRAFFIC_DB_FILE, _TRAFFIC_SCHEMA)
+        total_up, total_down, active_users = conn.execute(
+            f'SELECT COALESCE(SUM(up), 0), COALESCE(SUM(down), 0), COUNT(DISTINCT email) FROM {table} WHERE bucket >= ?', (since,)).fetchone()
+        per_panel = conn.execute(
+            f'SELECT panel, SUM(up), SUM(down), COUNT(DISTINCT email) FROM {table} WHERE bucket >= ? GROUP BY panel ORDER BY panel', (since,)).fetchall()
+        series = conn.execute(
+            f'SELECT bucket, SUM(up), SUM(down) FROM {table} WHERE bucket >= ? GROUP BY bucket ORDER BY bucket', (since,)).fetchall()
+        top_users = conn.execute(
+            f'SELECT email, SUM(up) + SUM(down) AS used FROM {table} WHERE bucket >= ? GROUP BY email ORDER BY used DESC LIMIT 10', (since,)).fetchall()
+    except sqlite3.Error as e:
+        return {'error': t('file_access_failed', lang), 'details': str(e)}
+
+    return {
+        'period': period,
+        'granularity': 'hourly' if bucket_size == 3600 else 'daily',
+        'since': since,
+        'active_users': active_users,
+        'upload': format_bytes(total_up),
+        'download': format_bytes(total_down),
+        'used': format_bytes(total_up + total_down),
+        'panels': {panel: {'upload': format_bytes(up), 'download': format_bytes(down), 'used': format_bytes(up + down), 'active_users': users}
+                   for panel, up, down, users in per_panel},
+        'series': [{'bucket': bucket, 'up': up, 'down': down} for bucket, up, down in series],
+        'top_users': [{'email': email, 'used': format_bytes(used)} for email, used in top_users],
+    }
+
+# Inbound that INBOUND_MAPPING assigns to a protocol/tier (matched by port), or the trial inbound
+def find_mapped_inbound(inbounds: List[Dict[str, Any]], protocol: str, tier: str) -> Union[Dict[str, Any], None]:
+    if protocol == 'trial':
+        target_port, target_remark = REQUIRED_PORT, REQUIRED_REMARK
+    else:
+        mapping = INBOUND_MAPPING.get(protocol, {}).get(tier)
+        if not mapping:
+            return None
+        target_port, target_remark = mapping['port'], mapping['remark']
+    by_remark = None
+    for inbound in inbounds:
+        if int(inbound.get('port', 0)) == target_port:
+            return inbound
+        if by_remark is None and inbound.get('remark') == target_remark:
+            by_remark = inbound
+    return by_remark
+
+_PLACEMENT_CACHE: Dict[tuple, Dict[str, Any]] = {}
+
+# Placement score for one panel (lower is better), None when the panel cannot take new clients.
+# Only in-memory data is used: cached inbound lists, latency/error EWMAs and breaker state.
+def score_panel_for_creation(panel: Dict[str, Any], protocol: str, tier: str) -> Union[Dict[str, Any], None]:
+    panel_url, username, password = get_panel_credentials(panel)
+    if not panel_url or _circuit_breaker(panel_url)['state'] == 'open':
+        return None
+
+    capacity = int(panel.get('max_clients') or panel.get('config', {}).get('max_clients') or PANEL_MAX_CLIENTS_PER_INBOUND)
+    entry = INBOUND_LIST_CACHE.get(panel_url.rstrip('/'))
+    if entry is None:
+        # Unknown load: warm the cache in the background and score the panel as half full
+        warm_panel_inbounds(panel.get('name', panel_url), panel_url, username, password)
+        client_count, load = None, 0.5
+    else:
+        inbound = find_mapped_inbound(entry['inbounds'], protocol, tier)
+        if inbound is None:
+            return None
+        client_count = len(get_inbound_tables(inbound)['clients'])
+        if client_count >= capacity:
+            return None
+        load = client_count / capacity
+
+    health = _panel_health(panel_url)
+    latency = health['latency_ewma']
+    latency_penalty = 0.5 if latency is None else min(1.0, latency / PANEL_READ_TIMEOUT)
+    score = (PLACEMENT_WEIGHTS['load'] * load
+             + PLACEMENT_WEIGHTS['latency'] * latency_penalty
+             + PLACEMENT_WEIGHTS['errors'] * health['error_ewma'])
+    return {
+        'score': round(score, 4), 'clients': client_count, 'capacity': capacity,
+        'free_capacity': None if client_count is None else capacity - client_count,
+        'latency_ms': None if latency is None else round(latency * 1000, 1),
+        'error_rate': round(health['error_ewma'], 4),
+    }
+
+# Scores every candidate panel (O(panels), no logins) and caches the result for PLACEMENT_SCORE_TTL
+def rank_panels_for_creation(panels: Union[Dict[int, Any], List[Any]], account_type: str, protocol: str = DEFAULT_PREMIUM_PROTOCOL, tier: str = DEFAULT_PREMIUM_TIER) -> Dict[str, Any]:
+    if isinstance(panels, list):
+        panels = {index: panel for index, panel in enumerate(panels, start=1)}
+    if account_type != 'premium':
+        protocol, tier = 'trial', REQUIRED_REMARK
+
+    cache_key = (account_type, protocol, tier, tuple((index, panel.get('name')) for index, panel in panels.items()))
+    cached = _PLACEMENT_CACHE.get(cache_key)
+    if cached and time.time() - cached['computed_at'] < PLACEMENT_SCORE_TTL:
+        return cached
+
+    scores = {}
+    best_index, best_score = None, None
+    for index, panel in panels.items():
+        panel_score = score_panel_for_creation(panel, protocol, tier)
+        scores[index] = panel_score
+        if panel_score is not None and (best_score is None or panel_score['score'] < best_score):
+            best_index, best_score = index, panel_score['score']
+
+    ranking = {'best_index': best_index, 'scores': scores, 'computed_at': time.time()}
+    # Only cache once every panel had real data, so warm-up guesses are not pinned for the whole TTL
+    if all(score is None or score['clients'] is not None for score in scores.values()):
+        _PLACEMENT_CACHE[cache_key] = ranking
+    return ranking
+
+def get_optimal_panel_for_creation(panels: Dict[int, Any], account_type: str, protocol: str = DEFAULT_PREMIUM_PROTOCOL, tier: str = DEFAULT_PREMIUM_TIER) -> int:
+    best_index = rank_panels_for_creation(panels, account_type, protocol, tier)['best_index']
+    if best_index is None:
+        # No panel reported spare capacity: keep the old behaviour of using the first panel
+        return next(iter(panels.keys()), 1) if isinstance(panels, dict) else 1
+    return best_index
+
+# Drop cached placement scores (after this API adds clients, so the next pick sees the new load)
+def invalidate_placement_scores() -> None:
+    _PLACEMENT_CACHE.clear()
+
+# New 3x-ui client entry for a protocol. totalGB is stored in bytes, expiryTime in ms (0 = never).
+def build_premium_client(protocol: str, email: str, gb_limit: int, time_limit_days: int, inbound_settings: Dict[str, Any]) -> Dict[str, Any]:
+    client = {
+        'email': email,
+        'enable': True,
+        'limitIp': 0,
+        'totalGB': int(gb_limit) * 1073741824 if gb_limit > 0 else 0,
+        'expiryTime': int((time.time() + time_limit_days * 86400) * 1000) if time_limit_days > 0 else PREMIUM_EXPIRY_TIME_MS_UNLIMITED,
+        'tgId': '',
+        'subId': uuid.uuid4().hex[:16],
+        'reset': 0,
+    }
+    if protocol in ('vless', 'vmess'):
+        client['id'] = str(uuid.uuid4())
+        if protocol == 'vless':
+            client['flow'] = ''
+    elif protocol == 'trojan':
+        client['password'] = generate_random_key(16)
+    elif protocol == 'shadowsocks':
+        client['password'] = generate_random_key(32)
+        client['method'] = inbound_settings.get('method', SHADOWSOCKS_METHOD)
+    return client
+
+# Target panel (panel_index <= 0 lets the placement engine choose) and its INBOUND_MAPPING inbound,
+# from one fresh inbound-list read -> dict with panel, credentials, cookie, inbounds, inbound, tables
+def resolve_premium_inbound(panel_index: int, protocol: str, tier: str, premium_panels: Dict[int, Any], lang: str) -> Dict[str, Any]:
+    if tier not in INBOUND_MAPPING.get(protocol, {}):
+        return {'error': f'Unsupported protocol/tier combination: {protocol}/{tier}'}
+    if panel_index <= 0:
+        panel_index = get_optimal_panel_for_creation(premium_panels, 'premium', protocol, tier)
+    if panel_index not in premium_panels:
+        return {'error': t('invalid_panel', lang)}
+
+    panel = premium_panels[panel_index]
+    panel_url, username, password = get_panel_credentials(panel)
+    fetched = fetch_panel_inbounds(panel['name'], panel_url, username, password, fresh=True)
+    if not fetched:
+        return {'error': t('login_failed', lang), 'panel_name': panel['name']}
+    cookie_header, inbounds = fetched
+
+    inbound = find_mapped_inbound(inbounds, protocol, tier)
+    if inbound is None:
+        return {'error': t('inbound_not_found', lang), 'panel_name': panel['name']}
+    return {
+        'panel_index': panel_index, 'panel': panel, 'panel_url': panel_url, 'credentials': (username, password),
+        'cookie': cookie_header, 'inbounds': inbounds, 'inbound': inbound, 'tables': get_inbound_tables(inbound),
+    }
+
+# Lowercased emails used by any inbound on the panel. 3x-ui rejects an addClient payload
+# when an email is already used anywhere on the panel, not just on the target inbound.
+def panel_taken_emails(inbounds: List[Dict[str, Any]]) -> set:
+    taken = set()
+    for inbound in inbounds:
+        taken.update(get_inbound_tables(inbound)['by_email'])
+    return taken
+
+# One addClient for all clients, then the index / stats / cache hooks -> panel response or False
+def add_premium_clients(target: Dict[str, Any], clients: List[Dict[str, Any]]) -> Union[Dict[str, Any], bool]:
+    inbound = target['inbound']
+    result = api_call(target['panel_url'], target['cookie'], 'xui/inbound/addClient',
+                      {'id': inbound['id'], 'settings': json.dumps({'clients': clients})},
+                      credentials=target['credentials'])
+    if not result or not result.get('success'):
+        return result
+
+    panel_name = target['panel']['name']
+    invalidate_inbound_list(target['panel_url'])
+    invalidate_placement_scores()
+    for client in clients:
+        index_client(panel_name, inbound['id'], client)
+    adjust_system_stats(panel_name, client_stats_delta(inbound, len(clients), 'active'))
+    return result
 
 def create_premium_account(gb_limit: int, user_name: str, time_limit_days: int, panel_index: int, protocol: str, tier: str, premium_panels: Dict[int, Any], lang: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'Premium create function not fully implemented in Python placeholder.'}
+    if not validate_user_name(user_name):
+        return {'error': t('invalid_username', lang)}
+    target = resolve_premium_inbound(panel_index, protocol, tier, premium_panels, lang)
+    if 'error' in target:
+        return target
+    if user_name.lower() in panel_taken_emails(target['inbounds']):
+        return {'error': f'Account already exists on this panel: {user_name}'}
+
+    client = build_premium_client(protocol, user_name, gb_limit, time_limit_days, target['tables']['settings'])
+    result = add_premium_clients(target, [client])
+    if not result or not result.get('success'):
+        return {'error': t('system_error', lang), 'details': (result or {}).get('msg', 'addClient failed')}
 
-# JSON Panel Management Dummies
+    return {
+        'message': t('account_created', lang),
+        'panel_index': target['panel_index'],
+        'panel_name': target['panel']['name'],
+        'protocol': protocol,
+        'tier': tier,
+        'email': user_name,
+        'config_link': create_config_link(target['panel_url'], int(target['inbound']['port']), client, protocol),
+        'total': client['totalGB'],
+        'expiryTime': client['expiryTime'],
+    }
+
+# Many premium accounts on one panel/inbound: one inbound read and one addClient for every valid name.
+# Names that are invalid, repeated, or already used on the panel are reported per name and skipped.
+def create_premium_accounts_bulk(gb_limit: int, user_names: List[str], time_limit_days: int, panel_index: int, protocol: str, tier: str, premium_panels: Dict[int, Any], lang: str) -> Dict[str, Any]:
+    target = resolve_premium_inbound(panel_index, protocol, tier, premium_panels, lang)
+    if 'error' in target:
+        return target
+
+    taken = panel_taken_emails(target['inbounds'])
+
+    accounts = []
+    clients = []
+    for user_name in user_names:
+        if not validate_user_name(user_name):
+            accounts.append({'email': user_name, 'error': t('invalid_username', lang)})
+            continue
+        if user_name.lower() in taken:
+            accounts.append({'email': user_name, 'error': f'Account already exists on this panel: {user_name}'})
+            continue
+        taken.add(user_name.lower())
+        client = build_premium_client(protocol, user_name, gb_limit, time_limit_days, target['tables']['settings'])
+        clients.append(client)
+        accounts.append({'email': user_name, 'client': client})
+
+    if not clients:
+        return {'error': 'No new valid account names provided.', 'accounts': accounts}
+    result = add_premium_clients(target, clients)
+    if not result or not result.get('success'):
+        return {'error': t('system_error', lang), 'details': (result or {}).get('msg', 'addClient failed'), 'panel_name': target['panel']['name']}
+
+    config_links = []
+    for account in accounts:
+        client = account.pop('client', None)
+        if client is None:
+            continue
+        account['config_link'] = create_config_link(target['panel_url'], int(target['inbound']['port']), client, protocol)
+        account['total'] = client['totalGB']
+        account['expiryTime'] = client['expiryTime']
+        config_links.append(account['config_link'])
+
+    return {
+        'message': t('account_created', lang),
+        'panel_index': target['panel_index'],
+        'panel_name': target['panel']['name'],
+        'protocol': protocol,
+        'tier': tier,
+        'created': len(clients),
+        'failed': len(accounts) - len(clients),
+        'accounts': accounts,
+        'config_links': config_links,
+    }
+
+# JSON Panel Management (bot endpoints)
 def add_panel_to_json(name: str, url: str, username: str, password: str, type_str: str, lang: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'Add panel function not fully implemented in Python placeholder.'}
+    def add(panels: Dict[str, Any]) -> Dict[str, Any]:
+        if name in panels or name in ALL_PANELS_CONFIG:
+            return {'error': f'Panel name already exists: {name}'}
+        panel = {'url': url, 'username': username, 'password': password, 'type': type_str}
+        panel['id'] = _stable_panel_id(panel)
+        panels[name] = panel
+        return {'message': t('panel_added', lang), 'panel_id': panel['id'], 'panel_name': name, 'type': type_str}
+
+    result = update_dynamic_panels(add)
+    if result.get('error') == 'file_access_failed':
+        result['error'] = t('file_access_failed', lang)
+    return result
 
 def delete_panel_from_json(id_str: str, lang: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'Delete panel function not fully implemented in Python placeholder.'}
+    def delete(panels: Dict[str, Any]) -> Dict[str, Any]:
+        for name, panel in list(panels.items()):
+            if panel.get('id') == id_str:
+                del panels[name]
+                drop_panel_stats(name)
+                return {'message': t('panel_deleted', lang), 'panel_id': id_str, 'panel_name': name}
+        return {'error': t('invalid_panel_id', lang)}
+
+    result = update_dynamic_panels(delete)
+    if result.get('error') == 'file_access_failed':
+        result['error'] = t('file_access_failed', lang)
+    return result
 
 def list_panels_from_json(lang: str) -> Dict[str, Any]:
-    # Placeholder for the actual logic
-    return {'error': t('system_error', lang), 'details': 'List panels function not fully implemented in Python placeholder.'}
+    panels = [
+        {'id': panel['id'], 'name': name, 'url': panel['url'], 'type': panel['type']}
+        for name, panel in get_dynamic_panels_from_json().items()
+    ]
+    return {'message': t('panel_list_retrieved', lang), 'panels': panels, 'count': len(panels)}
+
+
+# =========================================================================
+# PANEL DRAIN (bulk client migration between panels)
+# =========================================================================
+
+DRAIN_CHECKPOINT_NAME_PATTERN = re.compile(r'[^A-Za-z0-9_.-]')
+
+# (protocol, tier) an inbound serves, by INBOUND_MAPPING port first and remark second (as find_mapped_inbound)
+def inbound_mapping_key(inbound: Dict[str, Any]) -> Union[tuple, None]:
+    candidates = [('trial', REQUIRED_REMARK, REQUIRED_PORT, REQUIRED_REMARK)]
+    for protocol, tiers in INBOUND_MAPPING.items():
+        for tier, mapping in tiers.items():
+            candidates.append((protocol, tier, mapping['port'], mapping['remark']))
+    port = int(inbound.get('port', 0))
+    for protocol, tier, mapped_port, _ in candidates:
+        if port == mapped_port:
+            return protocol, tier
+    for protocol, tier, _, remark in candidates:
+        if inbound.get('remark') == remark:
+            return protocol, tier
+    return None
+
+# Checkpoint: emails already added to the destination but not yet removed from the source.
+# A resumed drain does not add those again, it only finishes removing them from the source.
+# Without a checkpoint entry, a destination client with the same email and id/password counts too.
+def is_drained_copy(client: Dict[str, Any], existing: Dict[str, Any]) -> bool:
+    secret = client.get('id') or client.get('password')
+    return bool(secret) and secret == (existing.get('id') or existing.get('password'))
+
+def drain_checkpoint_path(source_name: str, destination_name: str) -> str:
+    safe_name = DRAIN_CHECKPOINT_NAME_PATTERN.sub('_', f'{source_name}__{destination_name}')
+    return os.path.join(DRAIN_CHECKPOINT_DIR, f'drain_{safe_name}.json')
+
+def load_drain_checkpoint(path: str) -> set:
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return set()
+    return set(data.get('added', [])) if isinstance(data, dict) else set()
+
+def save_drain_checkpoint(path: str, added: set) -> bool:
+    temp_file = None
+    try:
+        if not added:
+            if os.path.exists(path):
+                os.remove(path)
+            return True
+        fd, temp_file = tempfile.mkstemp(prefix='.drain.', suffix='.tmp', dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'added': sorted(added), 'updated_at': int(time.time())}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, path)
+        return True
+    except Exception:
+        if temp_file and os.path.exists(temp_file):
+            os.remove(temp_file)
+        return False
 
+def adjust_client_stats(panel_name: str, inbound: Dict[str, Any], statuses: List[str], sign: int) -> None:
+    for status in set(statuses):
+        adjust_system_stats(panel_name, client_stats_delta(inbound, statuses.count(status), status, sign))
+
+# Moves the clients of one panel to another. The source and destination inbound lists are read once;
+# every client goes to the destination inbound of its INBOUND_MAPPING protocol/tier. Per batch, one
+# addClient on the destination, then one inbound update removing the batch from the source. Removals
+# run on a separate thread while the next batch is added, and throughput is capped at
+# DRAIN_MAX_CLIENTS_PER_SECOND. users limits the drain to those emails; limit caps clients per run.
+def drain_panel(from_panel_index: int, to_panel_index: int, panels: Dict[int, Any], lang: str, users: set = None, limit: int = 0, dry_run: bool = False, batch_size: int = 0) -> Dict[str, Any]:
+    if from_panel_index not in panels or to_panel_index not in panels:
+        return {'error': t('invalid_panel', lang)}
+    if from_panel_index == to_panel_index:
+        return {'error': 'Source and destination panels cannot be the same.'}
+    started = time.monotonic()
+    batch_size = batch_size if batch_size > 0 else DRAIN_BATCH_SIZE
+    source, destination = panels[from_panel_index], panels[to_panel_index]
+    source_url, source_user, source_pass = get_panel_credentials(source)
+    destination_url, destination_user, destination_pass = get_panel_credentials(destination)
+
+    fetched_source = fetch_panel_inbounds(source['name'], source_url, source_user, source_pass, fresh=True)
+    if not fetched_source:
+        return {'error': t('login_failed', lang), 'panel_name': source['name']}
+    fetched_destination = fetch_panel_inbounds(destination['name'], destination_url, destination_user, destination_pass, fresh=True)
+    if not fetched_destination:
+        return {'error': t('login_failed', lang), 'panel_name': destination['name']}
+    source_cookie, source_inbounds = fetched_source
+    destination_cookie, destination_inbounds = fetched_destination
+
+    checkpoint_path = drain_checkpoint_path(source['name'], destination['name'])
+    checkpoint = load_drain_checkpoint(checkpoint_path)
+    checkpoint_lock = threading.Lock()
+    destination_emails = set()
+    for inbound in destination_inbounds:
+        destination_emails.update(get_inbound_tables(inbound)['by_email'])
+    now_ms = int(time.time() * 1000)
+
+    # Plan: [(source inbound, its tables, target inbound, its tables, clients to move)]
+    report: Dict[str, Dict[str, Any]] = {}
+    statuses: Dict[int, str] = {}
+    used_bytes: Dict[int, int] = {}
+    resumed_emails = set()
+    # email -> (inbound_id, client) of the destination copy, re-indexed once the source copy is removed
+    destination_copies: Dict[str, tuple] = {}
+    plan = []
+    budget = limit if limit > 0 else -1
+    for inbound in source_inbounds:
+        tables = get_inbound_tables(inbound)
+        mapping_key = inbound_mapping_key(inbound)
+        target = find_mapped_inbound(destination_inbounds, *mapping_key) if mapping_key else None
+        target_tables = get_inbound_tables(target) if target else None
+        stats_by_email = get_client_stats_table(inbound, tables)
+        moving = []
+        for client in tables['clients']:
+            email = client.get('email', '')
+            if users is not None and email not in users:
+                continue
+            entry = report[email] = {'status': 'planned', 'source_inbound': inbound.get('id'), 'protocol': inbound.get('protocol', 'unknown').lower()}
+            if mapping_key is None:
+                entry['status'] = 'unmapped'
+                continue
+            entry['tier'] = mapping_key[1]
+            if target is None:
+                entry.update(status='no_target_inbound', error=t('inbound_not_found', lang))
+                continue
+            entry['target_inbound'] = target.get('id')
+            existing_index = find_email_in_tables(target_tables, email)
+            resumed = existing_index is not None and (email in checkpoint or is_drained_copy(client, target_tables['clients'][existing_index]))
+            if email.lower() in destination_emails and not resumed:
+                entry.update(status='conflict', error='Email already exists on the destination panel')
+                continue
+            if budget == 0:
+                entry['status'] = 'deferred'
+                continue
+            budget -= 1
+            stat = stats_by_email.get(email)
+            statuses[id(client)] = client_status(client, stat, now_ms)
+            used_bytes[id(client)] = int(stat.get('up', 0)) + int(stat.get('down', 0)) if stat else 0
+            entry['used_bytes'] = used_bytes[id(client)]
+            if resumed:
+                resumed_emails.add(email)
+                destination_copies[email] = (target['id'], target_tables['clients'][existing_index])
+            moving.append(client)
+        if moving:
+            plan.append((inbound, tables, target, target_tables, moving))
+
+    # The source inbound is re-read right before every removal and only the batch's emails are dropped,
+    # so clients created on the source while the drain runs are kept
+    def remove_batch(inbound_id: int, batch: List[Dict[str, Any]]) -> None:
+        def fail(error: str) -> None:
+            for client in batch:
+                report[client.get('email', '')].update(status='added_not_removed', error=error)
+
+        fetched = fetch_panel_inbounds(source['name'], source_url, source_user, source_pass, fresh=True)
+        inbound = next((item for item in fetched[1] if item.get('id') == inbound_id), None) if fetched else None
+        if inbound is None:
+            fail(t('login_failed', lang) if not fetched else t('inbound_not_found', lang))
+            return
+        try:
+            settings = json.loads(inbound.get('settings') or '{}')
+        except json.JSONDecodeError:
+            fail(t('system_error', lang))
+            return
+        batch_emails = {client.get('email', '') for client in batch}
+        kept = [client for client in settings.get('clients', []) if client.get('email', '') not in batch_emails]
+        payload = build_inbound_update(inbound, settings, kept)
+        result = api_call(source_url, fetched[0], f"xui/inbound/update/{inbound_id}", payload, credentials=(source_user, source_pass))
+        invalidate_inbound_list(source_url)
+        if not result or not result.get('success'):
+            fail((result or {}).get('msg') or t('system_error', lang))
+            return
+        adjust_client_stats(source['name'], inbound, [statuses[id(client)] for client in batch], -1)
+        # The fresh source read re-indexed these emails to the source; point them back at the destination
+        for client in batch:
+            moved = destination_copies.get(client.get('email', ''))
+            if moved:
+                index_client(destination['name'], *moved)
+        with checkpoint_lock:
+            for client in batch:
+                report[client.get('email', '')]['status'] = 'moved'
+                checkpoint.discard(client.get('email', ''))
+            save_drain_checkpoint(checkpoint_path, checkpoint)
+        for client in batch:
+            invalidate_subscription(client.get('email', ''))
+
+    remover = ThreadPoolExecutor(max_workers=1, thread_name_prefix='drain')
+    removals = []
+    processed = 0
+    try:
+        for inbound, tables, target, target_tables, moving in ([] if dry_run else plan):
+            target_method = target_tables['settings'].get('method')
+            for start in range(0, len(moving), batch_size):
+                batch = moving[start:start + batch_size]
+                to_add = [client for client in batch if client.get('email', '') not in resumed_emails]
+                copies = []
+                for client in to_add:
+                    copy = dict(client)
+                    if 'method' in copy and target_method:
+                        copy['method'] = target_method
+                    # Traffic counters start at zero on the destination, so the used traffic is
+                    # carried over by lowering the quota (1 byte keeps a depleted client depleted)
+                    total = client_total_bytes(client)
+                    if total > 0 and used_bytes[id(client)] > 0:
+                        copy['totalGB'] = max(total - used_bytes[id(client)], 1)
+                        report[client.get('email', '')]['total_on_destination'] = copy['totalGB']
+                    copies.append(copy)
+                if copies:
+                    result = api_call(destination_url, destination_cookie, 'xui/inbound/addClient',
+                                      {'id': target['id'], 'settings': json.dumps({'clients': copies})},
+                                      credentials=(destination_user, destination_pass))
+                    invalidate_inbound_list(destination_url)
+                    if result and result.get('success'):
+                        for copy in copies:
+                            index_client(destination['name'], target['id'], copy)
+                            destination_copies[copy.get('email', '')] = (target['id'], copy)
+                        adjust_client_stats(destination['name'], target, [statuses[id(client)] for client in to_add], 1)
+                    else:
+                        for client in to_add:
+                            report[client.get('email', '')].update(status='failed', error=(result or {}).get('msg') or 'addClient failed')
+                        # Clients resumed from the checkpoint are already on the destination
+                        failed_ids = {id(client) for client in to_add}
+                        batch = [client for client in batch if id(client) not in failed_ids]
+                        if not batch:
+                            continue
+
+                protocol = target.get('protocol', 'unknown').lower()
+                with checkpoint_lock:
+                    for client in batch:
+                        email = client.get('email', '')
+                        checkpoint.add(email)
+                        report[email].update(status='added', config_link=create_config_link(destination_url, int(target['port']), client, protocol))
+                    save_drain_checkpoint(checkpoint_path, checkpoint)
+                removals.append(remover.submit(contextvars.copy_context().run, run_with_request_context, remove_batch, inbound['id'], batch))
+
+                processed += len(batch)
+                if DRAIN_MAX_CLIENTS_PER_SECOND > 0:
+                    time.sleep(max(0.0, processed / DRAIN_MAX_CLIENTS_PER_SECOND - (time.monotonic() - started)))
+        for removal in removals:
+            try:
+                removal.result()
+            except Exception as e:
+                app.logger.warning(f'Drain removal batch failed: {e}')
+    finally:
+        remover.shutdown(wait=True)
+
+    if processed:
+        invalidate_placement_scores()
+    totals: Dict[str, int] = {}
+    for entry in report.values():
+        totals[entry['status']] = totals.get(entry['status'], 0) + 1
+    return {
+        'message': t('panel_drained', lang),
+        'source_panel': source['name'],
+        'destination_panel': destination['name'],
+        'dry_run': dry_run,
+        'batch_size': batch_size,
+        'totals': totals,
+        'pending_checkpoint': len(checkpoint),
+        'elapsed_ms': int((time.monotonic() - started) * 1000),
+        'clients': report,
+    }
+
+# =========================================================================
+# EXPIRY NOTIFICATIONS (Telegram, SQLite queue + sent-log)
+# =========================================================================
+
+# notify_sent: one row per (chat, email, state, expiry) that was delivered or given up on, so a
+# renewed account (new expiry) is notified again. notify_queue: pending messages with the Bot API
+# method and payload; next_attempt_at doubles as a short claim while a message is being sent.
+_NOTIFY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notify_sent (chat_id TEXT, email TEXT, state TEXT, expiry INTEGER, result TEXT, sent_at INTEGER, PRIMARY KEY (chat_id, email, state, expiry));
+CREATE TABLE IF NOT EXISTS notify_queue (id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id TEXT, email TEXT, state TEXT, expiry INTEGER, method TEXT, payload TEXT, attempts INTEGER DEFAULT 0, next_attempt_at REAL, UNIQUE (chat_id, email, state, expiry));
+CREATE INDEX IF NOT EXISTS notify_queue_due ON notify_queue (next_attempt_at);
+"""
+
+# Telegram chat of a client: 3x-ui tgId, or the email when it is a Telegram ID (trial accounts)
+def client_chat_id(client: Dict[str, Any]) -> Union[str, None]:
+    tg_id = str(client.get('tgId') or '').strip()
+    if validate_telegram_id(tg_id):
+        return tg_id
+    email = str(client.get('email', ''))
+    return email if validate_telegram_id(email) else None
+
+def build_expiry_notification(chat_id: str, state: str, days_left: int, lang: str) -> Dict[str, Any]:
+    notice = t('expiry_soon_user', lang) % days_left if state == 'expiring' else t('expired_user', lang)
+    return {
+        'chat_id': chat_id,
+        'photo': EXPIRY_NOTIFICATION_IMAGE_URL,
+        'caption': f'{notice}\n\n{MY_EXPIRY_NOTIFICATION_TEXT}',
+        'parse_mode': 'HTML',
+        'reply_markup': {'inline_keyboard': RENEWAL_INLINE_KEYBOARD},
+    }
+
+# Expiring / expired clients of the trial inbounds -> queue rows not already in the sent-log
+def queue_expiry_notifications(trial_panels: List[Any], lang: str, dry_run: bool = False) -> Dict[str, Any]:
+    panels = {panel['name']: panel for panel in trial_panels}
+    if not panels:
+        return {'error': t('no_trial_panels', lang)}
+    now_ms = int(time.time() * 1000)
+    window_ms = NOTIFY_EXPIRY_DAYS * 86400000
+
+    def scan_panel(panel_name: str, panel: Dict[str, Any], stop_event: threading.Event) -> Union[List[tuple], None]:
+        panel_url, username, password = get_panel_credentials(panel)
+        fetched = fetch_panel_inbounds(panel_name, panel_url, username, password, stop_event)
+        if not fetched:
+            return None
+        inbound = find_mapped_inbound(fetched[1], 'trial', REQUIRED_REMARK)
+        if inbound is None:
+            return []
+        notices = []
+        for client in get_inbound_tables(inbound)['clients']:
+            chat_id = client_chat_id(client)
+            expiry = int(client.get('expiryTime', 0))
+            # expiryTime <= 0: never expires, or starts on first use. Accounts that expired before the
+            # window are never (re)notified, even after their sent-log row is purged.
+            if chat_id is None or expiry <= 0 or abs(expiry - now_ms) > window_ms:
+                continue
+            state = 'expired' if expiry <= now_ms else 'expiring'
+            days_left = max(1, math.ceil((expiry - now_ms) / 86400000)) if state == 'expiring' else 0
+            notices.append((chat_id, client.get('email', ''), state, expiry, days_left))
+        return notices
+
+    scans = fan_out_panels(panels, scan_panel, first_match=False)
+    notices = []
+    unreachable = []
+    for panel_name in panels:
+        scan = scans.get(panel_name)
+        if isinstance(scan, list):
+            notices.extend(scan)
+        else:
+            unreachable.append(panel_name)
+
+    report = {'found': len(notices), 'queued': 0, 'dry_run': dry_run, 'unreachable_panels': unreachable,
+              'expiring': sum(1 for notice in notices if notice[2] == 'expiring'),
+              'expired': sum(1 for notice in notices if notice[2] == 'expired')}
+    if dry_run or not notices:
+        return report
+
+    rows = [(chat_id, email, state, expiry, 'sendPhoto', json.dumps(build_expiry_notification(chat_id, state, days_left, lang), ensure_ascii=False),
+             time.time(), chat_id, email, state, expiry)
+            for chat_id, email, state, expiry, days_left in notices]
+    try:
+        conn = get_sqlite_connection(NOTIFY_DB_FILE, _NOTIFY_SCHEMA)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM notify_sent WHERE sent_at < ?', (int(time.time()) - NOTIFY_SENT_RETENTION_DAYS * 86400,))
+            changes_before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO notify_queue (chat_id, email, state, expiry, method, payload, next_attempt_at) '
+                'SELECT ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS '
+                '(SELECT 1 FROM notify_sent WHERE chat_id = ? AND email = ? AND state = ? AND expiry = ?)', rows)
+            report['queued'] = conn.total_changes - changes_before
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    except (sqlite3.Error, OSError) as e:
+        return {'error': t('file_access_failed', lang), 'details': str(e)}
+    return report
+
+# One Bot API call -> (HTTP status or 0 on a network error, retry_after seconds, description)
+def send_telegram_request(method: str, payload: Dict[str, Any]) -> tuple:
+    load_requests()
+    url = f"{TELEGRAM_API_BASE.rstrip('/')}/bot{TELEGRAM_BOT_TOKEN}/{method}"
+    try:
+        response = get_http_session(TELEGRAM_API_BASE).post(url, json=payload, timeout=(PANEL_CONNECT_TIMEOUT, PANEL_READ_TIMEOUT))
+    except requests.RequestException as e:
+        # The URL carries the bot token, so only the exception type is reported
+        return 0, 0.0, type(e).__name__
+    try:
+        body = response.json()
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        body = {}
+    parameters = body.get('parameters') if isinstance(body.get('parameters'), dict) else {}
+    # Retry-After may also be an HTTP date; anything unparsable falls back to the default pause
+    try:
+        retry_after = float(parameters.get('retry_after') or response.headers.get('Retry-After') or 0)
+    except (TypeError, ValueError):
+        retry_after = 0.0
+    return response.status_code, retry_after, str(body.get('description', ''))
+
+def _finish_notification(conn: sqlite3.Connection, row: tuple, result: str) -> None:
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute('DELETE FROM notify_queue WHERE id = ?', (row[0],))
+        conn.execute('INSERT OR REPLACE INTO notify_sent (chat_id, email, state, expiry, result, sent_at) VALUES (?, ?, ?, ?, ?, ?)',
+                     (row[1], row[2], row[3], row[4], result, int(time.time())))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+
+# Queue database errors (e.g. a read-only NOTIFY_DB_FILE) are reported as file_access_failed
+def drain_notification_queue(lang: str, max_seconds: float = None) -> Dict[str, Any]:
+    try:
+        return _drain_notification_queue(max_seconds)
+    except (sqlite3.Error, OSError) as e:
+        return {'error': t('file_access_failed', lang), 'details': str(e)}
+
+# Sends due queue entries at most NOTIFY_MESSAGES_PER_SECOND for up to max_seconds. A 429 pauses all
+# sending for its retry_after (Telegram flood limits are per bot) and requeues the message; 4xx answers
+# (blocked bot, unknown chat) are final; network errors and 5xx are retried with backoff.
+def _drain_notification_queue(max_seconds: float = None) -> Dict[str, Any]:
+    max_seconds = NOTIFY_SEND_BUDGET_SECONDS if max_seconds is None else max_seconds
+    interval = 1.0 / NOTIFY_MESSAGES_PER_SECOND if NOTIFY_MESSAGES_PER_SECOND > 0 else 0.0
+    conn = get_sqlite_connection(NOTIFY_DB_FILE, _NOTIFY_SCHEMA)
+    started = time.monotonic()
+    deadline = started + max_seconds
+    next_send = started
+    counts = {'sent': 0, 'rejected': 0, 'failed': 0, 'retried': 0, 'throttled': 0}
+
+    while time.monotonic() < deadline and next_send < deadline:
+        now = time.time()
+        row = conn.execute('SELECT id, chat_id, email, state, expiry, method, payload, attempts FROM notify_queue '
+                           'WHERE next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT 1', (now,)).fetchone()
+        if row is None:
+            break
+        # Claim the message so a concurrent drain skips it
+        if conn.execute('UPDATE notify_queue SET next_attempt_at = ? WHERE id = ? AND next_attempt_at <= ?',
+                        (now + NOTIFY_CLAIM_SECONDS, row[0], now)).rowcount != 1:
+            continue
+
+        wait = next_send - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        next_send = time.monotonic() + interval
+        status, retry_after, description = send_telegram_request(row[5], json.loads(row[6]))
+
+        if 200 <= status < 300:
+            _finish_notification(conn, row, 'sent')
+            result = 'sent'
+        elif status == 429:
+            retry_after = max(retry_after, 1.0)
+            conn.execute('UPDATE notify_queue SET next_attempt_at = ? WHERE id = ?', (time.time() + retry_after, row[0]))
+            next_send = time.monotonic() + retry_after
+            result = 'throttled'
+        elif 400 <= status < 500:
+            _finish_notification(conn, row, f'rejected: {description}'[:200])
+            result = 'rejected'
+        elif row[7] + 1 >= NOTIFY_MAX_ATTEMPTS:
+            _finish_notification(conn, row, f'failed: {status} {description}'[:200])
+            result = 'failed'
+        else:
+            conn.execute('UPDATE notify_queue SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?',
+                         (time.time() + NOTIFY_RETRY_BASE_SECONDS * 2 ** row[7], row[0]))
+            result = 'retried'
+        counts[result] += 1
+        increment_metric('v2ray_api_notifications_total', result=result)
+
+    pending = conn.execute('SELECT COUNT(*) FROM notify_queue').fetchone()[0]
+    elapsed = time.monotonic() - started
+    return {**counts, 'pending': pending, 'elapsed_ms': int(elapsed * 1000),
+            'messages_per_second': round(counts['sent'] / elapsed, 2) if elapsed > 0 else 0.0}
 
 # =========================================================================
 # FLASK ROUTING (PHP's main Request Handler)
@@ -777,6 +3266,7 @@ def list_panels_from_json(lang: str) -> Dict[str, Any]:
 @rate_limit_required
 def handle_request_route():
     lang = get_client_language()
+    premium_panels, trial_panels = get_panel_tables()
     
     # Handle preflight OPTIONS request
     if request.method == 'OPTIONS':
@@ -808,6 +3298,11 @@ def handle_request_route():
         time_limit = int(args.get('exp', 0))
         panel_index = int(args.get('panel', 0))
         config = args.get('config', '')
+        sub_user = args.get('sub', '')
+        batch_configs = args.get('configs')
+        bulk_names = args.get('names')
+        if isinstance(bulk_names, str):
+            bulk_names = [name.strip() for name in bulk_names.split(',') if name.strip()]
         
         protocol = args.get('protocol', DEFAULT_PREMIUM_PROTOCOL).lower()
         tier = args.get('tier', DEFAULT_PREMIUM_TIER)
@@ -820,16 +3315,22 @@ def handle_request_route():
         
         delete_id = args.get('delete', '')
         delete_expired = 'delexp' in args
+        dry_run = str(args.get('dry_run', 'false')).lower() in ('true', '1')
+        purge_limit = int(args.get('limit', 0))
         trial_key_id = args.get('trialkey', '')
         trial_id = args.get('trial', '')
         stats = 'stats' in args
         analytics = 'analytics' in args
+        collect_traffic = 'collect_traffic' in args
         
         transfer = args.get('transfer', '')
         from_panel = int(args.get('from_panel', 0))
         to_panel = int(args.get('to_panel', 0))
+        drain_from = int(args.get('drain', 0))
         optimal_panel = 'optimal' in args
         online_users = 'online' in args
+        pool_stats = 'pool_stats' in args
+        panel_health = 'panel_health' in args
         
         # JSON Bot Parameters
         add_panel_name = args.get('add_panel', '')
@@ -839,6 +3340,8 @@ def handle_request_route():
         add_type = args.get('add_type', 'Premium')
         delete_panel_id = args.get('del_panel', '')
         list_panels = 'list_panels' in args
+        notify_expiry = 'notify_expiry' in args
+        notify_send = 'notify_send' in args
 
         # --- NEW ENDPOINT ROUTING (JSON Panel Management for Bot) ---
         if list_panels:
@@ -846,7 +3349,7 @@ def handle_request_route():
             return format_api_response(list_result, not list_result.get('error'), lang), 200
 
         if add_panel_name and add_url and add_user and add_pass:
-            if not re.match(r'https?:\/\/[^\s]+', add_url):
+            if not PANEL_URL_PATTERN.match(add_url):
                 return format_api_response({'error': 'Invalid panel URL format.'}, False, lang), 400
             add_result = add_panel_to_json(add_panel_name, add_url, add_user, add_pass, add_type, lang)
             return format_api_response(add_result, not add_result.get('error'), lang), 200
@@ -855,6 +3358,12 @@ def handle_request_route():
             delete_result = delete_panel_from_json(delete_panel_id, lang)
             return format_api_response(delete_result, not delete_result.get('error'), lang), 200
 
+        if pool_stats:
+            return format_api_response({'pools': get_http_pool_stats()}, True, lang), 200
+
+        if panel_health:
+            return format_api_response({'circuit_breakers': get_circuit_breaker_stats(), 'pools': get_http_pool_stats()}, True, lang), 200
+
         # --- EXISTING ENDPOINT ROUTING ---
         if online_users:
             online_result = get_online_users(ALL_PANELS_CONFIG, lang)
@@ -878,35 +3387,88 @@ def handle_request_route():
             reset_result = reset_account_traffic(reset_user, panel_index, lang)
             return format_api_response(reset_result, True, lang), 200
 
-        if gb_limit > 0 and user_name and panel_index > 0:
-            premium_result = create_premium_account(gb_limit, user_name, time_limit, panel_index, protocol, tier, PREMIUM_PANELS, lang)
+        if gb_limit > 0 and isinstance(bulk_names, list) and panel_index >= 0:
+            if not bulk_names or len(bulk_names) > BULK_CREATE_MAX_NAMES:
+                return format_api_response({'error': f'names must contain between 1 and {BULK_CREATE_MAX_NAMES} entries.'}, False, lang), 400
+            bulk_result = create_premium_accounts_bulk(gb_limit, [str(name) for name in bulk_names], time_limit, panel_index, protocol, tier, premium_panels, lang)
+            return format_api_response(bulk_result, not bulk_result.get('error'), lang), 200
+
+        if gb_limit > 0 and user_name and panel_index >= 0:
+            premium_result = create_premium_account(gb_limit, user_name, time_limit, panel_index, protocol, tier, premium_panels, lang)
             return format_api_response(premium_result, True, lang), 200
 
         if stats:
-            system_stats = get_system_stats(PREMIUM_PANELS, TRIAL_PANELS, ALL_PANELS_CONFIG)
+            system_stats = get_system_stats(premium_panels, trial_panels, ALL_PANELS_CONFIG, lang)
             return format_api_response(system_stats, True, lang), 200
 
         if analytics:
             period = args.get('period', '7d')
-            traffic_analytics = get_traffic_analytics(ALL_PANELS_CONFIG, period)
-            return format_api_response(traffic_analytics, True, lang), 200
+            traffic_analytics = get_traffic_analytics(ALL_PANELS_CONFIG, period, lang)
+            return format_api_response(traffic_analytics, not traffic_analytics.get('error'), lang), 200
+
+        if collect_traffic:
+            return format_api_response(collect_traffic_snapshots(lang), True, lang), 200
 
         if optimal_panel:
             account_type = args.get('type', 'premium')
-            panels_to_use = PREMIUM_PANELS if account_type == 'premium' else TRIAL_PANELS
-            optimal_index = get_optimal_panel_for_creation(panels_to_use, account_type)
+            panels_to_use = premium_panels if account_type == 'premium' else dict(enumerate(trial_panels, start=1))
+            optimal_index = get_optimal_panel_for_creation(panels_to_use, account_type, protocol, tier)
             panel_name = panels_to_use.get(optimal_index, {}).get('name', 'Unknown')
-            return format_api_response({'optimal_panel': optimal_index, 'panel_name': panel_name, 'account_type': account_type}, True, lang), 200
+            panel_scores = rank_panels_for_creation(panels_to_use, account_type, protocol, tier)['scores']
+            return format_api_response({'optimal_panel': optimal_index, 'panel_name': panel_name, 'account_type': account_type, 'panel_scores': panel_scores}, True, lang), 200
 
         if transfer and from_panel > 0 and to_panel > 0:
+            if request.method != 'POST':
+                return format_api_response({'error': 'Account transfer must be requested with POST.'}, False, lang), 405
             if not validate_user_name(transfer):
                 return format_api_response({'error': t('invalid_username', lang) + ' for transfer'}, False, lang), 400
             if from_panel == to_panel:
                 return format_api_response({'error': 'Source and destination panels cannot be the same.'}, False, lang), 400
             
-            transfer_result = transfer_account(transfer, from_panel, to_panel, PREMIUM_PANELS, lang)
+            transfer_result = transfer_account(transfer, from_panel, to_panel, premium_panels, lang)
             return format_api_response(transfer_result, not transfer_result.get('error'), lang), 200
 
+        if notify_expiry:
+            notify_result = queue_expiry_notifications(trial_panels, lang, dry_run)
+            if not notify_result.get('error') and not dry_run:
+                notify_result['delivery'] = drain_notification_queue(lang)
+            return format_api_response(notify_result, not notify_result.get('error'), lang), 200
+
+        if notify_send:
+            send_result = drain_notification_queue(lang)
+            return format_api_response(send_result, not send_result.get('error'), lang), 200
+
+        if drain_from > 0 and to_panel > 0:
+            if request.method != 'POST':
+                return format_api_response({'error': 'Panel drain must be requested with POST.'}, False, lang), 405
+            account_type = args.get('type', 'premium')
+            panels_to_use = premium_panels if account_type == 'premium' else dict(enumerate(trial_panels, start=1))
+            batch_size = int(args.get('batch', 0))
+            drain_result = drain_panel(drain_from, to_panel, panels_to_use, lang, limit=purge_limit, dry_run=dry_run, batch_size=batch_size)
+            return format_api_response(drain_result, not drain_result.get('error'), lang), 200
+
+        if isinstance(batch_configs, list):
+            if not batch_configs or len(batch_configs) > BATCH_CHECK_MAX_CONFIGS:
+                return format_api_response({'error': f'configs must contain between 1 and {BATCH_CHECK_MAX_CONFIGS} entries.'}, False, lang), 400
+            parsed_list = [parse_v2ray_config(str(item)) for item in batch_configs]
+            batch_results = check_v2ray_accounts_batch(parsed_list, ALL_PANELS_CONFIG, lang)
+            return format_api_response(format_batch_results(batch_configs, batch_results, lang), True, lang), 200
+
+        if sub_user:
+            if not validate_user_name(sub_user):
+                return format_api_response({'error': t('invalid_username', lang)}, False, lang), 400
+            subscription = get_subscription(sub_user, lang)
+            if 'error' in subscription:
+                return format_api_response(subscription, False, lang), 503
+            if not subscription['links']:
+                return format_api_response({'error': t('account_not_found', lang)}, False, lang), 404
+            response = app.response_class(subscription['body'], mimetype='text/plain')
+            response.headers['Subscription-Userinfo'] = subscription['userinfo']
+            response.headers['Profile-Update-Interval'] = str(SUBSCRIPTION_UPDATE_INTERVAL_HOURS)
+            response.set_etag(subscription['etag'], weak=True)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
+
         if config:
             parsed = parse_v2ray_config(config)
             if 'error' in parsed:
@@ -917,36 +3479,36 @@ def handle_request_route():
         if trial_key_id:
             if not validate_telegram_id(trial_key_id):
                 return format_api_response({'error': t('invalid_telegram_id', lang)}, False, lang), 400
-            key_result = get_trial_account_key(trial_key_id, TRIAL_PANELS, lang)
+            key_result = get_trial_account_key(trial_key_id, trial_panels, lang)
             return format_api_response(key_result, True, lang), 200
 
         if delete_expired:
             if panel_index > 0:
-                if not validate_panel_index(panel_index, PREMIUM_PANELS):
+                if not validate_panel_index(panel_index, premium_panels):
                     return format_api_response({'error': t('invalid_panel', lang) + ' for premium deletion'}, False, lang), 400
                 delete_result = {'error': 'Delete Expired Premium function is omitted.'} # Original PHP comment preserved
             else:
-                delete_result = delete_expired_trial_accounts(TRIAL_PANELS, lang)
+                delete_result = delete_expired_trial_accounts(trial_panels, lang, dry_run, purge_limit)
             return format_api_response(delete_result, True, lang), 200
 
         if delete_id:
             identifier = delete_id
             if panel_index > 0:
-                if not validate_panel_index(panel_index, PREMIUM_PANELS):
+                if not validate_panel_index(panel_index, premium_panels):
                     return format_api_response({'error': t('invalid_panel', lang) + ' for premium deletion'}, False, lang), 400
                 if not validate_user_name(identifier):
                     return format_api_response({'error': t('invalid_username', lang) + ' for deletion'}, False, lang), 400
-                delete_result = delete_premium_account(identifier, panel_index, PREMIUM_PANELS, lang)
+                delete_result = delete_premium_account(identifier, panel_index, premium_panels, lang)
             else:
                 if not validate_telegram_id(identifier):
                     return format_api_response({'error': t('invalid_telegram_id', lang) + ' for deletion'}, False, lang), 400
-                delete_result = delete_trial_account(identifier, TRIAL_PANELS, lang)
+                delete_result = delete_trial_account(identifier, trial_panels, lang)
             return format_api_response(delete_result, True, lang), 200
 
         if trial_id:
             if not validate_telegram_id(trial_id):
                 return format_api_response({'error': t('invalid_telegram_id', lang)}, False, lang), 400
-            trial_result = create_trial_account(trial_id, TRIAL_PANELS, lang)
+            trial_result = create_trial_account(trial_id, trial_panels, lang)
             return format_api_response(trial_result, True, lang), 200
 
         # Default Response
@@ -966,6 +3528,553 @@ def handle_request_route():
         }
         return format_api_response(error_response, False, lang), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics_route():
+    if METRICS_TOKEN and request.headers.get('Authorization', '') != f'Bearer {METRICS_TOKEN}':
+        return app.response_class('Unauthorized\n', status=401, mimetype='text/plain')
+    if not METRICS_ENABLED:
+        return app.response_class('Metrics are disabled\n', status=404, mimetype='text/plain')
+    return app.response_class(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# Debug requests (X-Debug-Token): phase timings, and a profile when X-Debug-Profile asks for one
+@app.before_request
+def start_debug_request():
+    if not is_debug_request():
+        return None
+    g.debug_timings = start_request_timings()
+    g.debug_profile = start_profile(request.headers.get('X-Debug-Profile', '').lower(), g.debug_timings)
+    return None
+
+@app.after_request
+def finish_debug_request(response):
+    timings = g.pop('debug_timings', None)
+    if timings is None:
+        return response
+    profile = g.pop('debug_profile', None)
+    if profile is not None:
+        to_file = request.headers.get('X-Debug-Profile-Output', 'inline').lower() == 'file'
+        profile_text, profile_path = finish_profile(profile, to_file)
+        if profile_path:
+            response.headers['X-Debug-Profile-File'] = profile_path
+        elif response.mimetype == 'application/json':
+            # Inline profiles are added to the JSON body as "debug_profile"
+            try:
+                body = json.loads(response.get_data())
+                body['debug_profile'] = profile_text
+                response.set_data(_dumps(body, wants_compact_response()))
+            except ValueError:
+                pass
+    response.headers['Server-Timing'] = format_server_timing(timings)
+    response.headers['Cache-Control'] = 'no-store'
+    finish_request_timings(timings)
+    return response
+
+# JSON content type on API responses, plus ETag / If-None-Match (304) on read-only GET requests
+@app.after_request
+def add_response_validators(response):
+    etag = g.pop('response_etag', None)
+    if etag is None:
+        return response
+    response.mimetype = 'application/json'
+    # Debug responses carry per-request timings, so they are never answered with 304
+    if 'debug_timings' in g:
+        return response
+    if request.method == 'GET' and response.status_code == 200 and request.args and set(request.args) <= READ_ONLY_PARAMS:
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        response.make_conditional(request)
+    return response
+
+# =========================================================================
+# ASYNC PANEL CLIENT & ASGI ENTRY POINT
+# =========================================================================
+# `uvicorn main:asgi_app` serves the same API from one event loop (needs httpx).
+# Account checks (config / configs) and online run on the asyncio panel client, so many
+# in-flight checks share the loop instead of holding a thread each; every other action
+# runs the Flask route in a worker thread. Vercel keeps serving the WSGI `app`.
+
+# httpx clients and asyncio locks belong to the loop that created them
+_ASYNC_STATE: Dict[str, Any] = {'loop': None}
+
+# Per-loop state. Every coroutine here reaches this before touching asyncio, which is bound
+# here rather than at import (it is already loaded by then: a loop is running).
+def _async_state() -> Dict[str, Any]:
+    global asyncio
+    if asyncio is None:
+        import asyncio as asyncio_module
+        asyncio = asyncio_module
+    loop = asyncio.get_running_loop()
+    if _ASYNC_STATE['loop'] is not loop:
+        _ASYNC_STATE.update({
+            'loop': loop, 'clients': {}, 'login_locks': {}, 'fetch_locks': {},
+            'online_lock': asyncio.Lock(), 'tasks': set(),
+        })
+    return _ASYNC_STATE
+
+# httpx is optional and only imported for the async client -> whether it is available
+def load_httpx() -> bool:
+    global httpx
+    if httpx is None:
+        httpx = optional_import('httpx')
+    return httpx is not None
+
+# Background task that keeps running after the request that started it has answered
+def _spawn_async_task(coro) -> None:
+    tasks = _async_state()['tasks']
+    task = asyncio.ensure_future(coro)
+    tasks.add(task)
+    task.add_done_callback(tasks.discard)
+
+# One pooled httpx client per panel host, same limits and timeouts as get_http_session
+def get_async_http_client(panel_url: str) -> 'httpx.AsyncClient':
+    parsed = urllib.parse.urlsplit(panel_url)
+    host_key = f"{parsed.scheme}://{parsed.netloc}"
+    clients = _async_state()['clients']
+    client = clients.get(host_key)
+    if client is None:
+        load_httpx()
+        client = clients[host_key] = httpx.AsyncClient(
+            verify=False,
+            headers={'User-Agent': USER_AGENT},
+            timeout=httpx.Timeout(PANEL_READ_TIMEOUT, connect=PANEL_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=PANEL_POOL_SIZE, max_keepalive_connections=PANEL_POOL_SIZE),
+            # Panel cookies are managed explicitly by the session cache, never by the shared jar
+            cookies=http.cookiejar.CookieJar(policy=http.cookiejar.DefaultCookiePolicy(allowed_domains=[])),
+        )
+    return client
+
+async def close_async_http_clients() -> None:
+    clients = _async_state()['clients']
+    for client in list(clients.values()):
+        await client.aclose()
+    clients.clear()
+
+async def async_api_login(panel_url: str, username: str, password: str) -> Union[str, bool]:
+    if not circuit_allows(panel_url):
+        return False
+    url = f"{panel_url.rstrip('/')}/login"
+    data = {'username': username, 'password': password}
+    started = time.monotonic()
+    response = None
+    try:
+        response = await get_async_http_client(panel_url).post(url, data=data, follow_redirects=True)
+        record_panel_latency(panel_url, time.monotonic() - started)
+        response.raise_for_status()
+
+        # 3x-ui answers a wrong password with HTTP 200 and {"success": false}
+        try:
+            login_result = response.json()
+            if isinstance(login_result, dict) and login_result.get('success') is False:
+                record_panel_result(panel_url, True)
+                increment_metric('v2ray_api_panel_failures_total', panel=metric_panel_label(panel_url), endpoint='login')
+                return False
+        except ValueError:
+            pass
+
+        cookies = {}
+        for resp in [*response.history, response]:
+            for cookie in resp.cookies.jar:
+                cookies[cookie.name] = cookie.value
+        cookie_header = "; ".join(f"{name}={value}" for name, value in cookies.items())
+        record_panel_result(panel_url, True)
+        return cookie_header if cookie_header else False
+    except httpx.HTTPError as e:
+        # Error statuses were already timed by record_panel_latency before raise_for_status
+        if response is None:
+            observe_metric('v2ray_api_panel_request_seconds', time.monotonic() - started, panel=metric_panel_label(panel_url), endpoint='login')
+        increment_metric('v2ray_api_panel_failures_total', panel=metric_panel_label(panel_url), endpoint='login')
+        record_panel_result(panel_url, not is_panel_failure(e))
+        return False
+
+# Async twin of get_panel_session, sharing PANEL_SESSION_CACHE with the sync client
+async def async_get_panel_session(panel_url: str, username: str, password: str, stale_cookie: str = None) -> Union[str, bool]:
+    key = (panel_url.rstrip('/'), username)
+    entry = PANEL_SESSION_CACHE.get(key)
+    if entry and entry['expires_at'] > time.time() and entry['cookie'] != stale_cookie:
+        return entry['cookie']
+
+    login_lock = _async_state()['login_locks'].setdefault(key, asyncio.Lock())
+    async with login_lock:
+        entry = PANEL_SESSION_CACHE.get(key)
+        if entry and entry['expires_at'] > time.time() and entry['cookie'] != stale_cookie:
+            return entry['cookie']
+
+        cookie_header = await async_api_login(panel_url, username, password)
+        if cookie_header:
+            PANEL_SESSION_CACHE[key] = {'cookie': cookie_header, 'expires_at': time.time() + PANEL_SESSION_TTL}
+        elif PANEL_LOGIN_FAILURE_TTL > 0:
+            PANEL_SESSION_CACHE[key] = {'cookie': False, 'expires_at': time.time() + PANEL_LOGIN_FAILURE_TTL}
+        else:
+            PANEL_SESSION_CACHE.pop(key, None)
+        return cookie_header
+
+async def async_handle_api_call_with_retry(api_call_func: Callable, max_retries: int = 2) -> Union[Dict[str, Any], bool]:
+    for attempt in range(max_retries + 1):
+        result = await api_call_func()
+        if result is not False:
+            return result
+        if attempt < max_retries:
+            await asyncio.sleep(random.uniform(0, min(RETRY_BACKOFF_MAX_SECONDS, RETRY_BACKOFF_BASE_SECONDS * (2 ** attempt))))
+    return False
+
+async def async_api_call(panel_url: str, cookie_header: str, endpoint: str, data: Dict[str, Any] = None, credentials: tuple = None) -> Union[Dict[str, Any], bool]:
+    if not circuit_allows(panel_url):
+        return False
+    call_started = time.monotonic()
+    # Whether the last attempt failed because the panel itself is unhealthy, and how many attempts were made
+    last_attempt = {'panel_failure': False, 'attempts': 0}
+
+    async def do_call(cookie: str):
+        last_attempt['panel_failure'] = False
+        last_attempt['attempts'] += 1
+        url = f"{panel_url.rstrip('/')}/{endpoint}"
+        headers = {"Cookie": cookie, "Content-Type": "application/json"}
+        try:
+            started = time.monotonic()
+            if data is not None:
+                response = await get_async_http_client(panel_url).post(url, json=data, headers=headers)
+            else:
+                response = await get_async_http_client(panel_url).post(url, headers=headers)
+            record_panel_latency(panel_url, time.monotonic() - started, endpoint)
+
+            if response.is_redirect or response.status_code in (401, 403, 404):
+                return PANEL_AUTH_FAILED
+
+            response.raise_for_status()
+
+            json_data = response.json()
+            if isinstance(json_data, dict) and 'success' in json_data:
+                return json_data
+            return False
+        except httpx.HTTPError as e:
+            last_attempt['panel_failure'] = is_panel_failure(e)
+            return False
+        except json.JSONDecodeError:
+            return False
+
+    result = await async_handle_api_call_with_retry(lambda: do_call(cookie_header))
+    attempt_loops = 1
+    if result is PANEL_AUTH_FAILED and credentials:
+        new_cookie = await async_get_panel_session(panel_url, credentials[0], credentials[1], stale_cookie=cookie_header)
+        if new_cookie:
+            attempt_loops += 1
+            result = await async_handle_api_call_with_retry(lambda: do_call(new_cookie))
+        if result is PANEL_AUTH_FAILED:
+            invalidate_panel_session(panel_url, credentials[0])
+    record_panel_result(panel_url, result is not False or not last_attempt['panel_failure'])
+    record_api_call_metrics(panel_url, endpoint, time.monotonic() - call_started, last_attempt['attempts'] - attempt_loops, result is False or result is PANEL_AUTH_FAILED)
+    return False if result is PANEL_AUTH_FAILED else result
+
+async def async_download_panel_inbounds(panel_name: str, panel_url: str, username: str, password: str) -> Union[tuple, bool]:
+    cookie_header = await async_get_panel_session(panel_url, username, password)
+    if not cookie_header:
+        return False
+
+    inbound_list = await async_api_call(panel_url, cookie_header, 'xui/inbound/list', credentials=(username, password))
+    if not inbound_list or 'obj' not in inbound_list:
+        return False
+    # Indexing parses every inbound's settings, which would stall the loop on large panels
+    return await asyncio.to_thread(store_panel_inbounds, panel_name, panel_url, cookie_header, inbound_list['obj'] or [])
+
+async def _async_refresh_panel_inbounds(panel_name: str, panel_url: str, username: str, password: str) -> None:
+    try:
+        await async_download_panel_inbounds(panel_name, panel_url, username, password)
+    except Exception as e:
+        app.logger.warning(f'Background inbound refresh failed for {panel_name}: {e}')
+    finally:
+        entry = INBOUND_LIST_CACHE.get(panel_url.rstrip('/'))
+        if entry:
+            entry['refreshing'] = False
+
+# Async twin of fetch_panel_inbounds over the same stale-while-revalidate cache
+async def async_fetch_panel_inbounds(panel_name: str, panel_url: str, username: str, password: str, fresh: bool = False) -> Union[tuple, bool]:
+    cache_key = panel_url.rstrip('/')
+    entry = INBOUND_LIST_CACHE.get(cache_key)
+    if entry and not fresh:
+        age = time.time() - entry['fetched_at']
+        if age <= INBOUND_LIST_FRESH_SECONDS:
+            return entry['cookie'], entry['inbounds']
+        if age <= INBOUND_LIST_MAX_STALE_SECONDS:
+            with _INBOUND_LIST_LOCK:
+                start_refresh = not entry['refreshing']
+                entry['refreshing'] = True
+            if start_refresh:
+                _spawn_async_task(_async_refresh_panel_inbounds(panel_name, panel_url, username, password))
+            return entry['cookie'], entry['inbounds']
+
+    requested_at = time.time()
+    fetch_lock = _async_state()['fetch_locks'].setdefault(cache_key, asyncio.Lock())
+    async with fetch_lock:
+        entry = INBOUND_LIST_CACHE.get(cache_key)
+        if entry and entry['fetched_at'] >= requested_at:
+            return entry['cookie'], entry['inbounds']
+        return await async_download_panel_inbounds(panel_name, panel_url, username, password)
+
+# Async fan_out_panels: worker(panel_key, panel) coroutines, at most PANEL_MAX_CONCURRENCY at once.
+# With first_match=True, queued panels are skipped once a match is found; panels already being
+# fetched finish in the background so their downloads still land in the caches.
+async def async_fan_out_panels(panels: Dict[Any, Any], worker: Callable, first_match: bool = True) -> Any:
+    items = list(panels.items())
+    if not items:
+        return False if first_match else {}
+
+    _async_state()
+    semaphore = asyncio.Semaphore(max(1, PANEL_MAX_CONCURRENCY))
+    stopped = {'value': False}
+
+    async def run(key, panel) -> tuple:
+        async with semaphore:
+            if stopped['value']:
+                return key, False
+            try:
+                return key, await worker(key, panel)
+            except Exception as e:
+                app.logger.warning(f'Panel worker failed for {key}: {e}')
+                return key, False
+
+    tasks = [asyncio.ensure_future(run(key, panel)) for key, panel in items]
+    results: Dict[Any, Any] = {}
+    for next_done in asyncio.as_completed(tasks):
+        key, result = await next_done
+        if not first_match:
+            results[key] = result
+        elif result:
+            stopped['value'] = True
+            for task in tasks:
+                if not task.done():
+                    _spawn_async_task(task)
+            return result
+    return results if not first_match else False
+
+async def async_check_v2ray_account(parsed_config: Dict[str, str], lang: str) -> Dict[str, Any]:
+    all_panels_to_check = get_all_panels_for_check()
+
+    async def check_panel(panel_name: str, panel_config: Dict[str, Any]) -> Union[Dict[str, Any], bool]:
+        panel_url, username, password = get_panel_credentials(panel_config)
+        if not panel_url or not username or not password:
+            return False
+        fetched = await async_fetch_panel_inbounds(panel_name, panel_url, username, password)
+        if not fetched:
+            return False
+        # Settings parsing and matching are CPU-bound, so they run off the event loop
+        return await asyncio.to_thread(match_account_on_panel, panel_name, panel_url, fetched[1], parsed_config, location)
+
+    location = lookup_client_location(CLIENT_INDEX_FIELDS[parsed_config['type']], parsed_config['value'])
+    if location and location['panel'] in all_panels_to_check:
+        result = await check_panel(location['panel'], all_panels_to_check[location['panel']])
+        if result:
+            return result
+        all_panels_to_check = {name: cfg for name, cfg in all_panels_to_check.items() if name != location['panel']}
+
+    result = await async_fan_out_panels(all_panels_to_check, check_panel)
+    if result:
+        return result
+    return {'error': t('account_not_found', lang)}
+
+async def async_check_v2ray_accounts_batch(parsed_configs: List[Dict[str, str]], lang: str) -> List[Dict[str, Any]]:
+    all_panels_to_check = get_all_panels_for_check()
+    pending = batch_lookup_keys(parsed_configs)
+
+    async def scan_panel(panel_name: str, panel_config: Dict[str, Any]) -> Dict[int, Any]:
+        panel_url, username, password = get_panel_credentials(panel_config)
+        if not panel_url or not username or not password:
+            return {}
+        fetched = await async_fetch_panel_inbounds(panel_name, panel_url, username, password)
+        if not fetched:
+            return {}
+        return await asyncio.to_thread(match_accounts_in_inbounds, panel_name, panel_url, fetched[1], pending)
+
+    panel_matches = await async_fan_out_panels(all_panels_to_check, scan_panel, first_match=False) if pending else {}
+    return merge_batch_matches(parsed_configs, all_panels_to_check, panel_matches, lang)
+
+async def _async_sweep_online_users() -> Dict[str, Any]:
+    async def fetch_online(panel_name: str, panel_config: Dict[str, Any]) -> Union[List[str], None]:
+        panel_url, username, password = get_panel_credentials(panel_config)
+        if not panel_url or not username or not password:
+            return None
+        cookie_header = await async_get_panel_session(panel_url, username, password)
+        if not cookie_header:
+            return None
+        result = await async_api_call(panel_url, cookie_header, 'xui/inbound/onlines', credentials=(username, password))
+        if not result or not result.get('success'):
+            return None
+        return [str(email) for email in (result.get('obj') or [])]
+
+    all_panels = get_all_panels_for_check()
+    results = await async_fan_out_panels(all_panels, fetch_online, first_match=False)
+    return {panel_name: results.get(panel_name) for panel_name in all_panels}
+
+async def async_get_online_users(lang: str) -> Dict[str, Any]:
+    cached = _ONLINE_USERS_CACHE
+    is_cached = time.time() - cached['computed_at'] < ONLINE_USERS_CACHE_TTL
+    if not is_cached:
+        async with _async_state()['online_lock']:
+            cached = _ONLINE_USERS_CACHE
+            is_cached = time.time() - cached['computed_at'] < ONLINE_USERS_CACHE_TTL
+            if not is_cached:
+                cached = {'computed_at': time.time(), 'panels': await _async_sweep_online_users()}
+                _ONLINE_USERS_CACHE.update(cached)
+    return format_online_users(cached, is_cached, lang)
+
+# Actions served natively on the event loop, and the order handle_request_route tries the
+# read-only actions in, so both entry points pick the same action for the same request
+ASYNC_ACTIONS = {'online', 'configs', 'config'}
+_READ_ACTION_ORDER = ('list_panels', 'pool_stats', 'panel_health', 'online', 'stats', 'analytics', 'optimal', 'configs', 'config')
+
+def select_async_action(args: Dict[str, Any]) -> Union[str, None]:
+    if not set(args) <= READ_ONLY_PARAMS | {'configs'}:
+        return None
+    for action in _READ_ACTION_ORDER:
+        if action not in args:
+            continue
+        if action == 'configs' and not isinstance(args[action], list):
+            continue
+        if action == 'config' and not args[action]:
+            continue
+        return action if action in ASYNC_ACTIONS else None
+    return None
+
+async def handle_async_action(action: str, args: Dict[str, Any]) -> tuple:
+    # The rate limiter may take an SQLite write lock; the request context is carried into the thread
+    rejection = await asyncio.to_thread(rate_limit_rejection)
+    if rejection:
+        return rejection
+    lang = get_client_language()
+
+    try:
+        if action == 'online':
+            online_result = await async_get_online_users(lang)
+            return format_api_response(online_result, not online_result.get('error'), lang), 200
+
+        if action == 'configs':
+            batch_configs = args['configs']
+            if not batch_configs or len(batch_configs) > BATCH_CHECK_MAX_CONFIGS:
+                return format_api_response({'error': f'configs must contain between 1 and {BATCH_CHECK_MAX_CONFIGS} entries.'}, False, lang), 400
+            parsed_list = await asyncio.to_thread(lambda: [parse_v2ray_config(str(item)) for item in batch_configs])
+            batch_results = await async_check_v2ray_accounts_batch(parsed_list, lang)
+            return format_api_response(format_batch_results(batch_configs, batch_results, lang), True, lang), 200
+
+        parsed = parse_v2ray_config(args['config'])
+        if 'error' in parsed:
+            return format_api_response(parsed, False, lang), 400
+        account_info = await async_check_v2ray_account(parsed, lang)
+        return format_api_response(account_info, True, lang), 200
+
+    except Exception as e:
+        import traceback
+        app.logger.error(f'API Error: {e}\n{traceback.format_exc()}')
+
+        error_response = {
+            'error': t('system_error', lang),
+            'message': f'An unexpected error occurred. Details: {str(e)}'
+        }
+        return format_api_response(error_response, False, lang), 500
+
+def _wsgi_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+    for raw_name, raw_value in scope.get('headers', []):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f'HTTP_{name}'
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+# Run a WSGI callable (the Flask app or a finished response) -> (status, headers, body)
+def _run_wsgi_request(environ: Dict[str, Any], wsgi_callable: Callable = None) -> tuple:
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'], started['headers'] = int(status.split(' ', 1)[0]), headers
+        return lambda data: None
+
+    chunks = (wsgi_callable or app)(environ, start_response)
+    try:
+        body = b''.join(chunks)
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+    return started['status'], started['headers'], body
+
+# Native async handling for account checks and online; None hands the request to Flask
+async def _dispatch_async_request(environ: Dict[str, Any]) -> Union[tuple, None]:
+    if environ['PATH_INFO'] != '/' or environ['REQUEST_METHOD'] not in ('GET', 'POST') or not load_httpx():
+        return None
+
+    with app.request_context(environ):
+        args = request.args.to_dict()
+        if request.method == 'POST':
+            input_data = request.get_json(silent=True)
+            if input_data is not None and not isinstance(input_data, dict):
+                return None
+            for key, value in (input_data or {}).items():
+                args.setdefault(key, value)
+
+        action = select_async_action(args)
+        if action is None:
+            return None
+        early_response = app.preprocess_request()
+        if early_response is not None:
+            return _run_wsgi_request(environ, app.process_response(app.make_response(early_response)))
+        response = app.process_response(app.make_response(await handle_async_action(action, args)))
+        # The response's own WSGI call drops the body of a 304 the way the Flask route would
+        return _run_wsgi_request(environ, response)
+
+async def asgi_app(scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+    _async_state()
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if httpx is not None:
+                    await close_async_http_clients()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    environ = _wsgi_environ(scope, b''.join(chunks))
+
+    handled = await _dispatch_async_request(environ)
+    if handled is None:
+        handled = await asyncio.to_thread(_run_wsgi_request, environ)
+    status, headers, body = handled
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
 # =========================================================================
 # RUN APPLICATION (For local development or Gunicorn on Vercel)
 # =========================================================================
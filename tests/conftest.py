@@ -0,0 +1,73 @@
+# Shared fixtures: main.py driven against the fake 3x-ui panels from bench/fake_panel.py.
+# State files (traffic history, notifications, drain checkpoints) go to a temporary directory.
+#
+#   python -m pytest -q
+
+import os
+import sys
+import json
+import tempfile
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, 'bench'))
+
+_WORK_DIR = tempfile.mkdtemp(prefix='v2ray-api-tests-')
+os.environ.setdefault('TRAFFIC_DB_FILE', os.path.join(_WORK_DIR, 'traffic_history.db'))
+os.environ.setdefault('NOTIFY_DB_FILE', os.path.join(_WORK_DIR, 'notifications.db'))
+os.environ.setdefault('DRAIN_CHECKPOINT_DIR', _WORK_DIR)
+os.environ['RATE_LIMIT_DB_FILE'] = ''
+
+import main
+from fake_panel import start_fake_panels
+from run_bench import configure_panels
+
+# Module-level caches that outlive a request; cleared so tests do not see each other's panels
+_STATE = (
+    'INBOUND_LIST_CACHE', 'INBOUND_SETTINGS_CACHE', 'CLIENT_INDEX', '_CLIENT_INDEX_PANEL_KEYS',
+    'PANEL_SESSION_CACHE', 'SUBSCRIPTION_CACHE', 'RATE_LIMIT_CACHE', 'CIRCUIT_BREAKERS', 'PANEL_HEALTH',
+    '_PLACEMENT_CACHE', 'SYSTEM_STATS_TOTALS', 'SYSTEM_STATS_PANELS',
+)
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    for name in _STATE:
+        getattr(main, name).clear()
+    main._ONLINE_USERS_CACHE.update(computed_at=0.0, panels={})
+    monkeypatch.setattr(main, 'RATE_LIMIT_REQUESTS_PER_MINUTE', 10 ** 9)
+    yield
+
+# start_panels(**kwargs) -> {name: (FakePanel, type)}; main.py is pointed at them and they stop after the test
+@pytest.fixture
+def start_panels():
+    started = []
+
+    def start(**kwargs):
+        fake_panels = start_fake_panels(**kwargs)
+        started.append(fake_panels)
+        configure_panels(fake_panels)
+        return fake_panels
+
+    yield start
+    for fake_panels in started:
+        for panel, _ in fake_panels.values():
+            panel.stop()
+
+@pytest.fixture
+def client():
+    return main.app.test_client()
+
+# edit_clients(panel, inbound_id, change) runs change(clients, inbound) on a fake panel inbound
+# under the panel lock and writes the settings back, like an edit made directly on the panel
+@pytest.fixture
+def edit_clients():
+    def edit(panel, inbound_id, change):
+        with panel.lock:
+            inbound = next(item for item in panel.inbounds if item['id'] == inbound_id)
+            settings = json.loads(inbound['settings'])
+            change(settings['clients'], inbound)
+            inbound['settings'] = json.dumps(settings)
+            panel._sync_stats(inbound, settings['clients'])
+    return edit
@@ -0,0 +1,53 @@
+import json
+import random
+
+import main
+from fake_panel import make_client
+
+def add_client(edit_clients, panel, inbound_id, email):
+    def change(clients, inbound):
+        clients.append(make_client(inbound['protocol'], email, 0, 10, random.Random(email)))
+    edit_clients(panel, inbound_id, change)
+
+def test_emails_differing_only_in_case_are_both_found(start_panels, edit_clients, client):
+    fake_panels = start_panels(panels=1, inbounds=4, clients=3, trial=0)
+    panel = fake_panels['Premium_1'][0]
+    add_client(edit_clients, panel, 1, 'CaseUser')
+    add_client(edit_clients, panel, 1, 'caseuser')
+
+    for email in ('CaseUser', 'caseuser'):
+        found = main.find_client_in_all_panels(email, main.PREMIUM_PANELS)
+        assert found and found['client_email'] == email
+        assert client.get(f'/?sub={email}').status_code == 200
+
+    # Config checks compare case-insensitively and return the first match, like the linear scan did
+    data = json.loads(client.get('/?config=caseuser').data)['data']
+    assert data['email'] == 'CaseUser'
+
+def test_indexed_check_reads_only_the_indexed_inbound(start_panels, client, monkeypatch):
+    start_panels(panels=2, inbounds=4, clients=5, trial=0)
+    assert json.loads(client.get('/?config=p2i3c4').data)['data']['panel_name'] == 'Premium_2'
+    location = main.CLIENT_INDEX[('email', 'p2i3c4')]
+    assert (location['panel'], location['inbound_id'], location['email']) == ('Premium_2', 3, 'p2i3c4')
+
+    def no_scan(*args):
+        raise AssertionError('indexed lookup fell back to a full scan')
+    monkeypatch.setattr(main, 'match_account_in_inbounds', no_scan)
+    assert json.loads(client.get('/?config=p2i3c4').data)['data']['email'] == 'p2i3c4'
+
+def test_stale_index_entry_falls_back_to_a_scan(start_panels, client):
+    start_panels(panels=2, inbounds=4, clients=5, trial=0)
+    client.get('/?config=p1i2c1')
+    main.CLIENT_INDEX[('email', 'p1i2c1')].update(inbound_id=4, email='p1i4c0')
+
+    data = json.loads(client.get('/?config=p1i2c1').data)['data']
+    assert data['email'] == 'p1i2c1'
+    assert data['panel_name'] == 'Premium_1'
+
+def test_created_account_is_indexed_with_its_inbound(start_panels, client):
+    start_panels(panels=2, inbounds=9, clients=2, trial=0)
+    data = json.loads(client.get('/?key=5&name=indexed_new&panel=2').data)['data']
+    assert data['email'] == 'indexed_new'
+    location = main.CLIENT_INDEX[('email', 'indexed_new')]
+    assert location['panel'] == 'Premium_2' and location['email'] == 'indexed_new'
+    assert json.loads(client.get('/?config=indexed_new').data)['data']['panel_name'] == 'Premium_2'
@@ -0,0 +1,60 @@
+import json
+import random
+import time
+
+import main
+from fake_panel import make_client
+
+def trial_clients(fake_panels):
+    panel = fake_panels['Trial_1'][0]
+    return json.loads(panel.inbounds[0]['settings'])['clients']
+
+def is_expired(client, now_ms):
+    return 0 < client['expiryTime'] <= now_ms
+
+def test_purge_keeps_clients_changed_after_the_scan(start_panels, edit_clients, monkeypatch):
+    fake_panels = start_panels(panels=1, inbounds=1, clients=30, trial=1, expired_ratio=0.5)
+    panel = fake_panels['Trial_1'][0]
+    now_ms = int(time.time() * 1000)
+    expired = [client['email'] for client in trial_clients(fake_panels) if is_expired(client, now_ms)]
+    assert len(expired) > 1
+
+    # Between the scan and the update a client is created and an expired one is renewed
+    def concurrent_writes(clients, inbound):
+        clients.append(make_client('vless', 'created_during_purge', 0, 10, random.Random(1)))
+        renewed = next(client for client in clients if client['email'] == expired[0])
+        renewed['expiryTime'] = now_ms + 86400000
+
+    fetches = []
+    fetch_panel_inbounds = main.fetch_panel_inbounds
+
+    def fetch_with_race(*args, **kwargs):
+        fetches.append(args[0])
+        if len(fetches) == 2:
+            edit_clients(panel, 1, concurrent_writes)
+        return fetch_panel_inbounds(*args, **kwargs)
+    monkeypatch.setattr(main, 'fetch_panel_inbounds', fetch_with_race)
+
+    result = main.delete_expired_trial_accounts(main.TRIAL_PANELS, 'en')
+    assert result['total_expired'] == len(expired)
+    assert result['total_deleted'] == len(expired) - 1
+
+    remaining = {client['email']: client for client in trial_clients(fake_panels)}
+    assert 'created_during_purge' in remaining
+    assert expired[0] in remaining
+    assert not any(is_expired(client, int(time.time() * 1000)) for client in remaining.values())
+
+def test_dry_run_deletes_nothing(start_panels):
+    fake_panels = start_panels(panels=1, inbounds=1, clients=20, trial=1, expired_ratio=0.5)
+    before = trial_clients(fake_panels)
+
+    result = main.delete_expired_trial_accounts(main.TRIAL_PANELS, 'en', dry_run=True)
+    assert result['total_expired'] > 0
+    assert result['total_deleted'] == 0
+    assert trial_clients(fake_panels) == before
+
+def test_limit_caps_deletions(start_panels):
+    fake_panels = start_panels(panels=1, inbounds=1, clients=40, trial=1, expired_ratio=0.5)
+    result = main.delete_expired_trial_accounts(main.TRIAL_PANELS, 'en', limit=3)
+    assert result['total_deleted'] == 3
+    assert len(trial_clients(fake_panels)) == 37
@@ -0,0 +1,60 @@
+import json
+import base64
+
+import main
+
+def test_config_check_answers_304_for_a_matching_etag(start_panels, client):
+    start_panels(panels=1, inbounds=4, clients=3, trial=0)
+    first = client.get('/?config=p1i1c1')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+
+    repeat = client.get('/?config=p1i1c1', headers={'If-None-Match': etag})
+    assert repeat.status_code == 304
+    assert repeat.data == b''
+
+    # The timestamp changes on every response but does not change the ETag
+    assert client.get('/?config=p1i1c1').headers['ETag'] == etag
+
+def test_etag_changes_with_the_account(start_panels, client):
+    fake_panels = start_panels(panels=1, inbounds=4, clients=3, trial=0)
+    etag = client.get('/?config=p1i1c1').headers['ETag']
+
+    panel = fake_panels['Premium_1'][0]
+    with panel.lock:
+        stat = next(stat for stat in panel.inbounds[0]['clientStats'] if stat['email'] == 'p1i1c1')
+        stat['up'] += 1
+    main.INBOUND_LIST_CACHE.clear()
+
+    changed = client.get('/?config=p1i1c1', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+def test_writes_get_no_etag(start_panels, client):
+    start_panels(panels=1, inbounds=9, clients=2, trial=0)
+    created = client.get('/?key=5&name=etag_write&panel=1')
+    assert created.status_code == 200
+    assert 'ETag' not in created.headers
+
+def test_subscription_etag(start_panels, client):
+    start_panels(panels=2, inbounds=9, clients=2, trial=0)
+    client.get('/?key=5&name=sub_user&panel=1')
+    first = client.get('/?sub=sub_user')
+    assert first.status_code == 200
+    assert len(base64.b64decode(first.data).decode().splitlines()) == 1
+    assert first.headers['Subscription-Userinfo'].startswith('upload=0; download=0;')
+
+    assert client.get('/?sub=sub_user', headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+
+    # A new link on another panel invalidates the cached subscription
+    client.get('/?key=5&name=sub_user&panel=2')
+    second = client.get('/?sub=sub_user', headers={'If-None-Match': first.headers['ETag']})
+    assert second.status_code == 200
+    assert len(base64.b64decode(second.data).decode().splitlines()) == 2
+
+def test_unknown_subscription_is_404(start_panels, client):
+    start_panels(panels=1, inbounds=4, clients=2, trial=0)
+    response = client.get('/?sub=nobody_here')
+    assert response.status_code == 404
+    assert json.loads(response.data)['success'] is False
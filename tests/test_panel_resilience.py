@@ -0,0 +1,96 @@
+import os
+import json
+import time
+
+import main
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    panel_url = 'http://panel.invalid:2053'
+    for _ in range(main.CIRCUIT_BREAKER_FAILURE_THRESHOLD):
+        assert main.circuit_allows(panel_url)
+        main.record_panel_result(panel_url, False)
+    assert not main.circuit_allows(panel_url)
+
+    # After the reset timeout exactly one half-open probe goes through
+    monkeypatch.setattr(main, 'CIRCUIT_BREAKER_RESET_SECONDS', 0)
+    assert main.circuit_allows(panel_url)
+    assert not main.circuit_allows(panel_url)
+
+    main.record_panel_result(panel_url, True)
+    assert main.circuit_allows(panel_url)
+    assert main.CIRCUIT_BREAKERS[panel_url]['trips'] == 1
+
+def test_dead_panel_is_skipped_once_its_breaker_is_open(start_panels):
+    fake_panels = start_panels(panels=2, inbounds=4, clients=3, trial=0, dead=1)
+    dead_url = fake_panels['Premium_1'][0].url
+    for _ in range(main.CIRCUIT_BREAKER_FAILURE_THRESHOLD):
+        assert main.api_login(dead_url, 'admin', 'admin') is False
+    assert main.CIRCUIT_BREAKERS[dead_url]['state'] == 'open'
+
+    started = time.monotonic()
+    assert main.api_login(dead_url, 'admin', 'admin') is False
+    assert time.monotonic() - started < 0.05
+
+def test_failed_login_is_cached_briefly(start_panels):
+    fake_panels = start_panels(panels=1, inbounds=4, clients=3, trial=0)
+    panel = fake_panels['Premium_1'][0]
+    assert main.get_panel_session(panel.url, 'admin', 'wrong') is False
+    assert main.get_panel_session(panel.url, 'admin', 'wrong') is False
+    assert panel.counters['login'] == 1
+
+def test_fresh_inbound_list_is_served_from_cache(start_panels):
+    fake_panels = start_panels(panels=1, inbounds=4, clients=3, trial=0)
+    panel = fake_panels['Premium_1'][0]
+    for _ in range(3):
+        assert main.fetch_panel_inbounds('Premium_1', panel.url, 'admin', 'admin')
+    assert panel.counters['list'] == 1
+
+    assert main.fetch_panel_inbounds('Premium_1', panel.url, 'admin', 'admin', fresh=True)
+    assert panel.counters['list'] == 2
+
+def test_stale_inbound_list_is_served_while_it_refreshes(start_panels, monkeypatch):
+    fake_panels = start_panels(panels=1, inbounds=4, clients=3, trial=0)
+    panel = fake_panels['Premium_1'][0]
+    first = main.fetch_panel_inbounds('Premium_1', panel.url, 'admin', 'admin')
+
+    monkeypatch.setattr(main, 'INBOUND_LIST_FRESH_SECONDS', 0)
+    stale = main.fetch_panel_inbounds('Premium_1', panel.url, 'admin', 'admin')
+    assert stale[1] is first[1]
+
+    deadline = time.monotonic() + 5
+    while panel.counters['list'] < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert panel.counters['list'] == 2
+
+def destination_emails(panel):
+    return [client['email'] for inbound in panel.inbounds for client in json.loads(inbound['settings'])['clients']]
+
+def test_drain_requires_post(start_panels, client):
+    start_panels(panels=2, inbounds=4, clients=2, trial=0)
+    assert client.get('/?drain=1&to_panel=2').status_code == 405
+    assert client.get('/?transfer=p1i1c0&from_panel=1&to_panel=2').status_code == 405
+
+def test_drain_resumes_without_its_checkpoint(start_panels, client):
+    fake_panels = start_panels(panels=2, inbounds=4, clients=5, trial=0)
+    source, destination = fake_panels['Premium_1'][0], fake_panels['Premium_2'][0]
+    moving = destination_emails(source)
+    destination_before = len(destination_emails(destination))
+
+    # The copies are added but the source removal fails: every client is reported, none is lost
+    update_inbound = source._update_inbound
+    source._update_inbound = lambda *args: (200, {'success': False, 'msg': 'injected'}, None)
+    failed = json.loads(client.post('/?drain=1&to_panel=2').data)['data']
+    assert failed['totals'] == {'added_not_removed': len(moving)}
+    assert len(destination_emails(destination)) == destination_before + len(moving)
+
+    # Resuming after the checkpoint file is gone must not add the clients a second time
+    checkpoint_path = main.drain_checkpoint_path('Premium_1', 'Premium_2')
+    assert os.path.exists(checkpoint_path)
+    os.remove(checkpoint_path)
+    source._update_inbound = update_inbound
+    resumed = json.loads(client.post('/?drain=1&to_panel=2').data)['data']
+    assert resumed['totals'] == {'moved': len(moving)}
+    assert destination_emails(source) == []
+    assert len(set(destination_emails(destination))) == destination_before + len(moving)
+    assert len(destination_emails(destination)) == destination_before + len(moving)
+    assert main.CLIENT_INDEX[('email', moving[0].lower())]['panel'] == 'Premium_2'
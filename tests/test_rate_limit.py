@@ -0,0 +1,48 @@
+import main
+
+def test_sliding_window_weights_the_previous_window(monkeypatch):
+    monkeypatch.setattr(main, 'RATE_LIMIT_REQUESTS_PER_MINUTE', 30)
+    entry = [5, 0, 0]
+    assert all(main._sliding_window_allows(entry, 5, 0.9, 1) for _ in range(30))
+    assert not main._sliding_window_allows(entry, 5, 0.9, 1)
+
+    # Halfway through the next window half of the previous count still applies
+    allowed = sum(main._sliding_window_allows(entry, 6, 0.5, 1) for _ in range(30))
+    assert allowed == 15
+
+    # Two windows later nothing from before counts
+    assert sum(main._sliding_window_allows(entry, 8, 0.0, 1) for _ in range(40)) == 30
+
+def test_costs_use_up_the_budget(monkeypatch):
+    monkeypatch.setattr(main, 'RATE_LIMIT_REQUESTS_PER_MINUTE', 30)
+    assert [main.check_rate_limit('cost-test', 10) for _ in range(4)] == [True, True, True, False]
+    # Other identifiers have their own budget
+    assert main.check_rate_limit('cost-test-other', 10)
+
+def test_request_cost_is_the_most_expensive_action():
+    with main.app.test_request_context('/?stats&delexp'):
+        assert main.get_request_cost() == main.RATE_LIMIT_ACTION_COSTS['delexp']
+    with main.app.test_request_context('/?config=someone'):
+        assert main.get_request_cost() == 1
+    with main.app.test_request_context('/', method='POST', json={'names': ['a', 'b']}):
+        assert main.get_request_cost() == main.RATE_LIMIT_ACTION_COSTS['names']
+
+def test_later_actions_are_priced():
+    for action in ('drain', 'transfer', 'names', 'notify_expiry', 'notify_send', 'collect_traffic', 'sub'):
+        assert main.RATE_LIMIT_ACTION_COSTS[action] > 1
+
+def test_cost_overrides_ignore_bad_input():
+    assert main.load_rate_limit_cost_overrides('') == {}
+    assert main.load_rate_limit_cost_overrides('{bad') == {}
+    assert main.load_rate_limit_cost_overrides('[1, 2]') == {}
+    assert main.load_rate_limit_cost_overrides('{"sub": 3, "drain": "x", "stats": true, "online": -1}') == {'sub': 3}
+
+def test_over_budget_requests_get_429(start_panels, client, monkeypatch):
+    start_panels(panels=1, inbounds=4, clients=3, trial=0)
+    monkeypatch.setattr(main, 'RATE_LIMIT_REQUESTS_PER_MINUTE', 30)
+    headers = {'X-Forwarded-For': '203.0.113.7'}
+    cost = main.RATE_LIMIT_ACTION_COSTS['stats']
+    statuses = [client.get('/?stats', headers=headers).status_code for _ in range(30 // cost + 1)]
+    assert statuses[:-1] == [200] * (30 // cost)
+    assert statuses[-1] == 429
+    assert client.get('/?stats', headers={'X-Forwarded-For': '203.0.113.8'}).status_code == 200